@@ -2,6 +2,7 @@
 
 from directionFinder_backend.correlator import Correlator
 from directionFinder_backend.scpi import SCPI
+from directionFinder_backend import calibration_store
 import numpy as np
 import matplotlib.pyplot as plt
 import logging
@@ -63,5 +64,12 @@ if __name__ == '__main__':
     offsets_json = json.dumps(offsets, indent = 2)
     with open('frequency_domain_plots.json', 'w') as f:
         f.write(offsets_json)
+    # the same phases already on the bin grid, which the correlator can map straight in
+    calibration_store.write_calibration_store(
+        'frequency_domain_plots.dfcal',
+        correlator.cross_combinations,
+        correlator.frequency_bins(),
+        {'phase_offsets': [offsets["{a}{b}".format(a = a, b = b)] for a, b in correlator.cross_combinations]},
+        offsets["metadata"])
      
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from directionFinder_backend.correlator import Correlator
+from directionFinder_backend import calibration_store
 import scipy.signal as signal
 import numpy as np
 import matplotlib.pyplot as plt
@@ -80,11 +81,17 @@ def plot_interpolated_vs_non_interpolated():
     ax.legend()
     plt.show()
 
-def do_calibration(c, write = False):
+def do_calibration(c, write = False, fetch = True):
     c.upsample_factor = 1000
     c.subsignal_length_max = 2**19
     c.time_domain_padding = 1000
-    c.do_time_domain_cross_correlation()
+    # keep some of the interpolated correlation around each peak for plotting
+    c.correlation_window = 8
+    if fetch == True:
+        # forced capture of the whole DRAM, correlated as it streams in
+        c.fetch_and_correlate_time_domain_snapshot(force=True)
+    else:
+        c.do_time_domain_cross_correlation()
     logger.info(c.time_domain_cross_correlations_peaks)
     logger.info("Step: {}".format(c.time_domain_correlations_times[(0,1)][1] - c.time_domain_correlations_times[(0,1)][0]))
     offsets = {}
@@ -97,6 +104,12 @@ def do_calibration(c, write = False):
     if write == True:
         with open('time_domain_calibration.json', 'w') as f:
             f.write(offsets_json)
+        calibration_store.write_calibration_store(
+            'time_domain_calibration.dfcal',
+            c.cross_combinations,
+            c.frequency_bins(),
+            {'time_offsets': [c.time_domain_cross_correlations_peaks[baseline] for baseline in c.cross_combinations]},
+            offsets["metadata"])
 
 
 def plot_calibration(c, insert = True):
@@ -154,7 +167,6 @@ if __name__ == '__main__':
     c = Correlator(logger = logger.getChild('correlator'))
     #c.apply_time_domain_calibration("./time_domain_calibration.json")
     #c.apply_cable_length_calibrations('../config/cable_length_calibration.json')
-    c.fetch_time_domain_snapshot(force=True)
     do_calibration(c, write = False)
     plot_calibration(c, insert = True)
 
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+from directionFinder_backend.catalogue import Catalogue
+import argparse
+import logging
+import os
+from colorlog import ColoredFormatter
+
+if __name__ == '__main__':
+    logger = logging.getLogger('main')
+    handler = logging.StreamHandler()
+    colored_formatter = ColoredFormatter("%(log_color)s%(asctime)s%(levelname)s:%(name)s:%(message)s")
+    handler.setFormatter(colored_formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = "Build or update the catalogue of a df_raw directory and query it")
+    parser.add_argument('df_raw_dir')
+    parser.add_argument('--catalogue', default=None, help = "default: catalogue.sqlite in df_raw_dir")
+    parser.add_argument('--t_start', type=float, default=None)
+    parser.add_argument('--t_stop', type=float, default=None)
+    parser.add_argument('--impulses', type=bool, default=False)
+    parser.add_argument('--frequency', type=float, default=None)
+    parser.add_argument('--tolerance', type=float, default=1e6)
+    args = parser.parse_args()
+
+    filename = args.catalogue or os.path.join(args.df_raw_dir, 'catalogue.sqlite')
+    catalogue = Catalogue(filename, logger = logger.getChild('catalogue'))
+    catalogue.add_tree(args.df_raw_dir)
+    if args.impulses == True:
+        captures = catalogue.impulses(args.t_start, args.t_stop)
+    elif args.frequency is not None:
+        captures = catalogue.near_frequency(args.frequency, args.tolerance, args.t_start, args.t_stop)
+    else:
+        captures = []
+    for capture in captures:
+        print("{t},{f},{aoa},{path},{record}".format(t = capture.t, f = capture.frequency, aoa = capture.aoa,
+                                                     path = capture.path, record = capture.record))
+    catalogue.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+from directionFinder_backend import calibration_store
+import argparse
+import logging
+from colorlog import ColoredFormatter
+
+if __name__ == '__main__':
+    logger = logging.getLogger('main')
+    handler = logging.StreamHandler()
+    colored_formatter = ColoredFormatter("%(log_color)s%(asctime)s%(levelname)s:%(name)s:%(message)s")
+    handler.setFormatter(colored_formatter)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = "Convert JSON calibrations to a binary calibration store")
+    parser.add_argument('output', help = "file to write. Should end in .dfcal")
+    parser.add_argument('--frequency_bin_file', default=None)
+    parser.add_argument('--cable_length_file', default=None)
+    parser.add_argument('--time_domain_file', default=None)
+    parser.add_argument('--interpolation', choices=['nearest', 'linear'], default='nearest')
+    parser.add_argument('--num_channels', type=int, default=4)
+    parser.add_argument('--num_bins', type=int, default=1024)
+    parser.add_argument('--fs', type=float, default=800e6)
+    args = parser.parse_args()
+
+    cross_combinations = [(a, b) for a in range(args.num_channels) for b in range(a + 1, args.num_channels)]
+    calibration_store.convert_json_calibrations(
+        args.output,
+        cross_combinations,
+        calibration_store.bin_grid(args.fs, args.num_bins),
+        frequency_bin_file = args.frequency_bin_file,
+        cable_length_file = args.cable_length_file,
+        time_domain_file = args.time_domain_file,
+        interpolation = args.interpolation)
+    logger.info("Wrote {f}".format(f = args.output))
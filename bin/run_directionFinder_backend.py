@@ -2,7 +2,13 @@
 
 from directionFinder_backend.antenna_array import AntennaArray
 from directionFinder_backend.correlator import Correlator
+from directionFinder_backend.replay_correlator import ReplayCorrelator
 from directionFinder_backend.direction_finder import DirectionFinder
+from directionFinder_backend.pipeline import Pipeline, Stage
+from directionFinder_backend.impulse_monitor import ImpulseMonitor
+from directionFinder_backend.session_recorder import SessionRecorder
+from directionFinder_backend.spectrum_codec import CODECS
+from directionFinder_backend.catalogue import Catalogue
 import logging
 from colorlog import ColoredFormatter
 import time
@@ -33,6 +39,23 @@ if __name__ == '__main__':
     parser.add_argument('--impulse_setpoint', type=int)
     parser.add_argument('--acc_len', type=int, default=40000)
     parser.add_argument('--comment', type=str)
+    parser.add_argument('--manifold_cache_dir', type=str, default=None)
+    parser.add_argument('--manifold_processes', type=int, default=None)
+    parser.add_argument('--fetch_workers', type=int, default=1)
+    parser.add_argument('--queue_len', type=int, default=8)
+    parser.add_argument('--impulse_max_poll_interval', type=float, default=0.1)
+    # 'dirs' writes a directory of .npy files per frame, as always. 'session' appends to a few large files.
+    parser.add_argument('--record_format', choices=['dirs', 'session'], default='dirs')
+    parser.add_argument('--record_codec', choices=CODECS, default='delta')
+    # play back a session index or df_raw directory instead of using the ROACH
+    parser.add_argument('--replay', type=str, default=None)
+    parser.add_argument('--replay_realtime', type=bool, default=False)
+    parser.add_argument('--replay_speed', type=float, default=1.0)
+    # also write results as binary columns which load_results can map
+    parser.add_argument('--binary_results', type=bool, default=False)
+    parser.add_argument('--calibration_cache_dir', type=str, default=None)
+    # index captures and results by time in df_raw/catalogue.sqlite as they are made
+    parser.add_argument('--catalogue', type=bool, default=False)
     args = parser.parse_args()
 
     df_raw_dir = '/home/jgowans/Documents/df_raw/{c}/'.format(c = args.comment)
@@ -40,30 +63,93 @@ if __name__ == '__main__':
         os.mkdir(df_raw_dir)
 
     array = AntennaArray.mk_from_config(args.array_geometry_file)
-    correlator = Correlator(logger = logger.getChild('correlator'))
+    if args.replay is None:
+        correlator = Correlator(logger = logger.getChild('correlator'), fetch_workers = args.fetch_workers,
+                                calibration_cache_dir = args.calibration_cache_dir)
+    else:
+        correlator = ReplayCorrelator(args.replay, realtime = args.replay_realtime, speed = args.replay_speed,
+                                      calibration_cache_dir = args.calibration_cache_dir,
+                                      logger = logger.getChild('replay_correlator'))
     correlator.set_accumulation_len(args.acc_len)
     correlator.add_cable_length_calibrations('/home/jgowans/workspace/directionFinder_backend/config/cable_length_calibration_actual_array.json')
     correlator.add_frequency_bin_calibrations('/home/jgowans/workspace/directionFinder_backend/config/frequency_domain_calibration_through_chain.json')
-    df = DirectionFinder(correlator, array, args.f_start, logger.getChild('df'))
+    catalogue = None
+    if args.catalogue == True:
+        # indexes captures and results by time as they are made. See catalogue_df_raw.py
+        catalogue = Catalogue(os.path.join(df_raw_dir, 'catalogue.sqlite'), logger = logger.getChild('catalogue'))
+    df = DirectionFinder(correlator, array, args.f_start, logger.getChild('df'),
+                         manifold_cache_dir = args.manifold_cache_dir,
+                         binary_results = args.binary_results,
+                         catalogue = catalogue)
+
+    if args.impulse == False:
+        df.precompute_band(args.f_start, args.f_stop, args.manifold_processes)
 
     if args.impulse == True:
         df.set_time()  # go into time mode
+        # only correlate over the lags the array can produce
+        correlator.set_array(array)
         # 100 impulse filter len = 0.5 us
         correlator.set_impulse_filter_len(100)
         correlator.set_impulse_setpoint(args.impulse_setpoint)
         correlator.re_sync()
         time.sleep(0.1)
-        correlator.impulse_arm()
+        monitor = ImpulseMonitor(correlator, max_interval = args.impulse_max_poll_interval,
+                                 logger = logger.getChild('impulse_monitor'))
+        monitor.arm()
+
+    if args.replay is not None:
+        # it's already recorded
+        args.record_format = None
+    if args.record_format == 'session':
+        recorder = SessionRecorder(df_raw_dir, codec = args.record_codec, catalogue = catalogue,
+                                   logger = logger.getChild('session_recorder'))
 
-    while True:
-        if args.impulse == True:
-            if df.fetch_impulse() == True:
-                correlator.save_time_domain_snapshots(df_raw_dir)
-                # not necessary to apply cal as it's done in the correlation routine
-                df.df_impulse(df_raw_dir)
-        else:
+    if args.impulse == True:
+        acquire = monitor.poll
+        def record(frame):
+            if args.record_format == 'session':
+                recorder.record(frame)
+            elif args.record_format == 'dirs':
+                correlator.save_time_domain_snapshots(df_raw_dir, frame)
+                if catalogue is not None:
+                    catalogue.add_frame(frame, "{base}/{sub}".format(base = df_raw_dir, sub = frame.t))
+        def direction_find(frame):
+            # not necessary to apply cal as it's done in the correlation routine
+            df.df_impulse(df_raw_dir, frame = frame)
+            monitor.record_result(frame)
+    else:
+        def acquire():
             df.fetch_frequency_crosses()
-            correlator.save_frequency_correlations(df_raw_dir)
-            correlator.apply_frequency_domain_calibrations()
-            df.df_strongest_signal(args.f_start, args.f_stop, df_raw_dir)
+            return correlator.frequency_frame()
+        def record(frame):
+            if args.record_format == 'session':
+                recorder.record(frame)
+            elif args.record_format == 'dirs':
+                correlator.save_frequency_correlations(df_raw_dir, frame)
+                if catalogue is not None:
+                    catalogue.add_frame(frame, "{base}/{sub}".format(base = df_raw_dir, sub = frame.t))
+        def direction_find(frame):
+            # a calibrated copy. The recorder may not have written the raw frame yet.
+            calibrated = correlator.apply_frequency_domain_calibrations(frame)
+            df.df_strongest_signal(args.f_start, args.f_stop, df_raw_dir, frame = calibrated)
 
+    # the recorder holds up acquisition rather than lose data. The DF stage drops
+    # frames if it can't keep up, except when replaying where every frame counts.
+    stages = [Stage('df', direction_find, maxsize = args.queue_len, block = args.replay is not None,
+                    logger = logger.getChild('df_stage'))]
+    if args.record_format is not None:
+        stages.insert(0, Stage('recorder', record, maxsize = args.queue_len, block = True,
+                               logger = logger.getChild('recorder')))
+    pipeline = Pipeline(
+        acquire = acquire,
+        stages = stages,
+        logger = logger.getChild('pipeline'))
+    pipeline.run()
+    df.close()
+    if args.record_format == 'session':
+        recorder.close()
+    if catalogue is not None:
+        catalogue.close()
+    if args.impulse == True:
+        monitor.log_stats()
@@ -7,22 +7,34 @@ import logging
 import time
 from colorlog import ColoredFormatter
 from directionFinder_backend.signal_generator import SignalGenerator
+from directionFinder_backend.monte_carlo import MonteCarloRunner
+import argparse
 
-def run_single_sim(siggen):
-    accumulated_phase = np.ndarray((INTEGRATIONS))
-    vacc = np.complex(0)
-    for integration_num in range(INTEGRATIONS):
-        if integration_num % 100000 == 0:
-            logger.info(integration_num)
-        siggen.fetch_crosses()
-        vacc += siggen.frequency_correlations[(0,1)].bin_at_freq(FREQUENCY)
-        accumulated_phase[integration_num] = np.angle(vacc)
-    return accumulated_phase
+INTEGRATIONS = 400000
+FREQUENCY = 0.2002
+PHASE_SHIFT = 1.234
+# integrations generated at once. Bounds memory to about CHUNK_SIZE * 100 kB.
+CHUNK_SIZE = 1000
 
-if __name__ == '__main__':
-    INTEGRATIONS = 400000
-    FREQUENCY = 0.2002
+def run_single_sim(snr, rng):
+    """ Unwrapped phase of the 0x1 cross at FREQUENCY after each integration
+    """
+    siggen = SignalGenerator(tone_freq = FREQUENCY,
+                             num_channels = 2,
+                             snr = snr,
+                             phase_shifts=np.array((PHASE_SHIFT, 0)),
+                             amplitude_scales=np.ones(2),
+                             rng = rng)
+    # running sum of the 0x1 cross at FREQUENCY after each integration
+    vacc = siggen.accumulate_crosses(INTEGRATIONS, bins = [siggen.bin_index(FREQUENCY)],
+                                     chunk_size = CHUNK_SIZE)
+    result = np.angle(vacc[:, siggen.cross_combinations.index((0, 1)), 0])
+    result = result[::-1]
+    result = np.unwrap(result)
+    result = result[::-1]
+    return result
 
+if __name__ == '__main__':
     # setup root logger. Shouldn't be used much but will catch unexpected messages
     colored_formatter = ColoredFormatter("%(log_color)s%(asctime)s:%(levelname)s:%(name)s:%(message)s")
     handler = logging.StreamHandler()
@@ -46,44 +58,32 @@ if __name__ == '__main__':
     logger.info("Logger info")
     logger.warn("Logger warning")
 
-    siggen = SignalGenerator(tone_freq = FREQUENCY, 
-                             num_channels = 2, 
-                             snr = 1, 
-                             phase_shifts=np.array((0, 1.234)),
-                             amplitude_scales=np.ones(2))
+    parser = argparse.ArgumentParser(description = "Simulate phase error against integration time")
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    # keep results here to resume an interrupted sweep
+    parser.add_argument('--results_file', type=str, default=None)
+    args = parser.parse_args()
+
+    snrs = [0.1, 0.03, 0.01, 0.003, 0.001]
+    runner = MonteCarloRunner(run_single_sim, snrs, args.runs, INTEGRATIONS,
+                              seed = args.seed, processes = args.processes,
+                              results_file = args.results_file,
+                              logger = logger.getChild('monte_carlo'))
+    results = runner.run()
+    rms = runner.rms_error(PHASE_SHIFT)
 
     fig_rmserr, ax_rmserr = plt.subplots()
-    for snr in [0.1, 0.03, 0.01, 0.003, 0.001]:
-        siggen = SignalGenerator(tone_freq = FREQUENCY, 
-                                 num_channels = 2, 
-                                 snr = snr,
-                                 phase_shifts=np.array((1.234, 0)),
-                                 amplitude_scales=np.ones(2))
-        logging.info("SNR: {}".format(snr))
-        results = []
-        for run in range(30):
-            logging.info("Run: {}".format(run))
-            result = run_single_sim(siggen)
-            result = result[::-1]
-            result = np.unwrap(result)
-            result = result[::-1]
-            results.append(result)
+    for snr_idx, snr in enumerate(snrs):
         fig, ax0 = plt.subplots()
-        for result in results[0:5]:
-            ax0.loglog(np.abs(result - 1.234))  # error rather than absolute
+        for result in results[snr_idx, 0:5]:
+            ax0.loglog(np.abs(result - PHASE_SHIFT))  # error rather than absolute
         ax0.set_ylabel("Phase output (radians)")
         ax0.set_title("Integrations vs correlator phase output for SNR = {snr}".format(snr = snr))
         ax0.set_xlabel("Integration number")
         plt.axhline(0)
-        errors = [result - 1.234 for result in results]
-        errors = [((e + np.pi) % (2*np.pi)) - np.pi for e in errors]
-        errors_squared = [np.square(e) for e in errors]
-        sum_squared = np.zeros(errors_squared[0].shape)
-        for error_squared in errors_squared:
-            sum_squared += error_squared
-        sum_squared /= len(results)
-        rms = np.sqrt(sum_squared)
-        ax_rmserr.loglog(rms, label="{snr}".format(snr = snr))
+        ax_rmserr.loglog(rms[snr_idx], label="{snr}".format(snr = snr))
     ax_rmserr.set_ylabel("RMS Error (radians)")
     ax_rmserr.set_title("Phase RMS error for various SNR")
     ax_rmserr.set_xlabel("Integration number")
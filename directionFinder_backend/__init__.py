@@ -4,6 +4,17 @@ __all__ = ['antenna_array',
            'direction_finder',
            'snapshot',
            'control_register',
+           'manifold_cache',
+           'frame',
+           'pipeline',
+           'impulse_monitor',
+           'session_recorder',
+           'replay_correlator',
+           'results_writer',
+           'calibration_store',
+           'spectrum_codec',
+           'catalogue',
+           'monte_carlo',
            ]
 
 def foobar():
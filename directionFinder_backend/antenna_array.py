@@ -9,6 +9,15 @@ class AntennaArray:
         """ antennas is a list of Antenna type objects
         """
         self.antennas = antennas
+        # (N x 2) array of element positions, one row of [x, y] per antenna
+        self.positions = np.array([[ant.x, ant.y] for ant in antennas],
+                                  dtype = np.float64).reshape(len(antennas), 2)
+        # (baselines x 2) array of antenna indices, in the same order as each_pair
+        self.baselines = np.array(list(itertools.combinations(range(len(antennas)), 2)),
+                                  dtype = int).reshape(-1, 2)
+        # (baselines x 2) array of the vector from antenna b to antenna a for each pair
+        self.baseline_vectors = self.positions[self.baselines[:, 0]] - \
+                                self.positions[self.baselines[:, 1]]
 
     @classmethod
     def mk_from_config(cls, array_geometry_file):
@@ -50,37 +59,60 @@ class AntennaArray:
         self.current += 1
         return self.antennas[self.current - 1]
 
+    def aperture(self):
+        """ The longest baseline in metres
+        """
+        return np.max(self.max_time_differences(c = 1))
+
+    def max_time_differences(self, c=scipy.constants.c):
+        """ The largest TDOA each baseline can see, which is for a source in line with it
+        """
+        return np.hypot(self.baseline_vectors[:, 0], self.baseline_vectors[:, 1]) / c
+
+    def angles_required(self, f, samples_per_cycle=8, minimum=16, c=scipy.constants.c):
+        """ How many angles around the circle a manifold needs so that no baseline's
+        phase moves by more than 1/samples_per_cycle of a cycle between neighbours.
+        The phase of a baseline of length d changes by at most 2*pi*f*d/c radians
+        per radian of arrival angle.
+        """
+        max_phase_rate = 2*np.pi * f * self.aperture() / c
+        return max(minimum, int(np.ceil(samples_per_cycle * max_phase_rate)))
+
     def each_pair(self):
         pairs = itertools.combinations(self.antennas, 2)
         for pair in pairs:
             yield pair
 
     def each_pair_phase_difference_at_angle(self, phi, f):
-        phases_of_pairs = np.array([])
-        for ant0, ant1 in self.each_pair():
-            phases_of_pairs = np.append(
-                phases_of_pairs,
-                self.phase_difference_between_two_antennas_at_angle(
-                    ant0, 
-                    ant1, 
-                    phi, 
-                    f
-                )
-            )
-        return phases_of_pairs
+        return self.each_pair_phase_difference_at_angles(phi, f)[0]
 
     def each_pair_time_difference_at_angle(self, phi):
-        times_of_pairs = np.array([])
-        for ant0, ant1 in self.each_pair():
-            times_of_pairs = np.append(
-                times_of_pairs,
-                self.time_difference_between_two_antennas_at_angle(
-                    ant0,
-                    ant1,
-                    phi
-                )
-            )
-        return times_of_pairs
+        return self.each_pair_time_difference_at_angles(phi)[0]
+
+    def each_pair_path_difference_at_angles(self, phis):
+        """ Returns an (angles x baselines) array of how much closer antenna a
+        is to a source at each angle than antenna b is, for each pair (a, b).
+        This is ant_a.rotated_distance(phi) - ant_b.rotated_distance(phi), done
+        for all angles and pairs in one go.
+        """
+        phis = np.atleast_1d(np.asarray(phis, dtype = np.float64))
+        directions = np.array([np.cos(phis), np.sin(phis)])  # 2 x angles
+        return directions.T.dot(self.baseline_vectors.T)
+
+    def each_pair_phase_difference_at_angles(self, phis, f, c=scipy.constants.c):
+        """ Returns an (angles x baselines) array of phase differences in the
+        range -pi to pi. Row i is what each_pair_phase_difference_at_angle
+        would give for phis[i].
+        """
+        phases = self.each_pair_path_difference_at_angles(phis) * (2*np.pi * f/c)
+        # force phase to range from -pi to pi
+        return np.mod(phases + np.pi, 2*np.pi) - np.pi
+
+    def each_pair_time_difference_at_angles(self, phis, c=scipy.constants.c):
+        """ Returns an (angles x baselines) array of time differences of arrival.
+        Row i is what each_pair_time_difference_at_angle would give for phis[i].
+        """
+        return self.each_pair_path_difference_at_angles(phis) / c
 
     def phase_difference_between_two_antennas_at_angle(self, antA, antB, phi, f):
         """Implements antB.phase - antA.phase"""
@@ -0,0 +1,219 @@
+"""
+A binary file holding calibrations already resampled onto the correlator's
+frequency bins, so applying them is a memory map rather than parsing JSON and
+interpolating. Also converts the JSON calibrations and caches the result by the
+hash of what it was made from.
+
+Layout: MAGIC, a little endian uint16 version, a little endian uint32 header
+length, the JSON header padded to ALIGNMENT and then each array as little
+endian float64, each starting on an ALIGNMENT boundary. The header gives the
+baselines, bin grid and each array's shape and offset.
+
+Arrays, all in cross_combinations order:
+phase_offsets -- (baselines x bins) frequency bin calibration phases
+cable_phase_offsets -- (baselines x bins) phases from the cable lengths
+time_offsets -- (baselines) time domain calibration
+cable_time_offsets -- (baselines) delays from the cable lengths
+"""
+
+import numpy as np
+from correlation import resample_calibration_phases
+import collections
+import hashlib
+import json
+import logging
+import os
+import scipy.constants
+import struct
+
+MAGIC = b'DFCAL\x00'
+VERSION = 1
+ALIGNMENT = 64
+EXTENSION = '.dfcal'
+
+def bin_grid(fs, num_bins):
+    """ The frequency of each bin as Correlation has it
+    """
+    return np.linspace(np.uint64(0), np.uint64(fs/2), num_bins, endpoint = False)
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def write_calibration_store(filename, cross_combinations, frequency_bins, arrays, metadata=None):
+    """ Writes arrays, a dict of name -> array, to filename
+    """
+    header = {
+        'version': VERSION,
+        'cross_combinations': [list(comb) for comb in cross_combinations],
+        'num_bins': len(frequency_bins),
+        'f_start': float(frequency_bins[0]),
+        'f_stop': float(frequency_bins[-1]),
+        'metadata': metadata or {},
+        'arrays': {},
+    }
+    # offsets depend on the header length, which depends on the offsets. Leave
+    # room for them to grow by a few digits.
+    prefix_len = len(MAGIC) + 6
+    arrays = collections.OrderedDict((name, np.ascontiguousarray(array, dtype = '<f8'))
+                                     for name, array in sorted(arrays.items()))
+    for name, array in arrays.items():
+        header['arrays'][name] = {'shape': list(array.shape), 'offset': 0}
+    data_start = aligned(prefix_len + len(json.dumps(header)) + 16*len(arrays))
+    offset = data_start
+    for name, array in arrays.items():
+        header['arrays'][name]['offset'] = offset
+        offset = aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+    assert(prefix_len + len(header_bytes) <= data_start)
+    header_bytes += b' ' * (data_start - prefix_len - len(header_bytes))
+    # write then rename so a reader never sees a partial file
+    tmp_filename = "{f}.{pid}.tmp".format(f = filename, pid = os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<HI', VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+    os.rename(tmp_filename, filename)
+
+
+class CalibrationStore:
+    def __init__(self, filename):
+        """ Opens a file written by write_calibration_store. The arrays are
+        memory mapped read only.
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{f} is not a calibration store".format(f = filename))
+            version, header_len = struct.unpack('<HI', f.read(6))
+            if version > VERSION:
+                raise ValueError("{f} is version {v}. Only up to {s} is supported".format(
+                    f = filename, v = version, s = VERSION))
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+        self.cross_combinations = [tuple(comb) for comb in self.header['cross_combinations']]
+        self.arrays = {}
+        for name, layout in self.header['arrays'].items():
+            self.arrays[name] = np.memmap(filename, dtype = '<f8', mode = 'r',
+                                          offset = layout['offset'], shape = tuple(layout['shape']))
+
+    def matches(self, cross_combinations, frequency_bins):
+        """ True if the store is for these baselines and bins
+        """
+        return (self.cross_combinations == list(cross_combinations) and
+                self.header['num_bins'] == len(frequency_bins) and
+                np.isclose(self.header['f_start'], frequency_bins[0]) and
+                np.isclose(self.header['f_stop'], frequency_bins[-1]))
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+
+def frequency_bin_calibration_arrays(filename, cross_combinations, frequency_bins, interpolation='nearest'):
+    """ phase_offsets from a JSON frequency bin calibration as written by the
+    calibrate_frequency_domain scripts
+    """
+    with open(filename) as f:
+        offsets = json.load(f)
+    return {'phase_offsets': np.array([
+        resample_calibration_phases(frequency_bins, offsets['axis'],
+                                    offsets["{a}{b}".format(a = a, b = b)], interpolation)
+        for a, b in cross_combinations])}
+
+def cable_length_calibration_arrays(filename, cross_combinations, frequency_bins):
+    """ cable_phase_offsets and cable_time_offsets from a JSON file of cable
+    lengths and velocity factors, as Correlator.add_cable_length_calibrations
+    """
+    with open(filename) as f:
+        cables = json.load(f)
+    delays = dict((int(chan), cable['length'] / (scipy.constants.c * cable['velocity factor']))
+                  for chan, cable in cables.items())
+    # b delayed from a by a positive amount will mean that the (a, b) correlation
+    # peak will be more positive than it should be
+    time_offsets = np.array([delays[b] - delays[a] for a, b in cross_combinations])
+    return {'cable_phase_offsets': 2*np.pi * -time_offsets[:, np.newaxis] * frequency_bins,
+            'cable_time_offsets': time_offsets}
+
+def time_domain_calibration_arrays(filename, cross_combinations):
+    """ time_offsets from a JSON time domain calibration as written by
+    calibrate_time_domain.py
+    """
+    with open(filename) as f:
+        offsets = json.load(f)
+    return {'time_offsets': np.array([offsets["{a}x{b}".format(a = a, b = b)]
+                                      for a, b in cross_combinations])}
+
+def convert_json_calibrations(filename, cross_combinations, frequency_bins, frequency_bin_file=None,
+                              cable_length_file=None, time_domain_file=None, interpolation='nearest'):
+    """ Writes a store at filename with whichever of the JSON calibrations are given
+    """
+    arrays = {}
+    sources = {}
+    if frequency_bin_file is not None:
+        arrays.update(frequency_bin_calibration_arrays(frequency_bin_file, cross_combinations,
+                                                       frequency_bins, interpolation))
+        sources['frequency_bin_file'] = frequency_bin_file
+        sources['interpolation'] = interpolation
+    if cable_length_file is not None:
+        arrays.update(cable_length_calibration_arrays(cable_length_file, cross_combinations, frequency_bins))
+        sources['cable_length_file'] = cable_length_file
+    if time_domain_file is not None:
+        arrays.update(time_domain_calibration_arrays(time_domain_file, cross_combinations))
+        sources['time_domain_file'] = time_domain_file
+    write_calibration_store(filename, cross_combinations, frequency_bins, arrays, {'sources': sources})
+
+
+class CalibrationCache:
+    def __init__(self, cache_dir=None, logger=logging.getLogger(__name__)):
+        """ Remembers stores built from JSON calibrations by the hash of the JSON
+        file's contents and everything it was resampled with.
+        cache_dir -- where to keep the stores between runs. None only remembers
+            them in this process.
+        """
+        self.logger = logger
+        self.cache_dir = cache_dir
+        # key -> dict of name -> array
+        self.stores = {}
+        if self.cache_dir is not None and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, filename, cross_combinations, frequency_bins, *args):
+        h = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+        h.update(json.dumps([list(comb) for comb in cross_combinations]).encode('ascii'))
+        h.update(np.ascontiguousarray(frequency_bins, dtype = np.float64).tobytes())
+        h.update(json.dumps(args).encode('ascii'))
+        return h.hexdigest()[0:16]
+
+    def filename(self, key):
+        return os.path.join(self.cache_dir, "{k}{e}".format(k = key, e = EXTENSION))
+
+    def get(self, key):
+        if key in self.stores:
+            return self.stores[key]
+        if self.cache_dir is not None and os.path.exists(self.filename(key)):
+            self.stores[key] = CalibrationStore(self.filename(key)).arrays
+            self.logger.debug("Loaded calibration {k} from {d}".format(k = key, d = self.cache_dir))
+            return self.stores[key]
+        return None
+
+    def put(self, key, cross_combinations, frequency_bins, arrays):
+        if self.cache_dir is not None:
+            write_calibration_store(self.filename(key), cross_combinations, frequency_bins, arrays)
+        self.stores[key] = arrays
+
+    def frequency_bin_calibration(self, filename, cross_combinations, frequency_bins, interpolation='nearest'):
+        """ frequency_bin_calibration_arrays, only parsed and resampled the first
+        time a file with these contents is seen
+        """
+        key = self.key(filename, cross_combinations, frequency_bins, 'frequency_bin', interpolation)
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = frequency_bin_calibration_arrays(filename, cross_combinations, frequency_bins, interpolation)
+            self.put(key, cross_combinations, frequency_bins, arrays)
+        return arrays
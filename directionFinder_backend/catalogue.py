@@ -0,0 +1,299 @@
+"""
+An SQLite index of recorded captures by time, so finding them doesn't mean
+listing df_raw and parsing directory names. Each capture has its time, whether
+it was an impulse, where it was recorded and, once it has been DFed, the
+frequency, AoA and quality of the result.
+
+Frames are added as they are recorded and results as they are written, in
+whichever order they arrive. A catalogue can also be built, or brought up to
+date, from existing df_raw trees.
+
+path is a session's .json index with record the frame's index in the session,
+or a per-frame directory with record NULL. Results with no recorded frame have
+a NULL path.
+
+Results are matched to captures by the nearest time within match_tolerance
+rather than exactly, as per-frame directory names and results.txt files written
+before it kept full precision only have 12 significant digits of the time.
+"""
+
+from results_writer import COLUMNS, column_filename, load_results
+from session_recorder import SessionReader, session_indexes
+from frame import ImpulseFrame
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    t REAL NOT NULL,
+    impulse INTEGER NOT NULL,
+    path TEXT,
+    record INTEGER,
+    frequency REAL,
+    aoa REAL,
+    quality REAL
+);
+CREATE INDEX IF NOT EXISTS captures_t ON captures (t);
+CREATE INDEX IF NOT EXISTS captures_impulse_t ON captures (impulse, t);
+CREATE INDEX IF NOT EXISTS captures_frequency ON captures (frequency);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+Capture = collections.namedtuple('Capture', ['t', 'impulse', 'path', 'record', 'frequency', 'aoa', 'quality'])
+
+def read_text_results(filename, skip=0, logger=logging.getLogger(__name__)):
+    """ (t, frequency, aoa, quality) rows from a results.txt after the first
+    skip lines, and how many lines were read. Impulse results have no frequency
+    and no quality is recorded. Malformed lines are skipped but counted as read.
+    A last line without its newline is still being written so isn't read.
+    """
+    rows = []
+    consumed = 0
+    with open(filename) as f:
+        for line_num, line in enumerate(f):
+            if line_num < skip:
+                continue
+            if not line.endswith('\n'):
+                break
+            consumed += 1
+            try:
+                fields = [float(field) for field in line.strip().split(',')]
+            except ValueError:
+                fields = []
+            if len(fields) == 3:
+                rows.append((fields[0], fields[1], fields[2], None))
+            elif len(fields) == 2:
+                rows.append((fields[0], None, fields[1], None))
+            else:
+                logger.warning("Skipping line {n} of {f}: {l}".format(
+                    n = line_num + 1, f = filename, l = line.strip()))
+    return rows, consumed
+
+
+class Catalogue:
+    def __init__(self, filename, commit_interval=5, match_tolerance=0.01, logger=logging.getLogger(__name__)):
+        """
+        filename -- the SQLite database. Made if it doesn't exist.
+        commit_interval -- seconds between committing what's been added. Queries
+            from other processes only see committed captures.
+        match_tolerance -- seconds apart a result and a capture can be and
+            still be matched
+        """
+        self.logger = logger
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.match_tolerance = match_tolerance
+        # the recorder and results writer add from their own threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        # lets other processes query while this one writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+        self.last_commit = time.time()
+
+    def maybe_commit(self):
+        if time.time() - self.last_commit > self.commit_interval:
+            self.connection.commit()
+            self.last_commit = time.time()
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.last_commit = time.time()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def nearest(self, t, impulse, condition):
+        """ id of the capture nearest t within match_tolerance which meets
+        condition, or None
+        """
+        row = self.connection.execute(
+            "SELECT id FROM captures WHERE t >= ? AND t <= ? AND impulse = ? AND " + condition +
+            " ORDER BY abs(t - ?) LIMIT 1",
+            (t - self.match_tolerance, t + self.match_tolerance, int(impulse), t)).fetchone()
+        return None if row is None else row[0]
+
+    def add_capture(self, t, impulse, path, record=None):
+        """ Adds a recorded capture, or fills in where it was recorded if its
+        result got here first
+        """
+        capture_id = self.nearest(t, impulse, "path IS NULL")
+        if capture_id is not None:
+            # the capture's own time rather than the result's, which may be rounded
+            self.connection.execute("UPDATE captures SET t = ?, path = ?, record = ? WHERE id = ?",
+                                    (t, path, record, capture_id))
+        else:
+            self.connection.execute(
+                "INSERT INTO captures (t, impulse, path, record) VALUES (?, ?, ?, ?)",
+                (t, int(impulse), path, record))
+
+    def add_result(self, t, frequency, aoa, quality):
+        """ Adds a result to the capture at t, or a capture for it if the frame
+        hasn't been added yet. frequency is None for impulses.
+        """
+        impulse = int(frequency is None)
+        capture_id = self.nearest(t, impulse, "aoa IS NULL")
+        if capture_id is not None:
+            self.connection.execute("UPDATE captures SET frequency = ?, aoa = ?, quality = ? WHERE id = ?",
+                                    (frequency, aoa, quality, capture_id))
+        else:
+            self.connection.execute(
+                "INSERT INTO captures (t, impulse, frequency, aoa, quality) VALUES (?, ?, ?, ?, ?)",
+                (t, impulse, frequency, aoa, quality))
+
+    def add_frame(self, frame, path, record=None):
+        """ Adds frame, a FrequencyFrame or ImpulseFrame, recorded to path
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            self.add_capture(frame.t, isinstance(frame, ImpulseFrame), path, record)
+            # so add_tree doesn't add it again
+            self.set_source_count(path, 1 if record is None else record + 1)
+            self.maybe_commit()
+
+    def add_results(self, rows, source=None, count=None):
+        """ Adds the (t, frequency, aoa, quality) rows ResultsWriter writes.
+        source and count say which file they went to and how many rows it now
+        has, so add_tree doesn't add them again.
+        """
+        with self.lock:
+            for t, frequency, aoa, quality in rows:
+                self.add_result(t, frequency, aoa, quality)
+            if source is not None:
+                self.set_source_count(os.path.abspath(source), count)
+            self.maybe_commit()
+
+    def source_count(self, path):
+        """ How much of path has already been catalogued
+        """
+        row = self.connection.execute("SELECT count FROM sources WHERE path = ?", (path,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def set_source_count(self, path, count):
+        self.connection.execute("INSERT OR REPLACE INTO sources (path, count) VALUES (?, ?)", (path, count))
+
+    def add_session(self, index_filename):
+        """ Adds the records of a session not already catalogued. Only reads
+        the record times.
+        """
+        index_filename = os.path.abspath(index_filename)
+        reader = SessionReader(index_filename)
+        with self.lock:
+            done = self.source_count(index_filename)
+            times = reader.times()
+            if len(times) <= done:
+                # a live recorder may have catalogued records its index hasn't synced
+                return 0
+            for record in range(done, len(times)):
+                self.add_capture(float(times[record]), reader.kind == 'impulse', index_filename, record)
+            self.set_source_count(index_filename, len(times))
+        return len(times) - done
+
+    def add_directories(self, path):
+        """ Adds the per-frame directories in path not already catalogued. A
+        directory is a frequency frame if it has a 0x1 correlation.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            known = set(row[0] for row in self.connection.execute(
+                "SELECT path FROM sources WHERE path LIKE ?", (os.path.join(path, '%'),)))
+            added = 0
+            for name in os.listdir(path):
+                full_dir = os.path.join(path, name)
+                if full_dir in known or not os.path.isdir(full_dir):
+                    continue
+                try:
+                    t = float(name)
+                except ValueError:
+                    continue
+                impulse = not os.path.exists(os.path.join(full_dir, '0x1.npy'))
+                self.add_capture(t, impulse, full_dir)
+                self.set_source_count(full_dir, 1)
+                added += 1
+        return added
+
+    def add_results_from(self, log_dir):
+        """ Adds the results in log_dir not already catalogued. The binary
+        columns are used if there are any as they have the quality.
+        """
+        log_dir = os.path.abspath(log_dir)
+        if all(os.path.exists(column_filename(log_dir, column)) for column in COLUMNS):
+            source = column_filename(log_dir, 't')
+            results = load_results(log_dir)
+            done = self.source_count(source)
+            rows = []
+            for idx in range(done, len(results['t'])):
+                row = [float(results[column][idx]) for column in COLUMNS]
+                # NaN frequency marks an impulse
+                rows.append([None if value != value else value for value in row])
+            count = len(results['t'])
+        elif os.path.exists(os.path.join(log_dir, 'results.txt')):
+            source = os.path.join(log_dir, 'results.txt')
+            done = self.source_count(source)
+            rows, consumed = read_text_results(source, skip = done, logger = self.logger)
+            count = done + consumed
+        else:
+            return 0
+        with self.lock:
+            for t, frequency, aoa, quality in rows:
+                self.add_result(t, frequency, aoa, quality)
+            self.set_source_count(source, count)
+        return len(rows)
+
+    def add_tree(self, path):
+        """ Brings the catalogue up to date with a df_raw directory: its
+        sessions, per-frame directories and results
+        """
+        added = 0
+        for index_filename in session_indexes(path):
+            added += self.add_session(index_filename)
+        added += self.add_directories(path)
+        added += self.add_results_from(path)
+        self.commit()
+        self.logger.info("Catalogued {n} new captures and results from {p}".format(n = added, p = path))
+        return added
+
+    def captures(self, t_start=None, t_stop=None, impulse=None, f_start=None, f_stop=None, limit=None):
+        """ Captures between t_start and t_stop, optionally only impulses (True)
+        or frequency frames (False) and only those DFed between f_start and
+        f_stop Hz. Sorted by time. Bounds left as None aren't applied.
+        """
+        conditions = []
+        params = []
+        for clause, value in [("t >= ?", t_start), ("t < ?", t_stop),
+                              ("impulse = ?", None if impulse is None else int(impulse)),
+                              ("frequency >= ?", f_start), ("frequency < ?", f_stop)]:
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        query = "SELECT t, impulse, path, record, frequency, aoa, quality FROM captures"
+        if len(conditions) > 0:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY t"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [Capture(t, bool(imp), path, record, frequency, aoa, quality)
+                for t, imp, path, record, frequency, aoa, quality in rows]
+
+    def impulses(self, t_start=None, t_stop=None):
+        return self.captures(t_start, t_stop, impulse = True)
+
+    def near_frequency(self, frequency, tolerance=1e6, t_start=None, t_stop=None):
+        """ Frequency domain detections within tolerance Hz of frequency
+        """
+        return self.captures(t_start, t_stop, impulse = False,
+                             f_start = frequency - tolerance, f_stop = frequency + tolerance)
@@ -8,6 +8,30 @@ from snapshot import Snapshot
 import scipy.constants
 import logging
 
+def resample_calibration_phases(frequency_bins, frequencies, phases, interpolation='nearest'):
+    """ Maps a table of calibration phases at frequencies onto frequency_bins.
+    interpolation is as per Correlation.add_frequency_bin_calibration
+    """
+    assert(len(frequencies) == len(phases))
+    frequencies = np.asarray(frequencies, dtype = np.float64)
+    phases = np.asarray(phases, dtype = np.float64)
+    # sorted, and where a frequency is repeated the first phase given for it wins
+    frequencies, first = np.unique(frequencies, return_index = True)
+    phases = phases[first]
+    if len(frequencies) == 1:
+        return np.repeat(phases, len(frequency_bins))
+    elif interpolation == 'nearest':
+        # the table frequencies either side of each bin
+        above = np.clip(np.searchsorted(frequencies, frequency_bins), 1, len(frequencies) - 1)
+        below = above - 1
+        # ties go to the lower frequency
+        use_below = (frequency_bins - frequencies[below]) <= (frequencies[above] - frequency_bins)
+        return phases[np.where(use_below, below, above)]
+    elif interpolation == 'linear':
+        # unwrap first otherwise interpolating across the -pi/pi wrap goes the long way round
+        return np.interp(frequency_bins, frequencies, np.unwrap(phases))
+    raise ValueError("Unknown interpolation: {i}".format(i = interpolation))
+
 class Correlation:
     def __init__(self, fpga, comb, f_start, f_stop, logger=logging.getLogger(__name__)):
         """ f_start and f_stop must be in Hz
@@ -33,6 +57,10 @@ class Correlation:
         # in other words comb1 is artificially delayed. 
         self.calibration_phase_offsets = None
         self.calibration_cable_length_offsets = None
+        # both of the above folded into one complex vector to multiply the signal by
+        self.calibration_correction = None
+        # reused by every fetch. self.signal is a read only view of it.
+        self.signal_buffer = None
         self.arm()
         self.fetch_signal()
         self.frequency_bins = np.linspace(
@@ -41,13 +69,15 @@ class Correlation:
             num = len(self.signal),
             endpoint = False)
 
-    def add_frequency_bin_calibration(self, frequencies, phases):
-        assert(len(frequencies) == len(phases))
-        self.calibration_phase_offsets = np.ndarray(len(self.frequency_bins))
-        for idx, f in enumerate(self.frequency_bins):
-            # find index in of the frequency in frequencies which is losest to f
-            frequencies_idx = np.argmin(np.abs(frequencies - f))
-            self.calibration_phase_offsets[idx] = phases[frequencies_idx]
+    def add_frequency_bin_calibration(self, frequencies, phases, interpolation='nearest'):
+        """ Maps a table of calibration phases onto self.frequency_bins.
+        interpolation -- 'nearest' takes the phase at the closest frequency in the
+            table. 'linear' unwraps the phases and then interpolates between the
+            two frequencies either side.
+        """
+        self.calibration_phase_offsets = resample_calibration_phases(
+            self.frequency_bins, frequencies, phases, interpolation)
+        self.update_calibration_correction()
         self.logger.info("Added calibration factors based on each frequency bin")
 
     def add_cable_length_calibration(self, length_a, velocity_factor_a, length_b, velocity_factor_b):
@@ -59,35 +89,77 @@ class Correlation:
         This will happen if comb[1]s cable is longer than comb[0]s.
         Hence this should be len(cable1) - len(cable0)
         """
-        self.calibration_cable_length_offsets = np.ndarray(len(self.frequency_bins))
         # calculate total time delay.
         t_a = length_a / (scipy.constants.c * velocity_factor_a)
         t_b = length_b / (scipy.constants.c * velocity_factor_b)
-        # for each frequency bin, calculate corresponding 
-        for idx, f in enumerate(self.frequency_bins):
-            # this will produce a positive number if As length is longer than Bs
-            phase = 2*np.pi * (t_a - t_b) * f
-            self.calibration_cable_length_offsets[idx] = phase
+        # for each frequency bin, calculate corresponding phase.
+        # this will produce a positive number if As length is longer than Bs
+        self.calibration_cable_length_offsets = 2*np.pi * (t_a - t_b) * self.frequency_bins
+        self.update_calibration_correction()
         self.logger.info("Added calibration factors base on cable length")
 
+    def set_calibration_offsets(self, phase_offsets=None, cable_length_offsets=None):
+        """ Sets already resampled calibrations, such as from a CalibrationStore.
+        Each is an array with a phase for every frequency bin. None leaves that
+        calibration as it is.
+        """
+        if phase_offsets is not None:
+            assert(len(phase_offsets) == len(self.frequency_bins))
+            self.calibration_phase_offsets = phase_offsets
+        if cable_length_offsets is not None:
+            assert(len(cable_length_offsets) == len(self.frequency_bins))
+            self.calibration_cable_length_offsets = cable_length_offsets
+        self.update_calibration_correction()
+
     def arm(self):
         self.snapshot0.arm()
         self.snapshot1.arm()
 
-    def apply_frequency_domain_calibrations(self):
-        if self.calibration_phase_offsets != None:
-            offsets = np.exp(1j*self.calibration_phase_offsets)
-            self.signal = self.signal * np.conj(offsets)
-        if self.calibration_cable_length_offsets != None:
-            offsets = np.exp(1j*self.calibration_cable_length_offsets)
-            self.signal = self.signal * offsets
+    def update_calibration_correction(self):
+        """ Folds the phase and cable length calibrations into one complex vector.
+        The phase offsets are removed by multiplying by exp(-j*offset) and the
+        cable length offsets are added by multiplying by exp(j*offset).
+        """
+        offsets = np.zeros(len(self.frequency_bins))
+        if self.calibration_phase_offsets is not None:
+            offsets -= self.calibration_phase_offsets
+        if self.calibration_cable_length_offsets is not None:
+            offsets += self.calibration_cable_length_offsets
+        self.calibration_correction = np.exp(1j*offsets)
+
+    def apply_frequency_domain_calibrations(self, signal=None):
+        """ Calibrates self.signal in place, or signal if it is given
+        """
+        if self.calibration_correction is None:
+            return
+        if signal is None:
+            signal = self.signal_buffer
+        signal *= self.calibration_correction
         self.logger.debug("Applied calibration factors")
 
     def fetch_signal(self):
-        self.snapshot0.fetch_signal()
-        self.snapshot1.fetch_signal()
-        # F:  index the elements in column-major order, with the first index changing fastest
-        self.signal = np.ravel( (self.snapshot0.signal, self.snapshot1.signal), order='F')
+        self.snapshot0.fetch_raw()
+        self.snapshot1.fetch_raw()
+        self.combine_snapshots()
+
+    def combine_snapshots(self):
+        """ Builds the signal from the two snapshot halves once both have been fetched.
+        snapshot0 holds the even bins and snapshot1 the odd bins. The raw big
+        endian integers are converted straight into signal_buffer, which is
+        reused between fetches, so self.signal is overwritten by the next fetch.
+        Copy it to keep it.
+        """
+        components0 = np.frombuffer(self.snapshot0.raw, self.snapshot0.dtype)
+        components1 = np.frombuffer(self.snapshot1.raw, self.snapshot1.dtype)
+        half_len = len(components0) // 2
+        if self.signal_buffer is None or len(self.signal_buffer) != 2 * half_len:
+            self.signal_buffer = np.empty(2 * half_len, dtype = np.complex128)
+        # view the buffer as (bin pairs x snapshot x real/imag) floats
+        interleaved = self.signal_buffer.view(np.float64).reshape(half_len, 2, 2)
+        interleaved[:, 0, :] = components0.reshape(half_len, 2)
+        interleaved[:, 1, :] = components1.reshape(half_len, 2)
+        self.signal = self.signal_buffer.view()
+        self.signal.flags.writeable = False
 
     def strongest_frequency(self):
         """ Returns the frequency in Hz which has the strongest signal.
@@ -4,20 +4,31 @@
 Interface to the ROACH.
 '''
 import logging
-import corr
+try:
+    import corr
+except ImportError:
+    # only needed to connect to a ROACH. See fpga_client.
+    corr = None
 from correlation import Correlation
 from snapshot import Snapshot
 from control_register import ControlRegister
+from frame import FrequencyFrame, ImpulseFrame
+from calibration_store import CalibrationStore, CalibrationCache
+import calibration_store
+import copy
 import itertools
+import multiprocessing.pool
+import Queue
 import numpy as np
-import scipy.signal, scipy.constants
+import scipy.signal, scipy.constants, scipy.fftpack
 import time
 import json
 import os
 
 
 class Correlator:
-    def __init__(self, ip_addr='localhost', num_channels=4, fs=800e6, logger=logging.getLogger(__name__)):
+    def __init__(self, ip_addr='localhost', num_channels=4, fs=800e6, logger=logging.getLogger(__name__), fetch_workers=1,
+                 calibration_cache_dir=None, fpga_client=None):
         """The interface to a ROACH cross correlator
 
         Keyword arguments:
@@ -25,14 +36,29 @@ class Correlator:
         num_channels -- antennas in the correlator. (default: 4)
         fs -- sample frequency of antennas. (default 800e6; 800 MHz)
         logger -- logger to use. (default: new default logger)
+        fetch_workers -- how many snapshots to read at once, each over its own
+            katcp connection. 1 reads them one after the other. (default: 1)
+        calibration_cache_dir -- where calibrations converted from JSON are kept
+            so they aren't parsed again. (default: None; only for this process)
+        fpga_client -- called with ip_addr to make each katcp connection.
+            (default: corr.katcp_wrapper.FpgaClient)
         """
         self.logger = logger
-        self.fpga = corr.katcp_wrapper.FpgaClient(ip_addr)
+        self.ip_addr = ip_addr
+        if fpga_client is None:
+            if corr is None:
+                raise ImportError("corr is needed to connect to a ROACH")
+            fpga_client = corr.katcp_wrapper.FpgaClient
+        self.fpga_client = fpga_client
+        self.fpga = self.fpga_client(ip_addr)
         time.sleep(0.1)
+        self.fetch_pool = None
+        self.set_fetch_workers(fetch_workers)
         self.num_channels = num_channels
         self.fs = np.float64(fs)
         self.cross_combinations = list(itertools.combinations(range(num_channels), 2))  # [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
         self.control_register = ControlRegister(self.fpga, self.logger.getChild('control_reg'))
+        self.overflows = None
         self.set_accumulation_len(100)
         self.re_sync()
         self.control_register.allow_trigger() # necessary as Correlations auto fetch signal
@@ -46,40 +72,93 @@ class Correlator:
                                                   f_start = 0,
                                                   f_stop = fs/2,
                                                   logger = self.logger.getChild("{a}x{b}".format(a = comb[0], b = comb[1])) )
+        self.share_signal_buffers()
+        self.calibration_corrections = None
+        self.calibration_cache = CalibrationCache(calibration_cache_dir, self.logger.getChild('calibration_cache'))
         self.time_domain_snap = Snapshot(fpga = self.fpga, 
                                          name = 'dram_snapshot',
                                          dtype = np.int8,
                                          cvalue = False,
                                          logger = self.logger.getChild('time_domain_snap'))
+        self.init_time_domain_processing()
+        self.control_register.block_trigger()
+
+    def init_time_domain_processing(self):
+        """ Defaults for how time domain snapshots are processed
+        """
         self.upsample_factor = 100
         self.subsignal_length_max = 2**17
         self.time_domain_padding = 100
+        # how the correlation peak is found to sub-sample precision:
+        # 'sinc' -- band limited interpolation of just the samples near the peak
+        # 'parabolic' -- parabola through the peak sample and its neighbours
+        # 'resample' -- upsample the whole correlation and take its maximum
+        self.peak_refinement = 'sinc'
+        # samples either side of the coarse peak which the sinc interpolation uses
+        self.peak_interpolation_half_width = 16
+        # samples either side of the peak to keep in time_domain_correlations_values
+        # and _times. 0 keeps only the peak. Not used by 'resample' which keeps everything.
+        self.correlation_window = 0
+        # set by set_array to bound the lags to what the array can physically produce
+        self.array = None
+        self.tdoa_margin = None
+        # zero padded copy of the channels which the FFT correlation reuses
+        self.time_domain_fft_workspace = None
+        # what the de-interleaved channels are stored as. int16 or float32 are
+        # enough for 8 bit samples; float64 only costs memory.
+        self.time_domain_dtype = np.float32
+        self.time_domain_signals_buffer = None
+        self.time_domain_dc_offsets = None
+        # bytes per DRAM read when streaming a capture
+        self.time_domain_chunk_size = 2**18
+        # samples per channel correlated at a time when streaming
+        self.time_domain_segment_length = 2**14
         self.time_domain_calibration_values = None
         self.time_domain_calibration_cable_values = None
-        self.control_register.block_trigger()
+        self.impulse_length = 0
+        # added to the time the capture takes before reading it. Covers the
+        # round trip of the katcp read which saw the impulse.
+        self.impulse_capture_guard = 1e-3
 
     def impulse_arm(self):
         self.control_register.pulse_impulse_arm()
         self.time_domain_snap.arm()
 
-    def impulse_fetch(self):
+    def impulse_fetch(self, impulse_len=None):
         """ Will fetch and re-arm if an impulse has occurred.
         Will do nothing if no impulse. 
         Return True if fetched (ie: an impulse happened) or
         False if not
+        impulse_len -- what the impulse_length register was just read as, to
+            save reading it again. (default: read it)
         """
-        pre_delay = 256 * 4
-        impulse_len = self.fpga.read_uint('impulse_length')
+        if impulse_len is None:
+            impulse_len = self.read_impulse_length()
         if impulse_len != 0:
+            self.impulse_length = impulse_len
             self.logger.info("Got an impulse of length: {}".format(impulse_len))
-            time.sleep(0.1)
-            if self.fpga.read_uint('impulse_length') != impulse_len:
+            time.sleep(self.impulse_capture_time(impulse_len))
+            if self.read_impulse_length() != impulse_len:
                 self.logger.warning('Impulse has gone on for too long. Adjust setpoint?')
             self.fetch_time_domain_snapshot()
             self.impulse_arm()
             return True
         return False
 
+    def read_impulse_length(self):
+        """ Length of the last impulse in FPGA clocks. 0 if there hasn't been one
+        since arming.
+        """
+        return self.fpga.read_uint('impulse_length')
+
+    def impulse_capture_time(self, impulse_len):
+        """ Seconds to wait after seeing an impulse of impulse_len FPGA clocks for
+        the DRAM to hold it and the samples after it
+        """
+        # four samples per FPGA clock cycle. Equal delay on either side of signal.
+        pre_delay = 256 * 4
+        return (pre_delay + impulse_len * 4 + pre_delay) / self.fs + self.impulse_capture_guard
+
     def set_impulse_setpoint(self, level):
         self.fpga.write_int('setppoint', level)
         self.logger.info("Impulse detection setpoint changed to: {}".format(level))
@@ -98,30 +177,79 @@ class Correlator:
     def fetch_time_domain_snapshot(self, force=False):
         self.time_domain_snap.fetch_signal(force)
         sig = self.time_domain_snap.signal
-        # shorten to fit exactly 
-        new_length = (4 * self.num_channels) * np.floor(len(sig) / (4 * self.num_channels))
-        sig = sig[0:new_length]
-        self.time_domain_signals = np.ndarray((self.num_channels, len(sig)/self.num_channels), 
-                                              dtype = np.float64)
-        sig = sig.reshape(len(sig)/self.num_channels, self.num_channels)
-        for chan in range(self.num_channels):
-            self.time_domain_signals[chan] = sig[chan::self.num_channels].flatten().astype(np.float64)
-            # remove DC offset
-            mean = np.mean(self.time_domain_signals[chan])
-            self.time_domain_signals[chan] -= mean
-            self.logger.info("After: DC offset for {chan} = {offset}".format(
-                chan = chan, 
-                offset = np.mean(self.time_domain_signals[chan])))
+        self.allocate_time_domain_signals(len(sig))
+        self.deinterleave_time_domain(sig, 0)
+        self.remove_time_domain_dc()
+
+    def stream_time_domain_snapshot(self, force=False, chunk_size=None):
+        """ As fetch_time_domain_snapshot but reads the DRAM chunk_size bytes at a
+        time, de-interleaving each chunk while the next one transfers. A generator
+        which yields how many samples of each channel in time_domain_signals have
+        arrived so far. The DC offsets are removed after the last yield.
+        chunk_size -- bytes per read. (default: time_domain_chunk_size)
+        """
+        if chunk_size is None:
+            chunk_size = self.time_domain_chunk_size
+        assert(chunk_size % (4 * self.num_channels) == 0)
+        # read once here. Reading it again for the transfer could disagree.
+        length = self.time_domain_snap.dram_length(force)
+        samples = self.allocate_time_domain_signals(length)
+        ready = 0
+        for chunk in self.time_domain_snap.iter_dram_chunks(force, chunk_size, length = length):
+            sig = self.time_domain_snap.unpack_signal(chunk)
+            count = min(len(sig) // self.num_channels, samples - ready)
+            if count > 0:
+                self.deinterleave_time_domain(sig[0:count * self.num_channels], ready)
+                ready += count
+                yield ready
+        if ready == 0:
+            # nothing arrived to take the offsets from
+            return
+        self.remove_time_domain_dc()
+
+    def allocate_time_domain_signals(self, length):
+        """ Points time_domain_signals at enough of the reusable buffer for a
+        capture of length bytes. Returns the samples per channel.
+        """
+        # shorten to fit exactly
+        block = 4 * self.num_channels
+        samples = (length // block) * block // self.num_channels
+        buf = self.time_domain_signals_buffer
+        if buf is None or buf.dtype != self.time_domain_dtype or buf.shape[1] < samples:
+            buf = np.empty((self.num_channels, samples), dtype = self.time_domain_dtype)
+            self.time_domain_signals_buffer = buf
+        self.time_domain_signals = buf[:, 0:samples]
         self.time_domain_axis = np.linspace(0,
-                                            len(self.time_domain_signals[0])/self.fs,
-                                            len(self.time_domain_signals[0]),
+                                            samples/self.fs,
+                                            samples,
                                             endpoint = False)
+        return samples
 
+    def deinterleave_time_domain(self, sig, start):
+        """ Copies the interleaved samples in sig into time_domain_signals from
+        sample start of each channel on
+        """
+        # the capture holds num_channels samples from each channel in turn.
+        interleaved = sig.reshape(-1, self.num_channels, self.num_channels)
+        # a view of the same memory in the capture's (block, channel, sample) order.
+        # setting shape rather than reshaping raises instead of silently copying.
+        deinterleaved = self.time_domain_signals[:, start:start + len(sig) // self.num_channels].view()
+        deinterleaved.shape = (self.num_channels, -1, self.num_channels)
+        deinterleaved[:] = interleaved.transpose(1, 0, 2)
+
+    def remove_time_domain_dc(self):
+        offsets = self.time_domain_signals.mean(axis = 1, dtype = np.float64)
+        if np.issubdtype(self.time_domain_dtype, np.integer):
+            offsets = np.round(offsets)
+        self.time_domain_signals -= offsets.astype(self.time_domain_dtype)[:, np.newaxis]
+        # what was actually subtracted
+        self.time_domain_dc_offsets = offsets.astype(self.time_domain_dtype).astype(np.float64)
+        self.logger.info("Removed DC offsets: {offsets}".format(offsets = offsets))
 
     def fetch_crosses(self):
         """ Updates the snapshot blocks for all cross correlations
         """
-        self.crosses = self.fetch_combinations(self.cross_combinations)
+        self.fetch_combinations(self.cross_combinations)
 
     def fetch_autos(self):
         """ Reads the snapshot blocks for all auto correlations and populates Correlation objects"""
@@ -133,6 +261,20 @@ class Correlator:
         """
         self.fetch_combinations(self.cross_combinations + self.auto_combinations)
 
+    def share_signal_buffers(self):
+        """ Makes the cross correlations decode into the rows of one
+        (baselines x bins) array, self.crosses, so that they can be worked on
+        all at once.
+        """
+        num_bins = len(self.frequency_correlations[self.cross_combinations[0]].signal)
+        self.crosses = np.empty((len(self.cross_combinations), num_bins), dtype = np.complex128)
+        for idx, comb in enumerate(self.cross_combinations):
+            correlation = self.frequency_correlations[comb]
+            self.crosses[idx] = correlation.signal
+            correlation.signal_buffer = self.crosses[idx]
+            correlation.signal = correlation.signal_buffer.view()
+            correlation.signal.flags.writeable = False
+
     def fetch_combinations(self, combinations):
         """ Takes an array of X correlations and returns the Correlation objects
         """
@@ -140,9 +282,48 @@ class Correlator:
         for comb in combinations:
             self.arm_combination(comb)
         self.control_register.allow_trigger()
-        for comb in combinations:
-            self.frequency_correlations[comb].fetch_signal()
-        self.get_overflow_state()
+        if self.fetch_pool is None:
+            for comb in combinations:
+                self.frequency_correlations[comb].fetch_signal()
+        else:
+            # everything was armed above so all snapshots hold the same accumulation
+            # no matter what order the reads complete in
+            snapshots = []
+            for comb in combinations:
+                snapshots.append(self.frequency_correlations[comb].snapshot0)
+                snapshots.append(self.frequency_correlations[comb].snapshot1)
+            self.fetch_pool.map(self.fetch_snapshot, snapshots)
+            for comb in combinations:
+                self.frequency_correlations[comb].combine_snapshots()
+        self.overflows = self.get_overflow_state()
+
+    def fetch_snapshot(self, snapshot):
+        """ Reads one snapshot over a connection from the fetch connection pool
+        """
+        fpga = self.fetch_connections.get()
+        try:
+            snapshot.fetch_raw(fpga = fpga)
+        finally:
+            self.fetch_connections.put(fpga)
+
+    def set_fetch_workers(self, fetch_workers):
+        """ Sets how many snapshots fetch_combinations reads concurrently.
+        Each worker gets its own katcp connection to the ROACH.
+        """
+        if self.fetch_pool is not None:
+            self.fetch_pool.close()
+            self.fetch_pool.join()
+            while not self.fetch_connections.empty():
+                self.fetch_connections.get().stop()
+            self.fetch_pool = None
+        self.fetch_workers = fetch_workers
+        if fetch_workers > 1:
+            self.fetch_connections = Queue.Queue()
+            for worker in range(fetch_workers):
+                self.fetch_connections.put(self.fpga_client(self.ip_addr))
+            time.sleep(0.1)
+            self.fetch_pool = multiprocessing.pool.ThreadPool(fetch_workers)
+        self.logger.info("Fetching snapshots with {n} workers".format(n = fetch_workers))
 
     def visibilities_at_frequency(self, f):
         visibilities = np.ndarray(len(self.cross_combinations))
@@ -150,55 +331,133 @@ class Correlator:
             visibilities[idx] = self.frequency_correlations[comb].phase_at_freq(f)
         return visibilities
 
-    def save_frequency_correlations(self, path):
-        full_dir = "{base}/{sub}/".format(base = path, sub = time.time())
+    def frequency_frame(self):
+        """ Copies the latest cross correlations into a FrequencyFrame which stays
+        valid after the next fetch
+        """
+        return FrequencyFrame(t = time.time(),
+                              cross_combinations = self.cross_combinations,
+                              crosses = np.array(self.crosses),
+                              frequency_bins = self.frequency_correlations[self.cross_combinations[0]].frequency_bins,
+                              acc_len = self.acc_len,
+                              overflows = self.overflows)
+
+    def impulse_frame(self):
+        """ Copies the latest time domain snapshot into an ImpulseFrame which stays
+        valid after the next fetch
+        """
+        return ImpulseFrame(t = time.time(),
+                            time_domain_signals = np.array(self.time_domain_signals),
+                            impulse_length = self.impulse_length)
+
+    def save_frequency_correlations(self, path, frame=None):
+        """ Saves the latest cross correlations, or those in frame if given
+        """
+        t = time.time() if frame is None else frame.t
+        full_dir = "{base}/{sub}/".format(base = path, sub = t)
         os.mkdir(full_dir)
         for comb in self.cross_combinations:
             filename = "{path}/{a}x{b}".format(path = full_dir, a = comb[0], b = comb[1])
-            np.save(filename, self.frequency_correlations[comb].signal)
+            if frame is None:
+                np.save(filename, self.frequency_correlations[comb].signal)
+            else:
+                np.save(filename, frame.signal(comb))
         self.logger.debug("Saved frequency combinations to {d}".format(d = full_dir))
 
-    def save_time_domain_snapshots(self, path):
-        full_dir = "{base}/{sub}/".format(base = path, sub = time.time())
+    def save_time_domain_snapshots(self, path, frame=None):
+        """ Saves the latest time domain snapshot, or the one in frame if given
+        """
+        t = time.time() if frame is None else frame.t
+        signals = self.time_domain_signals if frame is None else frame.time_domain_signals
+        full_dir = "{base}/{sub}/".format(base = path, sub = t)
         os.mkdir(full_dir)
         for chan in range(self.num_channels):
             filename = "{path}/{chan}".format(path = full_dir, chan = chan)
-            sig = self.time_domain_signals[chan]
+            # saved as float64 as they always have been, whatever time_domain_dtype is
+            sig = signals[chan].astype(np.float64)
             np.save(filename, sig)
         self.logger.debug("Saved time domain raw to {d}".format(d = full_dir))
 
-    def do_time_domain_cross_correlation(self):
+    def do_time_domain_cross_correlation(self, signals=None):
+        """ Finds the peak of the cross correlation for each baseline of the latest
+        time domain snapshot, or of signals if given
+        """
         # TODO: initiaise factor at initialisation from config.
         # TODO: min(length max, actual) should be used. Init from config.
-        self.do_time_domain_cross_correlations_cross_first()
-        self.time_domain_cross_correlations_peaks = {}
-        for baseline in self.cross_combinations:
-            self.time_domain_cross_correlations_peaks[baseline] = \
-                self.time_domain_correlations_times[baseline][np.argmax(self.time_domain_correlations_values[baseline])]
+        self.do_time_domain_cross_correlations_fft(signals)
 
     def visibilities_from_time(self):
         visibilities = np.ndarray(len(self.cross_combinations))
         for idx, baseline in enumerate(self.cross_combinations):
             visibilities[idx] = self.time_domain_cross_correlations_peaks[baseline]
+        if self.array is not None:
+            # anything beyond what the geometry allows is noise or the margin
+            max_tdoas = self.array.max_time_differences()
+            if np.any(np.abs(visibilities) > max_tdoas):
+                self.logger.debug("Clipping unphysical TDOAs: {v}".format(v = visibilities))
+            visibilities = np.clip(visibilities, -max_tdoas, max_tdoas)
         return visibilities
 
-    def do_time_domain_cross_correlations_cross_first(self):
+    def set_array(self, array, tdoa_margin=20e-9):
+        """ Limits the time domain correlation of each baseline to the lags that
+        the array geometry, the calibrations and tdoa_margin allow, rather than
+        +-time_domain_padding for every baseline.
+        array -- instance of AntennaArray with antennas in channel order
+        tdoa_margin -- extra time in seconds either side. Gives the peak
+            interpolation some samples to work with at endfire.
+        """
+        assert(len(array.baselines) == len(self.cross_combinations))
+        self.array = array
+        self.tdoa_margin = tdoa_margin
+        for baseline in self.cross_combinations:
+            lag_min, lag_max = self.time_domain_lag_window(baseline)
+            self.logger.info("Lags for {a}x{b}: {lmin} to {lmax}".format(
+                a = baseline[0], b = baseline[1], lmin = lag_min, lmax = lag_max))
+
+    def time_domain_lag_window(self, baseline):
+        """ Returns (lag_min, lag_max), the range of lags in samples to correlate
+        baseline over
+        """
+        if self.array is None:
+            return (-self.time_domain_padding, self.time_domain_padding)
+        max_tdoa = self.array.max_time_differences()[self.cross_combinations.index(baseline)]
+        # the peak lands at the true TDOA plus the offsets that calibration removes
+        offset = self.time_domain_calibration_offset(baseline)
+        lag_min = int(np.floor((offset - max_tdoa - self.tdoa_margin) * self.fs))
+        lag_max = int(np.ceil((offset + max_tdoa + self.tdoa_margin) * self.fs))
+        return (lag_min, lag_max)
+
+    def time_domain_calibration_offset(self, baseline):
+        """ How far the calibrations say a baseline's correlation peak is shifted
+        from the true TDOA
+        """
+        offset = 0
+        if self.time_domain_calibration_values is not None:
+            offset += self.time_domain_calibration_values[baseline]
+        if self.time_domain_calibration_cable_values is not None:
+            offset += self.time_domain_calibration_cable_values[baseline]
+        return offset
+
+    def do_time_domain_cross_correlations_cross_first(self, signals=None):
+        if signals is None:
+            signals = self.time_domain_signals
         self.time_domain_correlations_values = {}
         self.time_domain_correlations_times = {}
+        self.time_domain_cross_correlations_peaks = {}
         for (a_idx, b_idx) in self.cross_combinations:
             # NOTE: The only reason this works is that the dtype of the zeros is 
             # float64 hence 'a' and 'b' are also float64. The signals get cast 
             # to float64.
             # if they stayed as int8 the correlation would fail miserably.
             # investivate time impact of converting to float64 vs int32 vs int64
-            a = self.time_domain_signals[a_idx][0:self.subsignal_length_max]
+            a = signals[a_idx][0:self.subsignal_length_max]
             a_time = np.linspace(0,
                                  len(a)/self.fs,
                                  len(a),
                                  endpoint=False)
             b = np.concatenate(
                 (np.zeros(self.time_domain_padding),
-                 self.time_domain_signals[b_idx][0:self.subsignal_length_max],
+                 signals[b_idx][0:self.subsignal_length_max],
                  np.zeros(self.time_domain_padding)))
             b_time = np.linspace(-(self.time_domain_padding/self.fs), 
                                  (len(b)-self.time_domain_padding)/self.fs, 
@@ -210,16 +469,7 @@ class Correlator:
                                             b_time[-1] - a_time[-1],
                                             len(correlation),
                                             endpoint=True)
-            correlation_upped, correlation_time_upped = scipy.signal.resample(
-                correlation,
-                len(correlation)*self.upsample_factor,
-                t = correlation_time)
-            self.time_domain_correlations_values[(a_idx, b_idx)] = correlation_upped
-            if self.time_domain_calibration_values != None:
-                correlation_time_upped -= self.time_domain_calibration_values[(a_idx, b_idx)]
-            if self.time_domain_calibration_cable_values != None:
-                correlation_time_upped -= self.time_domain_calibration_cable_values[(a_idx, b_idx)]
-            self.time_domain_correlations_times[(a_idx, b_idx)] = correlation_time_upped
+            self.store_time_domain_correlation((a_idx, b_idx), correlation, correlation_time)
         # how much extra time we're appending each side
         #self.time_domain_correlation_time3 = np.linspace(-pt, pt, ((2*self.time_domain_padding)+1) * self.upsample_factor)
             # need to do something about the different length to compensate for
@@ -227,6 +477,183 @@ class Correlator:
             # perhaps contact b with zeros and then remove them? While doing the same to
             # the 't' axis. Or just to 't'? 
 
+    def do_time_domain_cross_correlations_fft(self, signals=None):
+        """ Gives the same correlations as do_time_domain_cross_correlations_cross_first
+        but transforms each channel once and gets every baseline from the product
+        of two spectra, so the cost grows with channels rather than baselines.
+        """
+        if signals is None:
+            signals = self.time_domain_signals
+        self.time_domain_correlations_values = {}
+        self.time_domain_correlations_times = {}
+        self.time_domain_cross_correlations_peaks = {}
+        length = min(len(signals[0]), self.subsignal_length_max)
+        lag_windows = [self.time_domain_lag_window(baseline) for baseline in self.cross_combinations]
+        max_lag = max(max(abs(lag_min), abs(lag_max)) for lag_min, lag_max in lag_windows)
+        # long enough that no lag in any window wraps around
+        nfft = scipy.fftpack.next_fast_len(length + max_lag)
+        workspace = self.time_domain_fft_workspace
+        if workspace is None or workspace.shape != (len(signals), nfft):
+            # a stable size also lets the FFT reuse its cached plan between impulses
+            workspace = np.zeros((len(signals), nfft), dtype = np.float64)
+            self.time_domain_fft_workspace = workspace
+        workspace[:, :length] = signals[:, :length]
+        workspace[:, length:] = 0
+        spectra = np.fft.rfft(workspace, axis = 1)
+        a_idxs = [a for a, b in self.cross_combinations]
+        b_idxs = [b for a, b in self.cross_combinations]
+        # irfft(conj(A) * B)[k] = sum_n a[n] * b[n + k] which is what np.correlate(b, a) gives
+        correlations = np.fft.irfft(np.conj(spectra[a_idxs]) * spectra[b_idxs], nfft, axis = 1)
+        for idx, baseline in enumerate(self.cross_combinations):
+            lag_min, lag_max = lag_windows[idx]
+            lags = np.arange(lag_min, lag_max + 1)
+            # negative lags index from the end of the circular correlation
+            self.store_time_domain_correlation(baseline, correlations[idx, lags], lags / self.fs)
+
+    def fetch_and_correlate_time_domain_snapshot(self, force=False):
+        """ Streams a capture with stream_time_domain_snapshot and correlates it
+        as it arrives. Leaves the same results as fetch_time_domain_snapshot
+        followed by do_time_domain_cross_correlation.
+        """
+        self.do_time_domain_cross_correlations_streaming(self.stream_time_domain_snapshot(force))
+
+    def do_time_domain_cross_correlations_streaming(self, ready_counts):
+        """ Gives the same correlations as do_time_domain_cross_correlations_fft
+        while time_domain_signals is still arriving.
+        ready_counts -- iterable of how many samples per channel have arrived,
+            such as stream_time_domain_snapshot. The signals must still have
+            their DC offsets until it is exhausted.
+        Each time_domain_segment_length samples are correlated over every lag
+        as soon as they and the max_lag samples after them are in. The DC
+        offsets are taken out of the sums at the end.
+        """
+        self.time_domain_correlations_values = {}
+        self.time_domain_correlations_times = {}
+        self.time_domain_cross_correlations_peaks = {}
+        lag_windows = [self.time_domain_lag_window(baseline) for baseline in self.cross_combinations]
+        max_lag = max(max(abs(lag_min), abs(lag_max)) for lag_min, lag_max in lag_windows)
+        segment_length = self.time_domain_segment_length
+        # each segment is correlated against itself extended by max_lag either side
+        nfft = scipy.fftpack.next_fast_len(segment_length + 2*max_lag)
+        sums = np.zeros((len(self.cross_combinations), 2*max_lag + 1))
+        length = None
+        start = 0
+        for ready in ready_counts:
+            if length is None:
+                length = min(self.time_domain_signals.shape[1], self.subsignal_length_max)
+            while start < length and ready >= min(start + segment_length + max_lag, length):
+                sums += self.correlate_time_domain_segment(start, length, max_lag, nfft)
+                start += segment_length
+        if length is None:
+            # nothing arrived, so there is nothing to correlate
+            self.logger.error("Time domain capture was empty")
+            raise ValueError("Time domain capture was empty")
+        signals = self.time_domain_signals
+        offsets = self.time_domain_dc_offsets
+        lags = np.arange(-max_lag, max_lag + 1)
+        overlaps = length - np.abs(lags)
+        # sum over each lag's overlap of the DC removed signals, with the offsets put back
+        # in, is what the segments summed. a overlaps b from 0 for positive lags and
+        # from -lag for negative ones, and the other way round for b.
+        cumulative = np.zeros((len(signals), length + 1))
+        np.cumsum(signals[:, 0:length], axis = 1, dtype = np.float64, out = cumulative[:, 1:])
+        cumulative += offsets[:, np.newaxis] * np.arange(length + 1)
+        overlap_start = np.maximum(0, -lags)
+        a_sums = cumulative[:, overlap_start + overlaps] - cumulative[:, overlap_start]
+        b_sums = cumulative[:, overlap_start + lags + overlaps] - cumulative[:, overlap_start + lags]
+        for idx, baseline in enumerate(self.cross_combinations):
+            a_idx, b_idx = baseline
+            # sum of (a - offset_a) * (b - offset_b) over the overlap
+            correlation = sums[idx] - offsets[b_idx]*a_sums[a_idx] - offsets[a_idx]*b_sums[b_idx] \
+                          + overlaps*offsets[a_idx]*offsets[b_idx]
+            lag_min, lag_max = lag_windows[idx]
+            window = np.arange(lag_min, lag_max + 1)
+            self.store_time_domain_correlation(baseline, correlation[window + max_lag], window / self.fs)
+
+    def correlate_time_domain_segment(self, start, length, max_lag, nfft):
+        """ (baselines x 2*max_lag+1) contribution of samples start to
+        start+time_domain_segment_length of 'a' to the correlation of each
+        baseline at lags -max_lag to max_lag
+        """
+        signals = self.time_domain_signals
+        stop = min(start + self.time_domain_segment_length, length)
+        a = np.zeros((len(signals), nfft))
+        a[:, 0:stop - start] = signals[:, start:stop]
+        b = np.zeros((len(signals), nfft))
+        b_start = max(0, start - max_lag)
+        b_stop = min(length, stop + max_lag)
+        b[:, b_start - (start - max_lag):b_stop - (start - max_lag)] = signals[:, b_start:b_stop]
+        a_spectra = np.fft.rfft(a, axis = 1)
+        b_spectra = np.fft.rfft(b, axis = 1)
+        a_idxs = [a_idx for a_idx, b_idx in self.cross_combinations]
+        b_idxs = [b_idx for a_idx, b_idx in self.cross_combinations]
+        # element max_lag + lag is sum_n a[start + n] * b[start + n + lag]
+        correlations = np.fft.irfft(np.conj(a_spectra[a_idxs]) * b_spectra[b_idxs], nfft, axis = 1)
+        return correlations[:, 0:2*max_lag + 1]
+
+    def store_time_domain_correlation(self, baseline, correlation, correlation_time):
+        """ Finds the time of the peak of a baseline's correlation to a fraction
+        of a sample and stores it calibrated, along with as much of the
+        interpolated correlation as peak_refinement and correlation_window keep.
+        """
+        if self.peak_refinement == 'resample':
+            values, times = scipy.signal.resample(
+                correlation,
+                len(correlation)*self.upsample_factor,
+                t = correlation_time)
+            peak_time = times[np.argmax(values)]
+        else:
+            step = correlation_time[1] - correlation_time[0]
+            peak, positions, values = self.refine_peak(correlation)
+            peak_time = correlation_time[0] + peak*step
+            if positions is not None:
+                times = correlation_time[0] + positions*step
+        offset = self.time_domain_calibration_offset(baseline)
+        self.time_domain_cross_correlations_peaks[baseline] = peak_time - offset
+        if values is not None:
+            self.time_domain_correlations_values[baseline] = values
+            self.time_domain_correlations_times[baseline] = times - offset
+
+    def refine_peak(self, correlation):
+        """ Returns (peak, positions, values). peak is the position of the maximum of
+        correlation in fractional samples. positions and values describe the
+        correlation_window either side of it, or are None if that is 0.
+        """
+        coarse = np.argmax(correlation)
+        if self.peak_refinement == 'parabolic':
+            peak = float(coarse)
+            if 0 < coarse < len(correlation) - 1:
+                below, centre, above = correlation[coarse-1:coarse+2]
+                curvature = below - 2*centre + above
+                if curvature < 0:
+                    peak += 0.5 * (below - above) / curvature
+            if self.correlation_window == 0:
+                return peak, None, None
+            positions = np.arange(max(0, coarse - self.correlation_window),
+                                  min(len(correlation), coarse + self.correlation_window + 1))
+            return peak, positions, correlation[positions]
+        elif self.peak_refinement == 'sinc':
+            # the true peak is within a sample of the coarse one. Evaluate the band
+            # limited interpolation on the same 1/upsample_factor grid that resampling
+            # the whole correlation would give, but only near the peak.
+            half_width = max(1, self.correlation_window)
+            positions = coarse + np.arange(-half_width*self.upsample_factor,
+                                           half_width*self.upsample_factor + 1) / float(self.upsample_factor)
+            positions = positions[(positions >= 0) & (positions <= len(correlation) - 1)]
+            taper_width = self.peak_interpolation_half_width + 1
+            neighbours = np.arange(max(0, coarse - half_width - self.peak_interpolation_half_width),
+                                   min(len(correlation), coarse + half_width + self.peak_interpolation_half_width + 1))
+            # (positions x neighbours) distances in samples
+            offsets = positions[:, np.newaxis] - neighbours
+            # Hann taper so truncating the sinc doesn't ring
+            taper = 0.5 * (1 + np.cos(np.pi * np.clip(offsets / taper_width, -1, 1)))
+            values = (np.sinc(offsets) * taper).dot(correlation[neighbours])
+            peak = positions[np.argmax(values)]
+            if self.correlation_window == 0:
+                return peak, None, None
+            return peak, positions, values
+        raise ValueError("Unknown peak refinement: {r}".format(r = self.peak_refinement))
+
     def do_time_domain_cross_correlation_resample_first(self):
         raise Exception("Need to swap A and B as done above")
         self.time_domain_correlations = []
@@ -264,6 +691,7 @@ class Correlator:
         """The number of vectors which should be accumulated before being snapped. 
         """
         self.fpga.write_int('acc_len', acc_len)
+        self.acc_len = acc_len
         self.logger.info("Accumulation length set to {l}".format(l = acc_len))
         self.re_sync()
 
@@ -302,6 +730,8 @@ class Correlator:
 
 
     def add_time_domain_calibration(self, filename):
+        if filename.endswith(calibration_store.EXTENSION):
+            return self.add_calibration_store(filename)
         self.time_domain_calibration_values = {}
         with open(filename) as f:
             offsets = json.load(f)
@@ -309,14 +739,22 @@ class Correlator:
             comb_str = "{a}x{b}".format(a = a, b = b)
             self.time_domain_calibration_values[(a, b)] = offsets[comb_str]
 
-    def add_frequency_bin_calibrations(self, filename):
-        with open(filename) as f:
-            offsets = json.load(f)
-        frequencies = offsets['axis']
-        for a, b in self.cross_combinations:
-            self.frequency_correlations[(a, b)].add_frequency_bin_calibration(
-                frequencies = frequencies,
-                phases = offsets["{a}{b}".format(a = a, b = b)])
+    def frequency_bins(self):
+        return self.frequency_correlations[self.cross_combinations[0]].frequency_bins
+
+    def add_frequency_bin_calibrations(self, filename, interpolation='nearest'):
+        """ interpolation is as per Correlation.add_frequency_bin_calibration.
+        filename can be JSON or a calibration store. JSON is only parsed and
+        resampled the first time calibration_cache sees its contents.
+        """
+        if filename.endswith(calibration_store.EXTENSION):
+            return self.add_calibration_store(filename)
+        arrays = self.calibration_cache.frequency_bin_calibration(
+            filename, self.cross_combinations, self.frequency_bins(), interpolation)
+        for idx, comb in enumerate(self.cross_combinations):
+            self.frequency_correlations[comb].set_calibration_offsets(phase_offsets = arrays['phase_offsets'][idx])
+        self.update_calibration_corrections()
+        self.logger.info("Added frequency bin calibrations from {f}".format(f = filename))
 
     def add_cable_length_calibrations(self, filename):
         """ Filename should be a json file with cable lengths
@@ -327,28 +765,65 @@ class Correlator:
               "velocity factor": 0.66
           },
         """
-        with open(filename) as f:
-            cables = json.load(f)
-        self.time_domain_calibration_cable_values = {}
-        for a, b in self.cross_combinations:
-            length_a = cables[str(a)]['length']
-            velocity_factor_a = cables[str(a)]['velocity factor']
-            length_b = cables[str(b)]['length']
-            velocity_factor_b = cables[str(b)]['velocity factor']
-            # For the frequency domain:
-            self.frequency_correlations[(a, b)].add_cable_length_calibration(
-                length_a = length_a,
-                velocity_factor_a = velocity_factor_a,
-                length_b = length_b,
-                velocity_factor_b = velocity_factor_b)
-            # For the time domain:
-            t_a = length_a / (scipy.constants.c * velocity_factor_a)
-            t_b = length_b / (scipy.constants.c * velocity_factor_b)
-            # this is how much b is delayed from a by as a result of the cable.
-            # b delayed from a by a positive amount will mean that the (a, b) correlation
-            # peak will be more positive than it should be. Subtract this to compensate.
-            self.time_domain_calibration_cable_values[(a, b)] = t_b - t_a
-
-    def apply_frequency_domain_calibrations(self):
-        for a, b in self.cross_combinations:
-            self.frequency_correlations[(a, b)].apply_frequency_domain_calibrations()
+        if filename.endswith(calibration_store.EXTENSION):
+            return self.add_calibration_store(filename)
+        arrays = calibration_store.cable_length_calibration_arrays(filename, self.cross_combinations, self.frequency_bins())
+        self.set_cable_length_calibrations(arrays['cable_phase_offsets'], arrays['cable_time_offsets'])
+        self.logger.info("Added cable length calibrations from {f}".format(f = filename))
+
+    def set_cable_length_calibrations(self, phase_offsets, time_offsets):
+        # For the frequency domain:
+        for idx, comb in enumerate(self.cross_combinations):
+            self.frequency_correlations[comb].set_calibration_offsets(cable_length_offsets = phase_offsets[idx])
+        # For the time domain. This is how much b is delayed from a by as a result of the cable.
+        # Subtracted from the (a, b) correlation peak to compensate.
+        self.time_domain_calibration_cable_values = dict(zip(self.cross_combinations, time_offsets))
+        self.update_calibration_corrections()
+
+    def add_calibration_store(self, filename):
+        """ Applies whichever calibrations a calibration store holds. The
+        frequency domain ones stay memory mapped.
+        """
+        store = CalibrationStore(filename)
+        if not store.matches(self.cross_combinations, self.frequency_bins()):
+            raise ValueError("{f} was made for different baselines or frequency bins".format(f = filename))
+        if 'phase_offsets' in store:
+            for idx, comb in enumerate(self.cross_combinations):
+                self.frequency_correlations[comb].set_calibration_offsets(phase_offsets = store['phase_offsets'][idx])
+        if 'cable_phase_offsets' in store:
+            self.set_cable_length_calibrations(store['cable_phase_offsets'], store['cable_time_offsets'])
+        if 'time_offsets' in store:
+            self.time_domain_calibration_values = dict(zip(self.cross_combinations, store['time_offsets']))
+        self.update_calibration_corrections()
+        self.logger.info("Added calibrations {c} from {f}".format(c = sorted(store.arrays.keys()), f = filename))
+
+    def update_calibration_corrections(self):
+        """ Stacks each baseline's calibration correction into one
+        (baselines x bins) array which calibrates all of self.crosses in one multiply
+        """
+        corrections = [self.frequency_correlations[comb].calibration_correction
+                       for comb in self.cross_combinations]
+        if all(correction is None for correction in corrections):
+            self.calibration_corrections = None
+            return
+        self.calibration_corrections = np.ones(self.crosses.shape, dtype = np.complex128)
+        for idx, correction in enumerate(corrections):
+            if correction is not None:
+                self.calibration_corrections[idx] = correction
+
+    def apply_frequency_domain_calibrations(self, frame=None):
+        """ Calibrates the latest cross correlations in place. If frame is given
+        returns a calibrated copy of it instead and leaves frame as it was, as
+        other stages, such as the recorder, may still be using it. One multiply
+        covers all baselines.
+        """
+        if frame is not None:
+            if self.calibration_corrections is None:
+                return frame
+            calibrated = copy.copy(frame)
+            calibrated.crosses = frame.crosses * self.calibration_corrections
+            return calibrated
+        if self.calibration_corrections is None:
+            return
+        self.crosses *= self.calibration_corrections
+        self.logger.debug("Applied calibration factors")
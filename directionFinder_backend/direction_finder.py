@@ -1,9 +1,15 @@
 import logging
 import numpy as np
 import time
+import scipy.constants
+from manifold_cache import ManifoldCache
+from results_writer import ResultsWriter
 
 class DirectionFinder:
-    def __init__(self, correlator, array, frequency, logger=logging.getLogger(__name__)):
+    def __init__(self, correlator, array, frequency, logger=logging.getLogger(__name__),
+                 num_angles=1000, search='grid', coarse_num_angles=None, refine_candidates=3,
+                 refine_points=16, manifold_cache=None, manifold_cache_dir=None,
+                 tdoa_refine_steps=1, binary_results=False, catalogue=None):
         """ Takes data from a correlator and compares it to the expected output
         of the antenna array to figure out where the signal at the correlator 
         is coming from
@@ -11,72 +17,278 @@ class DirectionFinder:
         frequency -- the frequency bin to DF in Hz
         correlator -- instance of Correlator, or a fake correlator: Signal Generator.
         array -- instance of AntennaArray
+        num_angles -- how many angles around the circle the 'grid' search compares against
+        search -- 'grid' to compare against every one of num_angles, or 'refined' for
+            a coarse scan followed by local refinement to a continuous angle
+        coarse_num_angles -- size of the coarse grid for the 'refined' search. None derives
+            it from the array aperture and the frequency.
+        refine_candidates -- how many of the best coarse minima get refined
+        refine_points -- how many points the local grid around each candidate has
+        manifold_cache -- instance of ManifoldCache. None makes one keyed on the
+            correlator's frequency bins.
+        manifold_cache_dir -- where the default ManifoldCache persists manifolds.
+            None keeps them in memory only.
+        tdoa_refine_steps -- Gauss-Newton steps solve_tdoas takes on the angle after
+            the least squares estimate. 0 uses the least squares estimate as is.
+        binary_results -- also write results as binary columns. See ResultsWriter.
+        catalogue -- a Catalogue to add results to. See ResultsWriter.
 
         """
         self.logger = logger
         self.correlator = correlator
         self.array = array
-        self.sampled_angles = np.linspace(-np.pi, np.pi, 1000)
+        self.sampled_angles = np.linspace(-np.pi, np.pi, num_angles)
         self.last_angle = self.sampled_angles[0]
-        self.frequency_manifolds = {}
+        self.search = search
+        self.coarse_num_angles = coarse_num_angles
+        self.refine_candidates = refine_candidates
+        self.refine_points = refine_points
+        self.tdoa_refine_steps = tdoa_refine_steps
+        self.tdoa_solver = None
+        self.last_residual = None
+        self.binary_results = binary_results
+        self.catalogue = catalogue
+        # log_dir -> ResultsWriter
+        self.results_writers = {}
+        if manifold_cache is None:
+            manifold_cache = ManifoldCache(bin_width = self.correlator_bin_width(),
+                                           cache_dir = manifold_cache_dir,
+                                           logger = self.logger.getChild('manifold_cache'))
+        self.manifold_cache = manifold_cache
         self.set_frequency(frequency)
 
+    def correlator_bin_width(self):
+        """ Width of the correlator's frequency bins in Hz, or None if the
+        correlator doesn't expose them
+        """
+        try:
+            comb = self.correlator.cross_combinations[0]
+            frequency_bins = self.correlator.frequency_correlations[comb].frequency_bins
+            return frequency_bins[1] - frequency_bins[0]
+        except (AttributeError, KeyError, IndexError):
+            return None
+
     def set_frequency(self, frequency):
         # assert that frequency is valid as per correlator specs here
         self.frequency = frequency
-        if self.frequency not in self.frequency_manifolds:
-            manifold = {}
-            for angle in self.sampled_angles:
-                manifold[angle] = self.array.each_pair_phase_difference_at_angle(angle, self.frequency)
-            self.frequency_manifolds[self.frequency] = manifold
-        self.manifold = self.frequency_manifolds[self.frequency]
+        self.domain = 'frequency'
+        # manifolds are (angles x baselines) arrays: row i is the expected
+        # visibility vector for self.sampled_angles[i]
+        if self.search == 'refined':
+            # the refined search only needs the coarse manifold. The full one is
+            # built by grid_manifold if a grid method is used.
+            self.manifold = None
+            num_angles = self.coarse_num_angles
+            if num_angles is None:
+                num_angles = self.array.angles_required(self.frequency)
+            self.coarse_angles = np.linspace(-np.pi, np.pi, num_angles, endpoint = False)
+            self.coarse_manifold = self.manifold_cache.phase_manifold(self.array, self.coarse_angles, self.frequency)
+        else:
+            self.manifold = self.manifold_cache.phase_manifold(self.array, self.sampled_angles, self.frequency)
+
+    def grid_manifold(self):
+        """ The manifold at every one of sampled_angles for the current mode
+        """
+        if self.manifold is None:
+            self.manifold = self.manifold_cache.phase_manifold(self.array, self.sampled_angles, self.frequency)
+        return self.manifold
+
+    def precompute_band(self, f_start, f_stop, processes=None):
+        """ Builds the manifolds for every correlator bin that df_strongest_signal
+        could pick between f_start and f_stop so that changing frequency never
+        has to wait for one.
+        """
+        comb = self.correlator.cross_combinations[0]
+        frequency_bins = self.correlator.frequency_correlations[comb].frequency_bins
+        frequencies = frequency_bins[np.searchsorted(frequency_bins, f_start):
+                                     np.searchsorted(frequency_bins, f_stop)]
+        if self.search == 'refined':
+            # only coarse manifolds, which are small and quick to build so stay in this process
+            frequency = self.frequency
+            for f in frequencies:
+                self.set_frequency(f)
+            self.set_frequency(frequency)
+        else:
+            self.manifold_cache.precompute_band(self.array, self.sampled_angles, frequencies, processes)
 
     def set_time(self):
         """ Goes into time mode
         """
-        self.manifold = {}
-        for angle in self.sampled_angles:
-            self.manifold[angle] = self.array.each_pair_time_difference_at_angle(angle)
+        self.domain = 'time'
+        self.manifold = self.array.each_pair_time_difference_at_angles(self.sampled_angles)
+        if self.search == 'refined':
+            # time differences don't wrap, so there is no aperture based density
+            self.coarse_angles = np.linspace(-np.pi, np.pi, self.coarse_num_angles or 64, endpoint = False)
+            self.coarse_manifold = self.manifold_at_angles(self.coarse_angles)
+        # TDOAs are baseline_vectors . direction / c so the least squares
+        # direction is this (2 x baselines) matrix times the TDOAs
+        self.tdoa_solver = np.linalg.pinv(self.array.baseline_vectors) * scipy.constants.c
+
+    def manifold_at_angles(self, angles):
+        """ Expected visibility vectors at arbitrary angles for the current mode
+        """
+        if self.domain == 'time':
+            return self.array.each_pair_time_difference_at_angles(angles)
+        return self.array.each_pair_phase_difference_at_angles(angles, self.frequency)
 
     def find_closest_point(self, input_vector):
+        if self.search == 'refined':
+            return self.find_closest_point_refined(input_vector)
         closest_angle = self.last_angle - np.pi/6 # go back a bit from last time
         if closest_angle < self.sampled_angles[0]:
             closest_angle = self.sampled_angles[-int((self.sampled_angles[0] - closest_angle) / (self.sampled_angles[1] - self.sampled_angles[0]))]
         last_idx = np.searchsorted(self.sampled_angles, closest_angle)
-        closest_angle = self.sampled_angles[last_idx]
-        #closest_angle = self.manifold.keys()[0]
-        closest_distance = self.distance_between_vectors(input_vector, self.manifold[closest_angle])  
-        for angle_idx in range(last_idx,
-                               last_idx + len(self.sampled_angles)):
-            angle_idx = angle_idx % len(self.sampled_angles)
-            angle = self.sampled_angles[angle_idx]
-            manifold_vector = self.manifold[angle]
-            new_distance = self.distance_between_vectors(input_vector, manifold_vector) 
-            if new_distance < closest_distance:
-                closest_distance = new_distance
-                closest_angle = angle
+        distances = self.distances_to_manifold(input_vector)
+        # scan the circle starting from last_idx so that ties still go to the
+        # first angle found when walking forward from the previous answer
+        closest_idx = (np.argmin(np.roll(distances, -last_idx)) + last_idx) % len(self.sampled_angles)
+        closest_angle = self.sampled_angles[closest_idx]
+        self.last_distance = distances[closest_idx]
         self.last_angle = closest_angle
         return closest_angle
 
+    def find_closest_point_refined(self, input_vector):
+        """ Coarse to fine search. Scans the coarse grid, samples a local grid of
+        refine_points around each of the best refine_candidates coarse minima and
+        fits a parabola through the best local point and its neighbours to get a
+        continuous angle.
+        """
+        distances = self.distance_between_vectors(input_vector, self.coarse_manifold)
+        # local minima on the circular coarse grid
+        minima = np.flatnonzero((distances <= np.roll(distances, 1)) &
+                                (distances <= np.roll(distances, -1)))
+        candidates = minima[np.argsort(distances[minima])][:self.refine_candidates]
+        coarse_step = 2*np.pi / len(self.coarse_angles)
+        offsets = np.linspace(-coarse_step, coarse_step, self.refine_points + 1)
+        fine_step = offsets[1] - offsets[0]
+        # (candidates x refine_points+1) angles around each candidate
+        local_angles = self.coarse_angles[candidates][:, np.newaxis] + offsets
+        local_distances = self.distance_between_vectors(
+            input_vector,
+            self.manifold_at_angles(local_angles.ravel())).reshape(local_angles.shape)
+        candidate, idx = np.unravel_index(np.argmin(local_distances), local_distances.shape)
+        # a minimum on the edge of the local grid has no neighbour on one side, so
+        # only interpolate when it is inside
+        angle = local_angles[candidate, idx]
+        closest_distance = local_distances[candidate, idx]
+        if 0 < idx < self.refine_points:
+            # parabolic interpolation on the squared distance which is smooth at the minimum
+            d_m, d_0, d_p = np.square(local_distances[candidate, idx-1:idx+2])
+            denominator = d_m - 2*d_0 + d_p
+            if denominator > 0:
+                angle += 0.5 * fine_step * (d_m - d_p) / denominator
+        closest_angle = np.mod(angle + np.pi, 2*np.pi) - np.pi
+        self.last_distance = closest_distance
+        self.last_angle = closest_angle
+        return closest_angle
+
+    def solve_tdoa(self, tdoas):
+        """ Angle of arrival straight from one vector of TDOAs, one per baseline.
+        Sets last_residual to the RMS difference in seconds between tdoas and
+        what the array would see from that angle.
+        """
+        angles, residuals = self.solve_tdoas(tdoas)
+        self.last_angle = angles[0]
+        self.last_residual = residuals[0]
+        return angles[0]
+
+    def solve_tdoas(self, tdoas):
+        """ Closed form alternative to searching the time manifold.
+
+        tdoas -- (vectors x baselines) array, or a single vector
+        Returns (angles, residuals). The least squares direction gives the angle
+        which tdoa_refine_steps of Gauss-Newton then fit to the unit circle.
+        residuals is the RMS misfit in seconds of each, a measure of quality.
+        """
+        if self.tdoa_solver is None:
+            self.set_time()
+        tdoas = np.atleast_2d(tdoas)
+        directions = tdoas.dot(self.tdoa_solver.T)
+        angles = np.arctan2(directions[:, 1], directions[:, 0])
+        for step in range(self.tdoa_refine_steps):
+            residuals = tdoas - self.array.each_pair_time_difference_at_angles(angles)
+            # derivative of each baseline's TDOA with respect to the angle
+            jacobian = np.array([-np.sin(angles), np.cos(angles)]).T.dot(
+                self.array.baseline_vectors.T) / scipy.constants.c
+            angles = angles + np.sum(jacobian * residuals, axis = 1) / np.sum(np.square(jacobian), axis = 1)
+        angles = np.mod(angles + np.pi, 2*np.pi) - np.pi
+        residuals = tdoas - self.array.each_pair_time_difference_at_angles(angles)
+        return angles, np.sqrt(np.mean(np.square(residuals), axis = 1))
+
+    def find_closest_points(self, input_vectors, chunk_size=512):
+        """ Batch version of find_closest_point.
+
+        input_vectors -- (vectors x baselines) array, such as all the visibilities
+            from a replayed session at one frequency.
+        chunk_size -- how many vectors to compare against the manifold at once.
+            Bounds the (chunk x angles x baselines) working array.
+
+        Returns an array of the closest angle for each vector. Ties go to the
+        lowest angle rather than depending on the previous answer.
+        """
+        input_vectors = np.atleast_2d(input_vectors)
+        closest_idxs = np.ndarray(len(input_vectors), dtype = int)
+        for start in range(0, len(input_vectors), chunk_size):
+            chunk = input_vectors[start:start + chunk_size]
+            distances = self.distance_between_vectors(chunk[:, np.newaxis, :], self.grid_manifold())
+            closest_idxs[start:start + chunk_size] = np.argmin(distances, axis = 1)
+        closest_angles = self.sampled_angles[closest_idxs]
+        if len(closest_angles) > 0:
+            self.last_angle = closest_angles[-1]
+        return closest_angles
+
+    def distances_to_manifold(self, input_vector):
+        """ Returns the distance from input_vector to every row of the manifold
+        """
+        return self.distance_between_vectors(input_vector, self.grid_manifold())
+
     def distance_between_vectors(self, vec0, vec1):
-        phase_differences = np.arctan2(
-            np.sin(vec0 - vec1),
-            np.cos(vec0 - vec1)
-        )
-        return np.linalg.norm(phase_differences)
+        """ Norm of the wrapped phase differences along the last axis.
+        Broadcasts, so vec1 can be the whole (angles x baselines) manifold.
+        """
+        # force phase to range from -pi to pi
+        phase_differences = np.mod((vec0 - vec1) + np.pi, 2*np.pi) - np.pi
+        return np.sqrt(np.sum(np.square(phase_differences), axis = -1))
 
     def fetch_frequency_crosses(self):
         self.correlator.fetch_crosses()
 
-    def df_strongest_signal(self, f_start, f_stop, log_dir, t = time.time()):
-        freq = self.correlator.frequency_correlations[(0,1)].strongest_frequency_in_range(f_start, f_stop)
+    def results_writer(self, log_dir):
+        if log_dir not in self.results_writers:
+            self.results_writers[log_dir] = ResultsWriter(
+                log_dir,
+                binary = self.binary_results,
+                catalogue = self.catalogue,
+                logger = self.logger.getChild('results'))
+        return self.results_writers[log_dir]
+
+    def close(self):
+        """ Writes out any results still waiting
+        """
+        for writer in self.results_writers.values():
+            writer.close()
+        self.results_writers = {}
+
+    def df_strongest_signal(self, f_start, f_stop, log_dir, t = None, frame = None):
+        """ DFs the strongest signal between f_start and f_stop in the latest
+        correlator output, or in frame (a FrequencyFrame) if given.
+        t defaults to the frame's time, or now.
+        """
+        if frame is None:
+            freq = self.correlator.frequency_correlations[(0,1)].strongest_frequency_in_range(f_start, f_stop)
+        else:
+            freq = frame.strongest_frequency_in_range(f_start, f_stop)
+        if t is None:
+            t = time.time() if frame is None else frame.t
         self.logger.info("Strongest signal in 0x1 correlation: {f} MHz.".format(f = freq/1e6))
         self.set_frequency(freq)
-        visibilities = self.correlator.visibilities_at_frequency(freq)
+        if frame is None:
+            visibilities = self.correlator.visibilities_at_frequency(freq)
+        else:
+            visibilities = frame.visibilities_at_frequency(freq)
         aoa = self.find_closest_point(visibilities)
         self.logger.info("AoA: {aoa}".format(aoa = aoa))
-        with open('{d}/results.txt'.format(d = log_dir), 'a') as f:
-            f.write("{t},{f},{aoa}\n".format(t = t, f = freq, aoa = aoa))
+        self.results_writer(log_dir).write(t, aoa, frequency = freq, quality = self.last_distance)
 
     def df_frequency(self):
         pass
@@ -84,10 +296,17 @@ class DirectionFinder:
     def fetch_impulse(self):
         return self.correlator.impulse_fetch()
 
-    def df_impulse(self, log_dir, t = time.time()):
-        self.correlator.do_time_domain_cross_correlation()
+    def df_impulse(self, log_dir, t = None, frame = None):
+        """ DFs the latest impulse, or the one in frame (an ImpulseFrame) if given.
+        t defaults to the frame's time, or now.
+        """
+        if frame is None:
+            self.correlator.do_time_domain_cross_correlation()
+        else:
+            self.correlator.do_time_domain_cross_correlation(frame.time_domain_signals)
+        if t is None:
+            t = time.time() if frame is None else frame.t
         visibilities = self.correlator.visibilities_from_time()
-        aoa = self.find_closest_point(visibilities)
-        self.logger.info("AoA: {aoa}".format(aoa = aoa))
-        with open('{d}/results.txt'.format(d = log_dir), 'a') as f:
-            f.write("{t},{aoa}\n".format(t = t, aoa = aoa))
+        aoa = self.solve_tdoa(visibilities)
+        self.logger.info("AoA: {aoa}. Residual: {r} ns".format(aoa = aoa, r = self.last_residual*1e9))
+        self.results_writer(log_dir).write(t, aoa, quality = self.last_residual)
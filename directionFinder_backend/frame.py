@@ -0,0 +1,56 @@
+"""
+Self contained copies of what the correlator produced for one update, so that
+they can be recorded and DFed while the correlator is fetching the next one.
+"""
+
+import numpy as np
+
+class FrequencyFrame:
+    def __init__(self, t, cross_combinations, crosses, frequency_bins, acc_len=None, overflows=None):
+        """
+        t -- time the frame was fetched
+        cross_combinations -- list of baselines, eg: [(0, 1), (0, 2), ...]
+        crosses -- (baselines x bins) array of cross correlations in the same order
+        frequency_bins -- frequency in Hz of each bin
+        acc_len -- accumulation length the correlator was set to
+        overflows -- dict of overflow flags as returned by Correlator.get_overflow_state
+        """
+        self.t = t
+        self.cross_combinations = cross_combinations
+        self.crosses = crosses
+        self.frequency_bins = frequency_bins
+        self.acc_len = acc_len
+        self.overflows = overflows
+
+    def signal(self, comb):
+        return self.crosses[self.cross_combinations.index(comb)]
+
+    def strongest_frequency_in_range(self, f_start, f_stop, comb=(0, 1)):
+        """ As Correlation.strongest_frequency_in_range, for one baseline of the frame
+        """
+        idx_start = np.searchsorted(self.frequency_bins, f_start)
+        idx_stop = np.searchsorted(self.frequency_bins, f_stop)
+        subsig = self.signal(comb)[idx_start:idx_stop]
+        offset_to_max = np.argmax(np.abs(subsig))
+        return self.frequency_bins[idx_start + offset_to_max]
+
+    def visibilities_at_frequency(self, f):
+        """ As Correlator.visibilities_at_frequency
+        """
+        bin_width = self.frequency_bins[1] - self.frequency_bins[0]
+        bin_number = int(round((f - self.frequency_bins[0]) / bin_width))
+        return np.angle(self.crosses[:, bin_number])
+
+
+class ImpulseFrame:
+    def __init__(self, t, time_domain_signals, impulse_length=None, detected=None):
+        """
+        t -- time the impulse was fetched
+        time_domain_signals -- (channels x samples) array
+        impulse_length -- length reported by the impulse detector
+        detected -- time the impulse was first seen, if known
+        """
+        self.t = t
+        self.time_domain_signals = time_domain_signals
+        self.impulse_length = impulse_length
+        self.detected = detected
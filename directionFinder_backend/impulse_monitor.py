@@ -0,0 +1,111 @@
+"""
+Watches the impulse detector on the FPGA. Polls quickly straight after arming
+and backs off while nothing happens so an idle system doesn't keep the katcp
+connection busy. Records how long each impulse takes from being seen to
+being DFed.
+"""
+
+import logging
+import collections
+import time
+import numpy as np
+
+class ImpulseMonitor:
+    def __init__(self, correlator, min_interval=1e-3, max_interval=0.1, backoff=1.5,
+                 tight_period=0.5, history=1000, logger=logging.getLogger(__name__)):
+        """
+        correlator -- instance of Correlator
+        min_interval -- seconds between polls straight after arming
+        max_interval -- longest the poll interval backs off to while idle
+        backoff -- factor the poll interval grows by on each idle poll
+        tight_period -- seconds after arming to poll every min_interval before
+            starting to back off
+        history -- how many of the latest latencies the statistics are taken over
+        """
+        self.logger = logger
+        self.correlator = correlator
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.tight_period = tight_period
+        self.interval = min_interval
+        self.armed_at = None
+        self.polls = 0
+        self.detections = 0
+        self.capture_latencies = collections.deque(maxlen = history)
+        self.result_latencies = collections.deque(maxlen = history)
+
+    def arm(self):
+        """ Arms the impulse detector and DRAM capture and goes back to tight polling
+        """
+        self.correlator.impulse_arm()
+        self.rearmed()
+
+    def rearmed(self):
+        self.armed_at = time.time()
+        self.interval = self.min_interval
+
+    def back_off(self):
+        if time.time() - self.armed_at > self.tight_period:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def poll(self):
+        """ Checks once for an impulse. If there was one it is fetched, the
+        detector re-armed and an ImpulseFrame returned. Otherwise waits the
+        current poll interval and returns None. Suits Pipeline's acquire.
+        """
+        if self.armed_at is None:
+            self.arm()
+        self.polls += 1
+        impulse_len = self.correlator.read_impulse_length()
+        if impulse_len == 0:
+            self.back_off()
+            time.sleep(self.interval)
+            return None
+        detected = time.time()
+        # waits for the capture to complete, reads it and re-arms
+        self.correlator.impulse_fetch(impulse_len)
+        self.rearmed()
+        frame = self.correlator.impulse_frame()
+        frame.detected = detected
+        self.detections += 1
+        self.capture_latencies.append(frame.t - detected)
+        return frame
+
+    def wait(self):
+        """ Blocks until there is an impulse and returns its ImpulseFrame
+        """
+        while True:
+            frame = self.poll()
+            if frame is not None:
+                return frame
+
+    def record_result(self, frame):
+        """ Call once frame has been DFed to record the latency from detection
+        """
+        latency = time.time() - frame.detected
+        self.result_latencies.append(latency)
+        self.logger.debug("Impulse DFed {l} ms after detection".format(l = latency*1e3))
+
+    def latency_stats(self, latencies):
+        if len(latencies) == 0:
+            return None
+        latencies = np.array(latencies)
+        return {
+            'mean': np.mean(latencies),
+            'median': np.median(latencies),
+            'p95': np.percentile(latencies, 95),
+            'max': np.max(latencies),
+        }
+
+    def stats(self):
+        return {
+            'polls': self.polls,
+            'detections': self.detections,
+            'interval': self.interval,
+            'capture_latency': self.latency_stats(self.capture_latencies),
+            'result_latency': self.latency_stats(self.result_latencies),
+        }
+
+    def log_stats(self):
+        self.logger.info("Impulse monitor stats: {s}".format(s = self.stats()))
@@ -0,0 +1,199 @@
+"""
+A bounded cache of array manifolds, optionally backed by a directory of
+memory-mappable .npy files so that a restarted process doesn't have to
+rebuild them.
+"""
+
+import numpy as np
+from antenna import Antenna
+from antenna_array import AntennaArray
+import collections
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+
+def build_phase_manifolds(args):
+    """ Pool worker. Fills rows start:stop of the (bins x angles x baselines)
+    .npy file with the manifolds for frequencies[start:stop].
+    Takes positions rather than an AntennaArray so the arguments pickle cheaply.
+    """
+    filename, positions, angles, frequencies, start, stop = args
+    array = AntennaArray([Antenna(x, y) for x, y in positions])
+    band = np.load(filename, mmap_mode = 'r+')
+    for idx in range(start, stop):
+        band[idx] = array.each_pair_phase_difference_at_angles(angles, frequencies[idx])
+    band.flush()
+
+class ManifoldCache:
+    def __init__(self, max_bytes=256*2**20, bin_width=None, cache_dir=None,
+                 logger=logging.getLogger(__name__)):
+        """
+        max_bytes -- memory budget for manifolds held by the cache. Least recently
+            used manifolds get dropped once this is exceeded.
+        bin_width -- width of a correlator frequency bin in Hz. Frequencies are
+            quantised to a bin index so all frequencies in a bin share a manifold.
+            None uses the exact frequency.
+        cache_dir -- directory to persist manifolds to. None keeps them in memory only.
+        """
+        self.logger = logger
+        self.max_bytes = max_bytes
+        self.bin_width = bin_width
+        self.cache_dir = cache_dir
+        self.manifolds = collections.OrderedDict()
+        self.nbytes = 0
+        # precomputed (bins x angles x baselines) blocks. These are memory mapped
+        # so don't count towards max_bytes. Every band of a geometry is kept.
+        # geometry hash -> dict of bin index -> (memmap, row)
+        self.bands = {}
+        self.band_files = []
+        if self.cache_dir is not None and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def geometry_hash(self, array, angles, domain):
+        """ Identifies everything other than frequency that a manifold depends on
+        """
+        h = hashlib.sha1()
+        h.update(domain.encode('ascii'))
+        h.update(np.ascontiguousarray(array.positions, dtype = np.float64).tobytes())
+        h.update(np.ascontiguousarray(angles, dtype = np.float64).tobytes())
+        return h.hexdigest()[:16]
+
+    def bin_index(self, frequency):
+        if self.bin_width is None:
+            return repr(float(frequency))
+        return int(round(frequency / self.bin_width))
+
+    def bin_frequency(self, frequency):
+        """ The frequency the manifold of frequency's bin is built at, so it
+        doesn't depend on which frequency in the bin asked first
+        """
+        if self.bin_width is None:
+            return frequency
+        return self.bin_index(frequency) * self.bin_width
+
+    def key(self, array, angles, domain, frequency):
+        return "{g}_{b}".format(g = self.geometry_hash(array, angles, domain),
+                                b = self.bin_index(frequency))
+
+    def phase_manifold(self, array, angles, frequency):
+        """ The (angles x baselines) phase manifold of array at frequency's bin.
+        Built with array.each_pair_phase_difference_at_angles on a miss.
+        """
+        geometry = self.geometry_hash(array, angles, 'phase')
+        bin_index = self.bin_index(frequency)
+        rows = self.bands.get(geometry, {})
+        if bin_index in rows:
+            band, row = rows[bin_index]
+            return band[row]
+        key = "{g}_{b}".format(g = geometry, b = bin_index)
+        manifold = self.get(key)
+        if manifold is None:
+            manifold = array.each_pair_phase_difference_at_angles(angles, self.bin_frequency(frequency))
+            manifold.flags.writeable = False
+            self.put(key, manifold)
+        return manifold
+
+    def precompute_band(self, array, angles, frequencies, processes=None, chunk_bins=16):
+        """ Builds the phase manifold for every frequency in one contiguous
+        (bins x angles x baselines) memory mapped array, spread over a pool
+        of processes. Later phase_manifold calls for these frequencies return
+        views into it.
+
+        frequencies -- the bin centres to build, normally a slice of Correlation.frequency_bins
+        processes -- size of the process pool. None uses one per CPU.
+        chunk_bins -- how many bins each pool task builds
+        """
+        if len(frequencies) == 0:
+            return None
+        geometry = self.geometry_hash(array, angles, 'phase')
+        bin_indices = [self.bin_index(f) for f in frequencies]
+        frequencies = [self.bin_frequency(f) for f in frequencies]
+        shape = (len(frequencies), len(angles), len(array.baselines))
+        if self.cache_dir is not None:
+            filename = os.path.join(self.cache_dir, "{g}_band_{b0}_{b1}_{n}.npy".format(
+                g = geometry, b0 = bin_indices[0], b1 = bin_indices[-1], n = len(bin_indices)))
+        else:
+            # deleted when the cache is garbage collected
+            band_file = tempfile.NamedTemporaryFile(suffix = '.npy')
+            self.band_files.append(band_file)
+            filename = band_file.name
+        if self.cache_dir is None or not os.path.exists(filename):
+            # build under another name so other processes never map a partial file
+            tmp_filename = filename
+            if self.cache_dir is not None:
+                tmp_filename = "{f}.{pid}.tmp".format(f = filename, pid = os.getpid())
+            np.lib.format.open_memmap(tmp_filename, mode = 'w+', dtype = np.float64, shape = shape).flush()
+            tasks = [(tmp_filename, array.positions, angles, frequencies, start, min(start + chunk_bins, len(frequencies)))
+                     for start in range(0, len(frequencies), chunk_bins)]
+            if processes == 1:
+                for task in tasks:
+                    build_phase_manifolds(task)
+            else:
+                pool = multiprocessing.Pool(processes)
+                try:
+                    pool.map(build_phase_manifolds, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+            if tmp_filename != filename:
+                os.rename(tmp_filename, filename)
+            self.logger.info("Built manifolds for {n} bins into {f}".format(n = len(frequencies), f = filename))
+        band = np.load(filename, mmap_mode = 'r')
+        assert(band.shape == shape)
+        # added to any earlier bands. A bin in more than one comes from the latest.
+        rows = self.bands.setdefault(geometry, {})
+        for row, bin_index in enumerate(bin_indices):
+            rows[bin_index] = (band, row)
+        return band
+
+    def get(self, key):
+        """ Returns the manifold stored under key, or None.
+        Looks on disk if it's not in memory.
+        """
+        if key in self.manifolds:
+            # move to the most recently used end
+            manifold = self.manifolds.pop(key)
+            self.manifolds[key] = manifold
+            return manifold
+        filename = self.filename(key)
+        if filename is not None and os.path.exists(filename):
+            manifold = np.load(filename, mmap_mode = 'r')
+            self.logger.debug("Loaded manifold {k} from {f}".format(k = key, f = filename))
+            self.add(key, manifold)
+            return manifold
+        return None
+
+    def put(self, key, manifold):
+        filename = self.filename(key)
+        if filename is not None:
+            # write then rename so a reader never sees a partial file
+            tmp_filename = "{f}.{pid}.tmp".format(f = filename, pid = os.getpid())
+            with open(tmp_filename, 'wb') as f:
+                np.save(f, manifold)
+            os.rename(tmp_filename, filename)
+            self.logger.debug("Saved manifold {k} to {f}".format(k = key, f = filename))
+        self.add(key, manifold)
+
+    def add(self, key, manifold):
+        if key in self.manifolds:
+            self.nbytes -= self.manifolds.pop(key).nbytes
+        self.manifolds[key] = manifold
+        self.nbytes += manifold.nbytes
+        # always keep the newest one, even if it alone is over budget
+        while self.nbytes > self.max_bytes and len(self.manifolds) > 1:
+            old_key, old_manifold = self.manifolds.popitem(last = False)
+            self.nbytes -= old_manifold.nbytes
+            self.logger.debug("Evicted manifold {k}".format(k = old_key))
+
+    def filename(self, key):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, "{k}.npy".format(k = key))
+
+    def __len__(self):
+        return len(self.manifolds)
+
+    def __contains__(self, key):
+        return key in self.manifolds
@@ -0,0 +1,138 @@
+"""
+Runs a simulation many times at each of several SNRs across a process pool.
+Each (SNR, run) task draws from its own RandomState seeded with
+[seed, snr_idx, run], so results don't depend on how tasks are spread over
+processes or in which order they finish, and any one run can be reproduced on
+its own. Results land in a preallocated (snrs x runs x length) array which can
+be backed by a .npy file to resume an interrupted sweep.
+"""
+
+import numpy as np
+import logging
+import multiprocessing
+import os
+import time
+
+def task_rng(seed, snr_idx, run):
+    """ The RandomState of one (SNR, run) task
+    """
+    return np.random.RandomState([seed, snr_idx, run])
+
+def run_task(args):
+    """ Pool worker. Runs simulate(snr, rng) for one task.
+    simulate must be a module level function so it pickles.
+    """
+    simulate, seed, snr_idx, snr, run = args
+    return snr_idx, run, simulate(snr, task_rng(seed, snr_idx, run))
+
+def wrap_phase(phase):
+    return ((phase + np.pi) % (2*np.pi)) - np.pi
+
+
+class MonteCarloRunner:
+    def __init__(self, simulate, snrs, runs, length, seed=0, processes=None,
+                 results_file=None, flush_interval=10, logger=logging.getLogger(__name__)):
+        """
+        simulate -- module level function of (snr, rng) returning a length long
+            array for one run. rng is a np.random.RandomState, eg for SignalGenerator.
+        snrs -- the SNRs to sweep
+        runs -- runs per SNR
+        length -- length of each run's result
+        seed -- seeds every task's RandomState along with its SNR index and run
+        processes -- size of the pool. None uses every core. 1 runs in this process.
+        results_file -- .npy file to keep results in. Finished runs already in it
+            are skipped, so an interrupted sweep carries on where it stopped.
+            None keeps results in memory.
+        flush_interval -- seconds between flushing results_file to disk
+        """
+        self.logger = logger
+        self.simulate = simulate
+        self.snrs = list(snrs)
+        self.runs = runs
+        self.length = length
+        self.seed = seed
+        self.processes = processes
+        self.results_file = results_file
+        self.flush_interval = flush_interval
+        shape = (len(self.snrs), runs, length)
+        if results_file is None:
+            self.results = np.zeros(shape)
+            self.done = np.zeros(shape[0:2], dtype = bool)
+        else:
+            self.results = self.open_results(results_file, shape, np.float64)
+            self.done = self.open_results(self.done_filename(), shape[0:2], bool)
+            self.logger.info("{n} of {t} runs already done in {f}".format(
+                n = np.count_nonzero(self.done), t = self.done.size, f = results_file))
+
+    def done_filename(self):
+        return "{f}.done.npy".format(f = os.path.splitext(self.results_file)[0])
+
+    def open_results(self, filename, shape, dtype):
+        if os.path.exists(filename):
+            results = np.load(filename, mmap_mode = 'r+')
+            if results.shape == shape and results.dtype == dtype:
+                return results
+            self.logger.warning("{f} is {s} rather than {e}. Starting again.".format(
+                f = filename, s = results.shape, e = shape))
+            del results
+        return np.lib.format.open_memmap(filename, mode = 'w+', dtype = dtype, shape = shape)
+
+    def tasks(self):
+        """ Arguments for run_task of every run not yet done
+        """
+        return [(self.simulate, self.seed, snr_idx, snr, run)
+                for snr_idx, snr in enumerate(self.snrs)
+                for run in range(self.runs)
+                if self.done[snr_idx, run] == False]
+
+    def flush(self):
+        # results before the flags that say they are there
+        if self.results_file is not None:
+            self.results.flush()
+            self.done.flush()
+
+    def run(self):
+        """ Runs every task not yet done, storing results as they come back
+        """
+        tasks = self.tasks()
+        self.logger.info("Running {n} tasks".format(n = len(tasks)))
+        if self.processes == 1:
+            self.collect(run_task(task) for task in tasks)
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                self.collect(pool.imap_unordered(run_task, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        self.flush()
+        return self.results
+
+    def collect(self, results):
+        last_flush = time.time()
+        for count, (snr_idx, run, result) in enumerate(results):
+            self.results[snr_idx, run] = result
+            if time.time() - last_flush > self.flush_interval:
+                self.flush()
+                last_flush = time.time()
+            self.done[snr_idx, run] = True
+            self.logger.debug("SNR {s} run {r} done. {n} this sweep.".format(
+                s = self.snrs[snr_idx], r = run, n = count + 1))
+
+    def rms_error(self, truth, wrap=True):
+        """ (snrs x length) RMS error of the finished runs from truth. wrap
+        takes errors modulo 2 pi, for phases. SNRs with no finished runs are NaN.
+        """
+        rms = np.full((len(self.snrs), self.length), np.nan)
+        for snr_idx in range(len(self.snrs)):
+            finished = np.flatnonzero(self.done[snr_idx])
+            if len(finished) == 0:
+                continue
+            sum_squared = np.zeros(self.length)
+            for run in finished:
+                error = self.results[snr_idx, run] - truth
+                if wrap == True:
+                    error = wrap_phase(error)
+                sum_squared += np.square(error)
+            rms[snr_idx] = np.sqrt(sum_squared / len(finished))
+        return rms
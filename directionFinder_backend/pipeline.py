@@ -0,0 +1,148 @@
+"""
+Runs acquisition, recording and DFing concurrently. An acquisition thread
+produces frames which fan out to stages, each with its own thread and
+bounded queue.
+"""
+
+import logging
+import threading
+import Queue
+import time
+
+class Stage:
+    STOP = object()
+
+    def __init__(self, name, function, maxsize=4, block=True, logger=logging.getLogger(__name__)):
+        """
+        name -- used for the thread name and in statistics
+        function -- called with each frame
+        maxsize -- how many frames can be waiting for this stage
+        block -- True to hold up acquisition when the queue is full (backpressure).
+            False to drop the frame and count it.
+        """
+        self.logger = logger
+        self.name = name
+        self.function = function
+        self.block = block
+        self.queue = Queue.Queue(maxsize)
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = threading.Thread(target = self.run, name = name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, frame):
+        if self.block == True:
+            self.queue.put(frame)
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except Queue.Full:
+            self.dropped += 1
+            self.logger.warning("Dropped a frame. {d} dropped so far".format(d = self.dropped))
+            return False
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is Stage.STOP:
+                return
+            try:
+                self.function(frame)
+            except Exception:
+                self.errors += 1
+                self.logger.exception("Failed to process frame")
+            self.processed += 1
+
+    def stop(self):
+        """ Processes whatever is queued and then ends the thread
+        """
+        self.queue.put(Stage.STOP)
+        self.thread.join()
+
+    def stats(self):
+        return {
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize(),
+        }
+
+
+class Pipeline:
+    def __init__(self, acquire, stages, logger=logging.getLogger(__name__)):
+        """
+        acquire -- called repeatedly in the acquisition thread. Returns a frame,
+            or None if there was nothing to acquire. Raises StopIteration if
+            there never will be anything again.
+        stages -- list of Stage objects which every frame is passed to
+        """
+        self.logger = logger
+        self.acquire = acquire
+        self.stages = stages
+        self.acquired = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target = self.run_acquisition, name = 'acquisition')
+        self.thread.daemon = True
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self.thread.start()
+
+    def run_acquisition(self):
+        while not self.stopping.is_set():
+            try:
+                frame = self.acquire()
+            except StopIteration:
+                # a finite source such as a replay has run out
+                self.logger.info("Nothing left to acquire")
+                self.stopping.set()
+                return
+            except Exception:
+                self.logger.exception("Acquisition failed")
+                self.stopping.set()
+                return
+            if frame is None:
+                continue
+            self.acquired += 1
+            for stage in self.stages:
+                stage.put(frame)
+
+    def stop(self):
+        """ Stops acquiring and lets every stage finish what it has queued
+        """
+        self.stopping.set()
+        self.thread.join()
+        for stage in self.stages:
+            stage.stop()
+        self.log_stats()
+
+    def run(self, stats_interval=60):
+        """ Starts the pipeline and blocks until interrupted or acquisition fails,
+        logging statistics every stats_interval seconds
+        """
+        self.start()
+        try:
+            last_stats = time.time()
+            while self.thread.is_alive():
+                self.thread.join(1)
+                if time.time() - last_stats > stats_interval:
+                    self.log_stats()
+                    last_stats = time.time()
+        except KeyboardInterrupt:
+            self.logger.info("Interrupted. Stopping pipeline")
+        self.stop()
+
+    def stats(self):
+        stats = {'acquired': self.acquired}
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
+
+    def log_stats(self):
+        self.logger.info("Pipeline stats: {s}".format(s = self.stats()))
@@ -0,0 +1,228 @@
+"""
+Stands in for a Correlator by playing back recorded frames, so the DF stack
+can be run and profiled against captured data without a ROACH. Reads the
+df_raw directories written by save_frequency_correlations and
+save_time_domain_snapshots as well as SessionRecorder sessions.
+"""
+
+import numpy as np
+from correlation import Correlation
+from correlator import Correlator
+from frame import FrequencyFrame, ImpulseFrame
+from session_recorder import SessionReader, session_indexes
+from calibration_store import CalibrationCache
+import glob
+import itertools
+import logging
+import os
+import time
+
+def frames_from_directories(path, cross_combinations, fs):
+    """ Yields a frame for each per-frame directory in path, oldest first.
+    The directories are named by the time they were saved.
+    """
+    times = []
+    for name in os.listdir(path):
+        try:
+            times.append((float(name), name))
+        except ValueError:
+            continue
+    for t, name in sorted(times):
+        full_dir = os.path.join(path, name)
+        if os.path.exists(os.path.join(full_dir, '0x1.npy')):
+            crosses = np.array([np.load(os.path.join(full_dir, "{a}x{b}.npy".format(a = a, b = b)))
+                                for a, b in cross_combinations])
+            frequency_bins = np.linspace(0, fs/2, crosses.shape[1], endpoint = False)
+            yield FrequencyFrame(t, cross_combinations, crosses, frequency_bins)
+        else:
+            channels = len(glob.glob(os.path.join(full_dir, '*.npy')))
+            signals = np.array([np.load(os.path.join(full_dir, "{c}.npy".format(c = chan)))
+                                for chan in range(channels)])
+            yield ImpulseFrame(t, signals)
+
+def recorded_frames(path, cross_combinations, fs):
+    """ Frames from a session index, or from a directory of sessions or of
+    per-frame directories
+    """
+    if os.path.isfile(path):
+        return SessionReader(path).frames()
+    indexes = session_indexes(path)
+    if len(indexes) > 0:
+        return itertools.chain(*[SessionReader(index).frames() for index in indexes])
+    return frames_from_directories(path, cross_combinations, fs)
+
+
+class ReplayCorrelation(Correlation):
+    def __init__(self, comb, f_start, f_stop, num_bins, logger=logging.getLogger(__name__)):
+        """ A Correlation whose signal is filled in by ReplayCorrelator rather
+        than read from snapshots
+        """
+        self.logger = logger
+        self.comb = comb
+        self.f_start = np.uint64(f_start)
+        self.f_stop = np.uint64(f_stop)
+        self.calibration_phase_offsets = None
+        self.calibration_cable_length_offsets = None
+        self.calibration_correction = None
+        self.signal_buffer = np.zeros(num_bins, dtype = np.complex128)
+        self.signal = self.signal_buffer.view()
+        self.signal.flags.writeable = False
+        self.frequency_bins = np.linspace(
+            start = self.f_start,
+            stop = self.f_stop,
+            num = num_bins,
+            endpoint = False)
+
+    def arm(self):
+        pass
+
+    def fetch_signal(self):
+        pass
+
+
+class ReplayCorrelator(Correlator):
+    def __init__(self, path, num_channels=4, fs=800e6, realtime=False, speed=1.0,
+                 num_bins=1024, calibration_cache_dir=None, logger=logging.getLogger(__name__)):
+        """ Plays back a recording through the parts of the Correlator interface
+        that DirectionFinder and the run script use.
+
+        path -- a session's .json index, or a directory of sessions or of the
+            per-frame directories in df_raw
+        realtime -- False to hand out frames as fast as they are asked for. True
+            to pace them by the times they were recorded at.
+        speed -- how many times faster than real time to pace frames
+        num_bins -- frequency bins per correlation if the recording has no
+            frequency frames to take it from. Calibrations still need them.
+        calibration_cache_dir -- as for Correlator
+        """
+        self.logger = logger
+        self.path = path
+        self.fpga = None
+        self.num_channels = num_channels
+        self.fs = np.float64(fs)
+        self.realtime = realtime
+        self.speed = speed
+        self.cross_combinations = list(itertools.combinations(range(num_channels), 2))
+        self.auto_combinations = []
+        self.acc_len = None
+        self.overflows = None
+        self.frames = recorded_frames(path, self.cross_combinations, self.fs)
+        self.pending = None
+        self.replayed = 0
+        # wall clock time and recorded time of the first frame
+        self.start = None
+        self.frame_t = None
+        self.frequency_correlations = {}
+        self.calibration_corrections = None
+        self.calibration_cache = CalibrationCache(calibration_cache_dir, self.logger.getChild('calibration_cache'))
+        self.init_time_domain_processing()
+        first = self.peek_frame()
+        if isinstance(first, FrequencyFrame):
+            num_bins = first.crosses.shape[1]
+        self.setup_correlations(num_bins)
+
+    def next_frame(self):
+        """ Takes the next frame off the recording. Raises StopIteration at the end.
+        """
+        frame = self.peek_frame()
+        self.pending = None
+        self.replayed += 1
+        self.frame_t = frame.t
+        return frame
+
+    def peek_frame(self):
+        if self.pending is None:
+            self.pending = next(self.frames)
+        return self.pending
+
+    def time_until(self, frame):
+        """ Seconds until frame is due. Always 0 if not pacing.
+        """
+        if self.realtime == False:
+            return 0
+        if self.start is None:
+            self.start = (time.time(), frame.t)
+        wall_start, recorded_start = self.start
+        return (wall_start + (frame.t - recorded_start) / self.speed) - time.time()
+
+    def wait_for(self, frame):
+        delay = self.time_until(frame)
+        if delay > 0:
+            time.sleep(delay)
+
+    def setup_correlations(self, num_bins):
+        """ Makes the Correlation objects once the number of bins is known
+        """
+        for comb in self.cross_combinations:
+            self.frequency_correlations[comb] = ReplayCorrelation(
+                comb = comb,
+                f_start = 0,
+                f_stop = self.fs/2,
+                num_bins = num_bins,
+                logger = self.logger.getChild("{a}x{b}".format(a = comb[0], b = comb[1])))
+        self.share_signal_buffers()
+
+    def fetch_crosses(self):
+        frame = self.next_frame()
+        assert(isinstance(frame, FrequencyFrame))
+        self.wait_for(frame)
+        self.crosses[:] = frame.crosses
+        self.acc_len = frame.acc_len
+        self.overflows = frame.overflows
+
+    def fetch_all(self):
+        self.fetch_crosses()
+
+    def frequency_frame(self):
+        frame = Correlator.frequency_frame(self)
+        frame.t = self.frame_t
+        return frame
+
+    def read_impulse_length(self):
+        """ Length of the next recorded impulse if it is due, otherwise 0
+        """
+        frame = self.peek_frame()
+        if self.time_until(frame) > 0:
+            return 0
+        if frame.impulse_length is None or frame.impulse_length <= 0:
+            # not recorded. Anything non zero says there is an impulse.
+            return 1
+        return frame.impulse_length
+
+    def impulse_fetch(self, impulse_len=None):
+        if impulse_len is None:
+            impulse_len = self.read_impulse_length()
+        if impulse_len == 0:
+            return False
+        frame = self.next_frame()
+        assert(isinstance(frame, ImpulseFrame))
+        self.impulse_length = impulse_len
+        self.time_domain_signals = frame.time_domain_signals
+        return True
+
+    def impulse_frame(self):
+        frame = Correlator.impulse_frame(self)
+        frame.t = self.frame_t
+        return frame
+
+    def fetch_time_domain_snapshot(self, force=False):
+        self.impulse_fetch(self.read_impulse_length() or 1)
+
+    # Nothing to configure on a recording. These keep the run script's calls working.
+    def impulse_arm(self):
+        pass
+
+    def set_accumulation_len(self, acc_len):
+        self.logger.info("Replaying. Ignoring accumulation length of {l}".format(l = acc_len))
+
+    def re_sync(self):
+        pass
+
+    def set_impulse_setpoint(self, level):
+        pass
+
+    def set_impulse_filter_len(self, length):
+        pass
+
+    def get_overflow_state(self):
+        return self.overflows
@@ -0,0 +1,118 @@
+"""
+Collects DF results in memory and writes them out in batches on a background
+thread. Keeps writing results.txt in the existing formats, and can also append
+each column to its own binary file which load_results maps straight into arrays.
+"""
+
+import numpy as np
+import logging
+import os
+import threading
+
+COLUMNS = ['t', 'frequency', 'aoa', 'quality']
+
+def column_filename(log_dir, column):
+    return os.path.join(log_dir, "results.{c}.f8".format(c = column))
+
+def load_results(log_dir):
+    """ Dict of column name -> float64 array from the binary results in log_dir.
+    The arrays are memory mapped. Impulse results have a frequency of NaN.
+    """
+    lengths = [os.path.getsize(column_filename(log_dir, column)) // 8 for column in COLUMNS]
+    # a column may be a row ahead if this is read mid flush
+    rows = min(lengths)
+    results = {}
+    for column in COLUMNS:
+        if rows == 0:
+            results[column] = np.array([], dtype = '<f8')
+        else:
+            results[column] = np.memmap(column_filename(log_dir, column), dtype = '<f8',
+                                        mode = 'r', shape = (rows,))
+    return results
+
+
+class ResultsWriter:
+    def __init__(self, log_dir, binary=False, flush_rows=1000, flush_interval=5, catalogue=None,
+                 logger=logging.getLogger(__name__)):
+        """
+        log_dir -- directory results.txt (and the binary columns) go in
+        binary -- True to also write the columns of COLUMNS to results.<column>.f8
+        flush_rows -- flush once this many results are waiting
+        flush_interval -- seconds after which waiting results are flushed anyway
+        catalogue -- a Catalogue to add each batch of results to once written
+        """
+        self.logger = logger
+        self.log_dir = log_dir
+        self.binary = binary
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.catalogue = catalogue
+        self.rows = []
+        self.written = 0
+        self.lock = threading.Lock()
+        # keeps the rows of concurrent flushes in order
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target = self.run, name = 'results_writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, t, aoa, frequency=None, quality=None):
+        """ Queues one result. frequency is None for impulses.
+        """
+        with self.lock:
+            self.rows.append((t, frequency, aoa, quality))
+            full = len(self.rows) >= self.flush_rows
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while not self.closing:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception("Failed to write results")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows = self.rows
+                self.rows = []
+            if len(rows) > 0:
+                self.write_rows(rows)
+
+    def write_rows(self, rows):
+        lines = []
+        for t, frequency, aoa, quality in rows:
+            # repr keeps all of t. str only keeps 12 significant digits, 10 ms.
+            if frequency is None:
+                lines.append("{t},{aoa}\n".format(t = repr(float(t)), aoa = aoa))
+            else:
+                lines.append("{t},{f},{aoa}\n".format(t = repr(float(t)), f = frequency, aoa = aoa))
+        with open(os.path.join(self.log_dir, 'results.txt'), 'a') as f:
+            f.write(''.join(lines))
+        if self.binary == True:
+            columns = np.array([[np.nan if value is None else value for value in row] for row in rows],
+                               dtype = '<f8')
+            for idx, column in enumerate(COLUMNS):
+                with open(column_filename(self.log_dir, column), 'ab') as f:
+                    f.write(columns[:, idx].tobytes())
+        self.written += len(rows)
+        if self.catalogue is not None:
+            if self.binary == True:
+                source = column_filename(self.log_dir, 't')
+            else:
+                source = os.path.join(self.log_dir, 'results.txt')
+            self.catalogue.add_results(rows, source, self.written)
+        self.logger.debug("Wrote {n} results".format(n = len(rows)))
+
+    def close(self):
+        """ Writes whatever is waiting and stops the background thread
+        """
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
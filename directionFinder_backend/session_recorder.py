@@ -0,0 +1,343 @@
+"""
+Records a session of frames into a few large, preallocated .npy files of fixed
+size records rather than a directory of small files per frame. A JSON index
+says which files make up the session and how many records each holds, so a
+reader can memory map them without copying.
+
+Impulse signals and compressed spectra vary in length, so they are appended
+to a .dat payload file alongside each .npy file and their records hold where
+they start. Each payload is padded to a multiple of 8 bytes so views of it
+are aligned.
+"""
+
+import numpy as np
+from frame import FrequencyFrame, ImpulseFrame
+from spectrum_codec import SpectrumCodec
+import glob
+import json
+import logging
+import os
+import time
+
+# bit of the overflows field for each flag of Correlator.get_overflow_state,
+# in the same order as the status register
+OVERFLOW_BITS = ['adc', 'acc', 'fft']
+# set when the frame didn't say what its overflow state was
+OVERFLOW_UNKNOWN = 1 << 7
+
+def pack_overflows(overflows):
+    if overflows is None:
+        return OVERFLOW_UNKNOWN
+    flags = 0
+    for bit, name in enumerate(OVERFLOW_BITS):
+        if overflows.get(name) == True:
+            flags |= 1 << bit
+    return flags
+
+def unpack_overflows(flags):
+    if flags & OVERFLOW_UNKNOWN:
+        return None
+    return dict((name, bool(flags & (1 << bit))) for bit, name in enumerate(OVERFLOW_BITS))
+
+def frequency_record_dtype(num_baselines, num_bins, codec=None):
+    if codec is None:
+        codec = SpectrumCodec()
+    return np.dtype([('t', '<f8'),
+                     ('acc_len', '<i8'),
+                     ('overflows', 'u1')] +
+                    codec.fields(num_baselines, num_bins))
+
+def impulse_record_dtype():
+    # the (channels x length) signals start offset bytes into the payload file
+    return np.dtype([('t', '<f8'),
+                     ('impulse_length', '<i8'),
+                     ('length', '<i8'),
+                     ('offset', '<i8')])
+
+def padded_length(nbytes):
+    return (nbytes + 7) // 8 * 8
+
+def session_indexes(path):
+    """ The SessionRecorder indexes in path, oldest first
+    """
+    indexes = []
+    for filename in glob.glob(os.path.join(path, '*.json')):
+        try:
+            with open(filename) as f:
+                index = json.load(f)
+        except ValueError:
+            continue
+        if isinstance(index, dict) and 'files' in index and 'kind' in index:
+            indexes.append(filename)
+    return sorted(indexes)
+
+
+class SessionRecorder:
+    def __init__(self, path, session=None, max_bytes=2**30, max_samples=None, max_records=2**16,
+                 signal_dtype=np.float32, fsync_interval=10, codec='complex128', codec_level=1,
+                 catalogue=None, logger=logging.getLogger(__name__)):
+        """
+        path -- directory to write the session to
+        session -- name the files are prefixed with. (default: the start time)
+        max_bytes -- size each file is preallocated to, or that a payload file
+            may grow to. A new file is started once one is full.
+        max_samples -- samples per channel kept of each impulse. Longer captures
+            are truncated. (default: all of them)
+        max_records -- records each file has room for when they keep their data
+            in a payload file
+        signal_dtype -- what impulse signals are stored as
+        fsync_interval -- seconds between flushing the data and index to disk
+        codec -- how frequency records store the crosses. One of spectrum_codec.CODECS
+        codec_level -- zlib level for the compressing codecs
+        catalogue -- a Catalogue to add each recorded frame to
+        """
+        self.logger = logger
+        self.path = path
+        self.session = session if session is not None else "{t:.3f}".format(t = time.time())
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.max_records = max_records
+        self.signal_dtype = signal_dtype
+        self.fsync_interval = fsync_interval
+        self.codec = SpectrumCodec(codec, codec_level)
+        self.index = None
+        self.records = None
+        self.payload = None
+        self.payload_bytes = 0
+        # records in the session so far
+        self.recorded = 0
+        self.catalogue = catalogue
+        self.last_sync = time.time()
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def index_filename(self):
+        return os.path.join(self.path, "{s}.json".format(s = self.session))
+
+    def start(self, kind, dtype, metadata, payload=False):
+        """ Sets up the index from the first frame
+        payload -- whether records keep their data in a payload file
+        """
+        self.index = {
+            'version': 1,
+            'kind': kind,
+            'dtype': dtype.descr,
+            'files': [],
+        }
+        self.index.update(metadata)
+        self.dtype = dtype
+        self.uses_payload = payload
+        if payload == True:
+            self.capacity = self.max_records
+        else:
+            self.capacity = max(1, self.max_bytes // dtype.itemsize)
+
+    def rotate(self):
+        """ Closes the current file and preallocates the next one
+        """
+        self.flush()
+        if self.payload is not None:
+            self.payload.close()
+            self.payload = None
+        name = "{s}_{n:04d}".format(s = self.session, n = len(self.index['files']))
+        entry = {'name': "{n}.npy".format(n = name), 'records': 0, 't_start': None, 't_stop': None}
+        self.records = np.lib.format.open_memmap(os.path.join(self.path, entry['name']), mode = 'w+',
+                                                 dtype = self.dtype, shape = (self.capacity,))
+        if self.uses_payload == True:
+            entry['payload'] = "{n}.dat".format(n = name)
+            entry['payload_bytes'] = 0
+            self.payload = open(os.path.join(self.path, entry['payload']), 'wb')
+            self.payload_bytes = 0
+        self.index['files'].append(entry)
+        self.write_index()
+        self.logger.info("Recording to {f}".format(f = entry['name']))
+
+    def next_record(self, t, payload_bytes=0):
+        """ The next free record, rotating if the current file is full or its
+        payload file has no room for payload_bytes more
+        """
+        if self.records is None or self.index['files'][-1]['records'] == self.capacity or \
+           (self.payload_bytes > 0 and self.payload_bytes + payload_bytes > self.max_bytes):
+            self.rotate()
+        entry = self.index['files'][-1]
+        record = self.records[entry['records']]
+        entry['records'] += 1
+        self.recorded += 1
+        if entry['t_start'] is None:
+            entry['t_start'] = t
+        entry['t_stop'] = t
+        return record
+
+    def append_payload(self, data):
+        """ Appends data, padded to a multiple of 8 bytes, to the payload file.
+        Returns the offset it starts at.
+        """
+        offset = self.payload_bytes
+        self.payload.write(data)
+        padding = padded_length(len(data)) - len(data)
+        self.payload.write(b'\0' * padding)
+        self.payload_bytes += len(data) + padding
+        self.index['files'][-1]['payload_bytes'] = self.payload_bytes
+        return offset
+
+    def record(self, frame):
+        """ Appends frame, a FrequencyFrame or ImpulseFrame, to the session
+        """
+        if isinstance(frame, ImpulseFrame):
+            self.record_impulse_frame(frame)
+        else:
+            self.record_frequency_frame(frame)
+        if self.catalogue is not None:
+            self.catalogue.add_frame(frame, self.index_filename(), self.recorded - 1)
+        if time.time() - self.last_sync > self.fsync_interval:
+            self.sync()
+
+    def record_frequency_frame(self, frame):
+        if self.index is None:
+            self.start('frequency',
+                       frequency_record_dtype(frame.crosses.shape[0], frame.crosses.shape[1], self.codec),
+                       {'cross_combinations': [list(comb) for comb in frame.cross_combinations],
+                        'frequency_bins': list(frame.frequency_bins),
+                        'codec': self.codec.name},
+                       payload = self.codec.compressed)
+        # room for the worst case, as the payload isn't compressed until there's a record for it
+        record = self.next_record(frame.t, padded_length(self.codec.payload_bound(*frame.crosses.shape)))
+        record['t'] = frame.t
+        record['acc_len'] = frame.acc_len if frame.acc_len is not None else -1
+        record['overflows'] = pack_overflows(frame.overflows)
+        payload = self.codec.encode_into(record, frame.crosses)
+        if payload is not None:
+            record['offset'] = self.append_payload(payload)
+
+    def record_impulse_frame(self, frame):
+        signals = frame.time_domain_signals
+        signal_dtype = np.dtype(self.signal_dtype).newbyteorder('<')
+        if self.index is None:
+            self.start('impulse', impulse_record_dtype(),
+                       {'num_channels': len(signals), 'signal_dtype': signal_dtype.str},
+                       payload = True)
+        length = signals.shape[1]
+        if self.max_samples is not None and length > self.max_samples:
+            self.logger.warning("Truncating impulse of {l} samples to {m}".format(
+                l = length, m = self.max_samples))
+            length = self.max_samples
+        data = np.ascontiguousarray(signals[:, 0:length], dtype = signal_dtype).tobytes()
+        record = self.next_record(frame.t, padded_length(len(data)))
+        record['t'] = frame.t
+        record['impulse_length'] = frame.impulse_length if frame.impulse_length is not None else -1
+        record['length'] = length
+        record['offset'] = self.append_payload(data)
+
+    def write_index(self):
+        # write then rename so a reader never sees a partial index
+        filename = self.index_filename()
+        tmp_filename = "{f}.tmp".format(f = filename)
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.index, f, indent = 2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_filename, filename)
+
+    def flush(self):
+        # payloads before the records which point into them
+        if self.payload is not None:
+            self.payload.flush()
+            os.fsync(self.payload.fileno())
+        if self.records is not None:
+            self.records.flush()
+
+    def sync(self):
+        """ Flushes the payloads and records to disk, then the index which
+        counts them
+        """
+        self.flush()
+        if self.index is not None:
+            self.write_index()
+        self.last_sync = time.time()
+
+    def close(self):
+        self.sync()
+        if self.payload is not None:
+            self.payload.close()
+            self.payload = None
+        self.records = None
+
+
+class SessionReader:
+    def __init__(self, index_filename, logger=logging.getLogger(__name__)):
+        """ Opens a session written by SessionRecorder. Records are memory mapped
+        so reading them doesn't copy anything until they are used.
+        index_filename -- the session's .json index
+        """
+        self.logger = logger
+        self.path = os.path.dirname(index_filename)
+        with open(index_filename) as f:
+            self.index = json.load(f)
+        self.kind = self.index['kind']
+        # only as many records as the index has counted. The rest of each
+        # preallocated file is unused or not yet synced.
+        self.files = [np.load(os.path.join(self.path, entry['name']), mmap_mode = 'r')[0:entry['records']]
+                      for entry in self.index['files'] if entry['records'] > 0]
+        self.offsets = np.cumsum([0] + [len(records) for records in self.files])
+        # likewise only the payload bytes the index has counted
+        self.payloads = [np.memmap(os.path.join(self.path, entry['payload']), dtype = np.uint8, mode = 'r',
+                                   shape = (entry['payload_bytes'],))
+                         if entry.get('payload_bytes', 0) > 0 else np.zeros(0, dtype = np.uint8)
+                         for entry in self.index['files'] if entry['records'] > 0]
+        if self.kind == 'frequency':
+            self.cross_combinations = [tuple(comb) for comb in self.index['cross_combinations']]
+            self.frequency_bins = np.array(self.index['frequency_bins'])
+            self.codec = SpectrumCodec(self.index.get('codec', 'complex128'))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        """ The idx'th record of the session as a numpy record
+        """
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        file_idx = self.file_index(idx)
+        return self.files[file_idx][idx - self.offsets[file_idx]]
+
+    def file_index(self, idx):
+        return np.searchsorted(self.offsets, idx, side = 'right') - 1
+
+    def times(self):
+        return np.concatenate([records['t'] for records in self.files]) if self.files else np.array([])
+
+    def frame(self, idx):
+        """ The idx'th record as a FrequencyFrame or ImpulseFrame. The frame's
+        arrays are views of the file, unless a codec other than complex128 has
+        to decode the crosses.
+        """
+        if idx < 0:
+            idx += len(self)
+        record = self[idx]
+        if self.kind == 'frequency':
+            payload = None
+            if self.codec.compressed == True:
+                start = int(record['offset'])
+                payload = self.payloads[self.file_index(idx)][start:start + int(record['length'])].tobytes()
+            return FrequencyFrame(t = float(record['t']),
+                                  cross_combinations = self.cross_combinations,
+                                  crosses = self.codec.decode(record, (len(self.cross_combinations),
+                                                                       len(self.frequency_bins)), payload),
+                                  frequency_bins = self.frequency_bins,
+                                  acc_len = int(record['acc_len']),
+                                  overflows = unpack_overflows(int(record['overflows'])))
+        signal_dtype = np.dtype(str(self.index['signal_dtype']))
+        shape = (self.index['num_channels'], int(record['length']))
+        start = int(record['offset'])
+        payload = self.payloads[self.file_index(idx)]
+        signals = payload[start:start + shape[0] * shape[1] * signal_dtype.itemsize] \
+                    .view(signal_dtype).reshape(shape)
+        return ImpulseFrame(t = float(record['t']),
+                            time_domain_signals = signals,
+                            impulse_length = int(record['impulse_length']))
+
+    def frames(self):
+        for idx in range(len(self)):
+            yield self.frame(idx)
@@ -15,6 +15,7 @@ class SignalGenerator:
                  fft_bits = 18,
                  impulse_length = 1000, impulse_snr = 1,
                  impulse_offsets = np.zeros(4),
+                 rng = None,
                  logger = logging.getLogger(__name__)):
         """ Creates a signal generator instance
         
@@ -29,6 +30,8 @@ class SignalGenerator:
         bits -- when quantising time domain signal, how many bits to quantise to.
         samples -- when generating vectors, how many samples per channel.
         fft_bits -- when quantising output of FFT, how many bits to quantise to.
+        rng -- np.random.RandomState to draw noise from. None uses the global
+            np.random state.
         """
         self.logger = logger
         self.num_channels = num_channels
@@ -41,6 +44,7 @@ class SignalGenerator:
         self.fft_bits = fft_bits
         self.impulse_length = impulse_length
         self.impulse_snr = impulse_snr
+        self.rng = rng if rng is not None else np.random
         assert(snr <= 1)
         assert(phase_shifts.size == num_channels)
         assert(amplitude_scales.size == num_channels)
@@ -62,6 +66,47 @@ class SignalGenerator:
             cross = spectrums[a] * np.conj(spectrums[b])
             self.frequency_correlations[(a, b)].update(cross)
 
+    def bin_index(self, f):
+        """ The rfft bin closest to f, as a fraction of the sample frequency.
+        Same as SignalGeneratorCorrelation.bin_at_freq picks.
+        """
+        return int(round(f * self.samples))
+
+    def fetch_crosses_batch(self, count, bins=None):
+        """ count integrations' cross spectra as a (count x crosses x bins) array
+        with the crosses in cross_combinations order.
+        bins -- indices of the bins to keep. None keeps them all.
+        """
+        spectrums = self.generate_quantised_spectrums_batch(count)
+        if bins is not None:
+            spectrums = spectrums[..., bins]
+        a_idx = [a for a, b in self.cross_combinations]
+        b_idx = [b for a, b in self.cross_combinations]
+        return spectrums[:, a_idx] * np.conj(spectrums[:, b_idx])
+
+    def iter_crosses(self, count, bins=None, chunk_size=1024):
+        """ fetch_crosses_batch for count integrations in chunks of at most
+        chunk_size, so only a chunk's time domain signals are in memory at once
+        """
+        for start in range(0, count, chunk_size):
+            yield self.fetch_crosses_batch(min(chunk_size, count - start), bins)
+
+    def accumulate_crosses(self, count, bins=None, chunk_size=1024):
+        """ Running sum of the cross spectra after each of count integrations,
+        as a (count x crosses x bins) array. Pass bins to keep this small.
+        """
+        accumulated = None
+        done = 0
+        for crosses in self.iter_crosses(count, bins, chunk_size):
+            if accumulated is None:
+                accumulated = np.empty((count, ) + crosses.shape[1:], dtype = crosses.dtype)
+            chunk = accumulated[done:done + len(crosses)]
+            np.cumsum(crosses, axis = 0, out = chunk)
+            if done > 0:
+                chunk += accumulated[done - 1]
+            done += len(crosses)
+        return accumulated
+
     def set_impulse_len(self, length):
         self.impulse_length = length
 
@@ -74,7 +119,7 @@ class SignalGenerator:
         pre_delay = 256 * 4
         impulse = np.concatenate((
             np.zeros(pre_delay),
-            np.random.normal(loc = 0,
+            self.rng.normal(loc = 0,
                              scale = self.noise_stddev * 127 * self.impulse_snr,
                              size = self.impulse_length),
             np.zeros(pre_delay)
@@ -84,7 +129,7 @@ class SignalGenerator:
                                                len(impulse)),
                                                dtype = np.int8)
         for chan in range(self.num_channels):
-            noise = np.random.normal(loc = 0, 
+            noise = self.rng.normal(loc = 0, 
                                      scale = self.noise_stddev * 127,
                                      size = len(impulse))
             noise = noise.clip(-128, 127)
@@ -95,12 +140,20 @@ class SignalGenerator:
 
 
     def generate(self):
-        signals = np.ndarray((self.num_channels, self.samples))
-        for channel in range(self.num_channels):
-            signals[channel] = self.generate_tone(channel)
-            signals[channel] += self.generate_noise()
+        return self.generate_batch(1)[0]
+
+    def generate_batch(self, count):
+        """ count integrations' signals as a (count x channels x samples) array
+        """
+        signals = self.rng.normal(0, self.noise_stddev, (count, self.num_channels, self.samples))
+        signals += self.generate_tones()
         return signals
 
+    def generate_tones(self):
+        """ (channels x samples) of each channel's tone
+        """
+        return np.array([self.generate_tone(channel) for channel in range(self.num_channels)])
+
     def generate_tone(self, channel):
         #x = np.linspace(start = self.phase_shifts[channel],
         #                stop = self.phase_shifts[channel] + (2*np.pi * self.tone_freq * self.samples),
@@ -118,7 +171,7 @@ class SignalGenerator:
         return (self.amplitude_scales[channel] * amplitude) * tone
 
     def generate_noise(self):
-        return np.random.normal(0, self.noise_stddev, self.samples)
+        return self.rng.normal(0, self.noise_stddev, self.samples)
 
     def quantise(self, signal):
         """ Quantising process is:
@@ -163,3 +216,9 @@ class SignalGenerator:
         spectrums = np.fft.rfft(signals)
         #spectrums = self.quantise_spectrum(spectrums)
         return spectrums
+
+    def generate_quantised_spectrums_batch(self, count):
+        """ (count x channels x bins) spectra of count integrations
+        """
+        signals = self.quantise(self.generate_batch(count))
+        return np.fft.rfft(signals, axis = -1)
@@ -5,6 +5,8 @@ functions on the data received
 
 import numpy as np
 import logging
+import threading
+import Queue
 import time
 
 class Snapshot:
@@ -21,41 +23,124 @@ class Snapshot:
         self.name = name
         self.dtype = dtype
         self.cvalue = cvalue
+        # how long a forced DRAM capture takes to fill before reading it
+        self.dram_capture_wait = 0.1
 
-    def unpack_signal(self, raw):
+    def unpack_signal(self, raw, out=None):
+        """ Interprets raw as per #dtype and #cvalue.
+        'out' is an optional complex128 array to decode complex values into
+        rather than allocating a new one.
+        """
         components = np.frombuffer(raw, self.dtype)
         if self.cvalue == True:  # we need to convert to array of complex floats
-            components = components.astype(np.float64)  # convert each element from int to floats
-            components.dtype = np.complex128  # now view as complex pairs of 2x 64bit floats
+            if out is None:
+                out = np.empty(len(components) // 2, dtype = np.complex128)
+            # view the output as pairs of 2x 64bit floats and convert each element
+            # from int straight into it
+            out.view(np.float64)[:] = components
+            return out
         return components
 
     def arm(self):
         self.fpga.snapshot_arm(self.name)
         self.logger.debug("Armed snapshot: {n}".format(n = self.name))
 
-    def fetch_signal(self, force=False):
+    def fetch_signal(self, force=False, fpga=None):
         """ Returns an numpy array object containing the samples from the snap block
         interpreted as per #dtype and #cvalue
         'force' will get the whole snap if DRAM or will force capture on a BRAM snap
+        'fpga' is the katcp connection to read a BRAM snap over. Defaults to the one
+        this snapshot was made with. Arming always uses that one.
+        """
+        self.signal = self.unpack_signal(self.fetch_raw(force, fpga))
+        self.logger.debug("A signal of length {l} was read".format(
+            n = self.name, l = len(self.signal)))
+        return self.signal
+
+    def fetch_raw(self, force=False, fpga=None):
+        """ As fetch_signal but doesn't interpret the data. Returns the raw
+        bytes, which are also kept in self.raw.
         """
+        if fpga is None:
+            fpga = self.fpga
         if self.name == 'dram_snapshot':
             if force == True:
-                # maximum of 2**21 bytes or 2**19 per channel
-                self.fpga.snapshot_arm(self.name, man_valid=True, man_trig=True)
-                time.sleep(0.1)
-                raw = self.fpga.read_dram(2**21)
-            else:
-                # four samples per FPGA clock cycle
-                pre_delay = 256 * 4
-                impulse_len = self.fpga.read_uint('impulse_length') * 4
-                # equal delay on either side of signal
-                to_fetch = pre_delay + impulse_len + pre_delay
-                to_fetch *= 4   # 4 simultaneous inputs
-                # maximum of 2**21 bytes or 2**19 per channel
-                to_fetch = min(2**21, to_fetch)
-                raw = self.fpga.read_dram(to_fetch)
+                self.force_dram_capture()
+            raw = self.fpga.read_dram(self.dram_length(force))
         else:
-            raw = self.fpga.snapshot_get(self.name, man_valid=force, man_trig=force, wait_period=12, arm=force)['data']
-        self.signal = self.unpack_signal(raw)
-        self.logger.debug("A signal of length {l} was read".format(
-            n = self.name, l = len(self.signal)))
+            raw = fpga.snapshot_get(self.name, man_valid=force, man_trig=force, wait_period=12, arm=force)['data']
+        self.raw = raw
+        return raw
+
+    def force_dram_capture(self):
+        self.fpga.snapshot_arm(self.name, man_valid=True, man_trig=True)
+        time.sleep(self.dram_capture_wait)
+
+    def dram_length(self, force=False):
+        """ How many bytes of the DRAM hold the capture. All of it if forced,
+        otherwise enough for the impulse and the delays either side of it.
+        """
+        if force == True:
+            # maximum of 2**21 bytes or 2**19 per channel
+            return 2**21
+        # four samples per FPGA clock cycle
+        pre_delay = 256 * 4
+        impulse_len = self.fpga.read_uint('impulse_length') * 4
+        # equal delay on either side of signal
+        to_fetch = pre_delay + impulse_len + pre_delay
+        to_fetch *= 4   # 4 simultaneous inputs
+        # maximum of 2**21 bytes or 2**19 per channel
+        return min(2**21, to_fetch)
+
+    def iter_dram_chunks(self, force=False, chunk_size=2**18, prefetch=2, length=None):
+        """ Reads the DRAM capture chunk_size bytes at a time and yields each chunk
+        as it arrives. A background thread keeps reading up to prefetch chunks
+        ahead, so whatever is done with one chunk overlaps with the transfer of
+        the next. self.raw holds the whole capture once the iterator is exhausted.
+        length -- bytes to read, if the caller already has dram_length(force)
+        """
+        if force == True:
+            self.force_dram_capture()
+        if length is None:
+            length = self.dram_length(force)
+        chunks = Queue.Queue(prefetch)
+        # set once the consumer is done, even if it stops early, so the reader
+        # doesn't block forever on a full queue holding the connection
+        stop = threading.Event()
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout = 0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        def read():
+            try:
+                for offset in range(0, length, chunk_size):
+                    if stop.is_set() or not put(self.fpga.read_dram(min(chunk_size, length - offset), offset)):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+        reader = threading.Thread(target = read, name = '{n}_reader'.format(n = self.name))
+        reader.daemon = True
+        reader.start()
+        received = []
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                received.append(chunk)
+                yield chunk
+        finally:
+            stop.set()
+            reader.join()
+        self.raw = b''.join(received)
+        self.signal = self.unpack_signal(self.raw)
+        self.logger.debug("Read {l} bytes from {n} in {c} chunks".format(
+            l = len(self.raw), n = self.name, c = len(received)))
@@ -0,0 +1,156 @@
+"""
+Ways of storing cross correlation spectra in SessionRecorder records which
+take less room than complex128.
+
+complex128 -- as Correlation.signal has them
+raw -- the integer real and imaginary accumulator values the FPGA produced
+shuffle -- raw with the bytes of each value regrouped by significance and
+    deflated. Lossless.
+delta -- as shuffle but of the zigzag encoded difference between neighbouring
+    bins, which is smaller for smooth spectra. Lossless.
+float32 -- complex64. Lossy.
+float16 -- each baseline scaled to fit half precision floats. Lossy.
+
+raw, shuffle and delta rely on the values being integers. A spectrum which
+isn't, such as a calibrated one or one with NaNs, is stored as the bit
+patterns of its float64 values instead, flagged in its record, so those
+codecs stay lossless whatever they are given.
+
+Compressed codecs vary in size, so encode_into hands back the compressed bytes
+for the recorder to append to its payload file, and the record only holds
+their length and where they start.
+"""
+
+import numpy as np
+import zlib
+
+CODECS = ['complex128', 'raw', 'shuffle', 'delta', 'float32', 'float16']
+# largest finite half precision float
+FLOAT16_MAX = 65504.0
+
+def deflate_bound(length):
+    """ The most zlib.compress can produce from length bytes
+    """
+    return length + (length >> 12) + (length >> 14) + (length >> 25) + 13
+
+def shuffle(values):
+    """ Bytes of the int64 values regrouped so all the first bytes come first,
+    then all the second bytes and so on. The high bytes are mostly the same
+    which deflates well.
+    """
+    return values.view(np.uint8).reshape(-1, 8).T.tobytes()
+
+def unshuffle(data, count):
+    return np.frombuffer(data, np.uint8).reshape(8, count).T.copy().view('<i8').ravel()
+
+def zigzag(values):
+    """ Maps int64 0, -1, 1, -2, ... to 0, 1, 2, 3, ... so small differences of
+    either sign have zero high bytes
+    """
+    return (values << 1) ^ (values >> 63)
+
+def unzigzag(values):
+    unsigned = values.view(np.uint64)
+    return ((unsigned >> np.uint64(1)).view(np.int64)) ^ -(values & 1)
+
+
+class SpectrumCodec:
+    def __init__(self, name='complex128', level=1):
+        """
+        name -- one of CODECS
+        level -- zlib level for shuffle and delta. 1 is fast and gets most of the gain.
+        """
+        if name not in CODECS:
+            raise ValueError("Unknown codec: {n}. Choose from {c}".format(n = name, c = CODECS))
+        self.name = name
+        self.level = level
+        # whether records keep their data in a payload file
+        self.compressed = name in ('shuffle', 'delta')
+
+    def fields(self, num_baselines, num_bins):
+        """ Record fields which hold a (num_baselines x num_bins) spectrum
+        """
+        if self.name == 'complex128':
+            return [('crosses', '<c16', (num_baselines, num_bins))]
+        if self.name == 'raw':
+            return [('floats', 'u1'),
+                    ('crosses', '<i8', (num_baselines, num_bins, 2))]
+        if self.name == 'float32':
+            return [('crosses', '<c8', (num_baselines, num_bins))]
+        if self.name == 'float16':
+            return [('scales', '<f8', (num_baselines,)),
+                    ('crosses', '<f2', (num_baselines, num_bins, 2))]
+        return [('floats', 'u1'),
+                ('length', '<i8'),
+                ('offset', '<i8')]
+
+    def payload_bound(self, num_baselines, num_bins):
+        """ The most a (num_baselines x num_bins) spectrum can add to the
+        payload file
+        """
+        if self.compressed == False:
+            return 0
+        return deflate_bound(num_baselines * num_bins * 2 * 8)
+
+    def integers(self, crosses):
+        """ (baselines x bins x 2) int64 of the real and imaginary parts and
+        whether they are the values themselves. If any part isn't an integer
+        they are the bit patterns of the float64 parts instead.
+        """
+        parts = np.ascontiguousarray(crosses, dtype = np.complex128).view(np.float64) \
+                  .reshape(crosses.shape + (2,))
+        with np.errstate(invalid = 'ignore'):
+            values = parts.astype('<i8')
+        if np.all(values == parts):
+            return values, True
+        # a copy, as delta works on them in place
+        return parts.view('<i8').copy(), False
+
+    def encode_into(self, record, crosses):
+        """ Stores the (baselines x bins) crosses in record. Returns the bytes
+        to append to the payload file for compressed codecs, otherwise None.
+        """
+        if self.name in ('complex128', 'float32'):
+            record['crosses'] = crosses
+        elif self.name == 'raw':
+            values, exact = self.integers(crosses)
+            record['floats'] = not exact
+            record['crosses'] = values
+        elif self.name == 'float16':
+            values = np.ascontiguousarray(crosses).view(np.float64).reshape(crosses.shape + (2,))
+            peaks = np.max(np.abs(values), axis = (1, 2))
+            scales = np.where(peaks > 0, peaks / FLOAT16_MAX, 1.0)
+            record['scales'] = scales
+            record['crosses'] = values / scales[:, np.newaxis, np.newaxis]
+        else:
+            values, exact = self.integers(crosses)
+            if self.name == 'delta':
+                # int64 arithmetic wraps, and the cumulative sum in decode unwraps it
+                values[:, 1:] = np.diff(values, axis = 1)
+                values = zigzag(values)
+            payload = zlib.compress(shuffle(values), self.level)
+            record['floats'] = not exact
+            record['length'] = len(payload)
+            return payload
+
+    def decode(self, record, shape, payload=None):
+        """ The (baselines x bins) complex128 spectrum stored in record
+        payload -- the record's bytes from the payload file, for compressed codecs
+        """
+        if self.name == 'complex128':
+            return record['crosses']
+        if self.name == 'float32':
+            return record['crosses'].astype(np.complex128)
+        if self.name == 'raw':
+            values = record['crosses']
+        elif self.name == 'float16':
+            values = record['crosses'].astype(np.float64) * record['scales'][:, np.newaxis, np.newaxis]
+        else:
+            values = unshuffle(zlib.decompress(payload), shape[0] * shape[1] * 2).reshape(shape + (2,))
+            if self.name == 'delta':
+                values = np.cumsum(unzigzag(values), axis = 1)
+        if self.name in ('raw', 'shuffle', 'delta') and record['floats'] == True:
+            values = values.view(np.float64)
+        crosses = np.empty(shape, dtype = np.complex128)
+        crosses.view(np.float64).reshape(shape + (2,))[:] = values
+        return crosses
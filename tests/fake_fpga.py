@@ -0,0 +1,71 @@
+"""
+Stands in for the ROACH so that Correlator can be tested without one.
+"""
+
+import collections
+import numpy as np
+import zlib
+
+class FakeRoach:
+    def __init__(self, num_bins=32):
+        """ What the FPGA holds. Every FakeFpga connected to it sees the same
+        registers, snapshots and DRAM.
+        num_bins -- frequency bins of each correlation. Each of its two
+            snapshots holds half of them.
+        """
+        self.num_bins = num_bins
+        self.registers = {'control': 0, 'status': 0, 'impulse_length': 0}
+        # name -> raw bytes. Snapshots not in here get made up from their name.
+        self.snapshots = {}
+        self.dram = b''
+        self.connections = []
+
+    def connect(self, ip_addr):
+        """ Use as Correlator's fpga_client
+        """
+        fpga = FakeFpga(self)
+        self.connections.append(fpga)
+        return fpga
+
+    def snapshot(self, name):
+        if name not in self.snapshots:
+            rng = np.random.RandomState(zlib.crc32(name.encode('ascii')) & 0xffffffff)
+            self.snapshots[name] = rng.randint(-1000, 1000, size = self.num_bins).astype('>i8').tobytes()
+        return self.snapshots[name]
+
+    def set_dram(self, signals):
+        """ Stores (channels x samples) int8 signals interleaved as the DRAM
+        holds them: as many samples as there are channels from each channel in turn
+        """
+        channels = len(signals)
+        blocks = np.asarray(signals, dtype = np.int8).reshape(channels, -1, channels).transpose(1, 0, 2)
+        self.dram = blocks.tobytes()
+
+
+class FakeFpga:
+    def __init__(self, roach):
+        self.roach = roach
+        self.snapshot_reads = 0
+        self.dram_reads = 0
+        self.register_reads = collections.Counter()
+
+    def read_uint(self, name):
+        self.register_reads[name] += 1
+        return self.roach.registers.get(name, 0)
+
+    def write_int(self, name, value):
+        self.roach.registers[name] = value
+
+    def snapshot_arm(self, name, **kwargs):
+        pass
+
+    def snapshot_get(self, name, **kwargs):
+        self.snapshot_reads += 1
+        return {'data': self.roach.snapshot(name)}
+
+    def read_dram(self, size, offset=0):
+        self.dram_reads += 1
+        return self.roach.dram[offset:offset + size]
+
+    def stop(self):
+        pass
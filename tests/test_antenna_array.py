@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend import antenna_array
+from directionFinder_backend import antenna
+
+class AntennaArrayTester(unittest.TestCase):
+    def setUp(self):
+        self.array = antenna_array.AntennaArray([
+            antenna.Antenna(0.39, 0.0),
+            antenna.Antenna(-0.07, 0.54),
+            antenna.Antenna(-0.61, -0.04),
+            antenna.Antenna(0.29, -0.50)])
+        self.angles = np.linspace(-np.pi, np.pi, 50)
+
+    def test_positions(self):
+        self.assertEqual(self.array.positions.shape, (4, 2))
+        self.assertEqual(self.array.baselines.tolist(),
+                         [[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3]])
+
+    def test_phase_manifold_matches_pairwise(self):
+        f = 240e6
+        manifold = self.array.each_pair_phase_difference_at_angles(self.angles, f)
+        self.assertEqual(manifold.shape, (len(self.angles), 6))
+        for row, phi in zip(manifold, self.angles):
+            for idx, (ant0, ant1) in enumerate(self.array.each_pair()):
+                expected = self.array.phase_difference_between_two_antennas_at_angle(ant0, ant1, phi, f)
+                # compare on the unit circle as -pi and pi are equivalent
+                self.assertAlmostEqual(np.exp(1j*row[idx]), np.exp(1j*expected))
+
+    def test_time_manifold_matches_pairwise(self):
+        manifold = self.array.each_pair_time_difference_at_angles(self.angles)
+        self.assertEqual(manifold.shape, (len(self.angles), 6))
+        for row, phi in zip(manifold, self.angles):
+            for idx, (ant0, ant1) in enumerate(self.array.each_pair()):
+                expected = self.array.time_difference_between_two_antennas_at_angle(ant0, ant1, phi)
+                self.assertAlmostEqual(row[idx] * 1e9, expected * 1e9)
+
+    def test_single_angle(self):
+        phases = self.array.each_pair_phase_difference_at_angle(1.0, 240e6)
+        self.assertEqual(phases.shape, (6,))
+
+    def test_angles_required(self):
+        self.assertAlmostEqual(self.array.aperture(), np.hypot(0.36, 1.04))
+        # higher frequencies wind the phase faster so need more angles
+        self.assertGreater(self.array.angles_required(400e6), self.array.angles_required(200e6))
+        self.assertEqual(self.array.angles_required(1e3), 16)
+
+    def test_max_time_differences(self):
+        max_tdoas = self.array.max_time_differences()
+        manifold = self.array.each_pair_time_difference_at_angles(np.linspace(-np.pi, np.pi, 2000))
+        self.assertTrue(np.all(np.abs(manifold) <= max_tdoas + 1e-18))
+        np.testing.assert_allclose(np.max(np.abs(manifold), axis = 0), max_tdoas, rtol = 1e-5)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from directionFinder_backend import calibration_store
+from directionFinder_backend.calibration_store import CalibrationStore, CalibrationCache
+
+class CalibrationStoreTester(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.combs = [(0, 1), (0, 2), (1, 2)]
+        self.bins = calibration_store.bin_grid(800e6, 16)
+        self.json_file = os.path.join(self.dir, 'cal.json')
+        phases = np.random.RandomState(0).uniform(-np.pi, np.pi, (3, 16))
+        with open(self.json_file, 'w') as f:
+            json.dump({'axis': list(self.bins), '01': list(phases[0]), '02': list(phases[1]),
+                       '12': list(phases[2])}, f)
+        self.phases = phases
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        filename = os.path.join(self.dir, 'cal.dfcal')
+        calibration_store.write_calibration_store(filename, self.combs, self.bins,
+                                                  {'phase_offsets': self.phases,
+                                                   'time_offsets': np.array([1e-9, 2e-9, 3e-9])},
+                                                  {'created': 'now'})
+        store = CalibrationStore(filename)
+        self.assertTrue(store.matches(self.combs, self.bins))
+        self.assertFalse(store.matches(self.combs, self.bins[:-1]))
+        np.testing.assert_array_equal(store['phase_offsets'], self.phases)
+        np.testing.assert_array_equal(store['time_offsets'], [1e-9, 2e-9, 3e-9])
+        self.assertIsInstance(store['phase_offsets'], np.memmap)
+        self.assertEqual(store['phase_offsets'].offset % calibration_store.ALIGNMENT, 0)
+        self.assertNotIn('cable_phase_offsets', store)
+
+    def test_convert_json(self):
+        filename = os.path.join(self.dir, 'cal.dfcal')
+        calibration_store.convert_json_calibrations(filename, self.combs, self.bins,
+                                                    frequency_bin_file = self.json_file)
+        np.testing.assert_array_equal(CalibrationStore(filename)['phase_offsets'], self.phases)
+
+    def test_not_a_store(self):
+        self.assertRaises(ValueError, CalibrationStore, self.json_file)
+
+    def test_cache_keyed_on_contents(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        first = CalibrationCache(cache_dir).frequency_bin_calibration(self.json_file, self.combs, self.bins)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        # a new process finds it on disk
+        second = CalibrationCache(cache_dir).frequency_bin_calibration(self.json_file, self.combs, self.bins)
+        self.assertIsInstance(second['phase_offsets'], np.memmap)
+        np.testing.assert_array_equal(first['phase_offsets'], second['phase_offsets'])
+        # different interpolation or contents gets its own entry
+        CalibrationCache(cache_dir).frequency_bin_calibration(self.json_file, self.combs, self.bins, 'linear')
+        with open(self.json_file, 'a') as f:
+            f.write(' ')
+        CalibrationCache(cache_dir).frequency_bin_calibration(self.json_file, self.combs, self.bins)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from directionFinder_backend.catalogue import Catalogue
+from directionFinder_backend.session_recorder import SessionRecorder
+from directionFinder_backend.results_writer import ResultsWriter
+from directionFinder_backend.frame import FrequencyFrame, ImpulseFrame
+
+class CatalogueTester(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.combs = [(0, 1), (0, 2), (1, 2)]
+        self.bins = np.linspace(0, 400e6, 8, endpoint = False)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def frequency_frame(self, t):
+        return FrequencyFrame(t, self.combs, np.ones((3, 8), dtype = np.complex128), self.bins)
+
+    def test_live(self):
+        catalogue = Catalogue(os.path.join(self.path, 'catalogue.sqlite'))
+        recorder = SessionRecorder(self.path, session = 'live', catalogue = catalogue)
+        writer = ResultsWriter(self.path, catalogue = catalogue)
+        # the DF result for t=1 arrives before its frame is recorded
+        writer.write(1.0, 0.5, frequency = 240e6, quality = 0.1)
+        writer.flush()
+        for t in range(4):
+            recorder.record(self.frequency_frame(float(t)))
+        writer.write(2.0, -0.5, frequency = 100e6, quality = 0.2)
+        writer.close()
+        recorder.close()
+        captures = catalogue.captures()
+        self.assertEqual([capture.t for capture in captures], [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(captures[1].record, 1)
+        self.assertEqual(captures[1].path, os.path.join(self.path, 'live.json'))
+        near = catalogue.near_frequency(240e6)
+        self.assertEqual([(capture.t, capture.aoa) for capture in near], [(1.0, 0.5)])
+        # nothing new to add from the tree
+        self.assertEqual(catalogue.add_tree(self.path), 0)
+        self.assertEqual(len(catalogue.captures()), 4)
+        catalogue.close()
+
+    def test_rebuild_from_tree(self):
+        recorder = SessionRecorder(self.path, session = 'impulses')
+        for t in [10.0, 11.0, 12.0]:
+            recorder.record(ImpulseFrame(t, np.zeros((4, 16))))
+        recorder.close()
+        os.mkdir(os.path.join(self.path, '5.5'))
+        np.save(os.path.join(self.path, '5.5', '0x1.npy'), np.zeros(8))
+        with open(os.path.join(self.path, 'results.txt'), 'w') as f:
+            f.write("5.5,240000000.0,1.0\n11.0,0.25\n")
+        catalogue = Catalogue(os.path.join(self.path, 'catalogue.sqlite'))
+        self.assertEqual(catalogue.add_tree(self.path), 6)
+        impulses = catalogue.impulses(10.5, 20.0)
+        self.assertEqual([capture.t for capture in impulses], [11.0, 12.0])
+        self.assertEqual(impulses[0].aoa, 0.25)
+        self.assertEqual(impulses[0].record, 1)
+        self.assertEqual(catalogue.near_frequency(240.5e6)[0].path, os.path.join(self.path, '5.5'))
+        # a second pass only adds what's new
+        with open(os.path.join(self.path, 'results.txt'), 'a') as f:
+            f.write("12.0,-0.25\n")
+        self.assertEqual(catalogue.add_tree(self.path), 1)
+        self.assertEqual(len(catalogue.captures()), 4)
+        self.assertEqual(catalogue.impulses(12.0)[0].aoa, -0.25)
+        catalogue.close()
+
+    def test_matches_realistic_times(self):
+        # time.time() values have more digits than str keeps
+        times = [1760711000.123456 + 0.25*idx for idx in range(5)]
+        recorder = SessionRecorder(self.path, session = 'session')
+        for t in times[0:4]:
+            recorder.record(self.frequency_frame(t))
+        recorder.close()
+        # a per-frame directory is named with str(t)
+        os.mkdir(os.path.join(self.path, "{t}".format(t = times[4])))
+        np.save(os.path.join(self.path, "{t}".format(t = times[4]), '0x1.npy'), np.zeros(8))
+        writer = ResultsWriter(self.path)
+        for t in times:
+            writer.write(t, 0.5, frequency = 240e6)
+        writer.close()
+        catalogue = Catalogue(os.path.join(self.path, 'catalogue.sqlite'))
+        catalogue.add_tree(self.path)
+        captures = catalogue.captures()
+        self.assertEqual(len(captures), 5)
+        self.assertEqual([capture.t for capture in captures[0:4]], times[0:4])
+        for capture in captures:
+            self.assertIsNotNone(capture.path)
+            self.assertEqual(capture.aoa, 0.5)
+        catalogue.close()
+
+    def test_partial_and_malformed_lines(self):
+        filename = os.path.join(self.path, 'results.txt')
+        with open(filename, 'w') as f:
+            f.write("1.0,0.5\nnot a result\n2.0,0.25\n3.0,0.")
+        catalogue = Catalogue(os.path.join(self.path, 'catalogue.sqlite'))
+        self.assertEqual(catalogue.add_results_from(self.path), 2)
+        # the malformed line is counted, the partial one isn't
+        self.assertEqual(catalogue.source_count(filename), 3)
+        with open(filename, 'a') as f:
+            f.write("75\n")
+        self.assertEqual(catalogue.add_results_from(self.path), 1)
+        self.assertEqual([(capture.t, capture.aoa) for capture in catalogue.captures()],
+                         [(1.0, 0.5), (2.0, 0.25), (3.0, 0.75)])
+        catalogue.close()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend.correlation import Correlation, resample_calibration_phases
+from fake_fpga import FakeRoach
+
+class CorrelationTester(unittest.TestCase):
+    def setUp(self):
+        self.roach = FakeRoach(num_bins = 16)
+        self.fpga = self.roach.connect('localhost')
+        self.correlation = Correlation(self.fpga, (0, 1), 0, 400e6)
+
+    def set_snapshots(self, even, odd):
+        """ even and odd are the complex bins each snapshot holds
+        """
+        for name, bins in [('snap_0x1_0', even), ('snap_0x1_1', odd)]:
+            components = np.empty(2 * len(bins), dtype = '>i8')
+            components[0::2] = bins.real
+            components[1::2] = bins.imag
+            self.roach.snapshots[name] = components.tobytes()
+
+    def test_interleaves_snapshots(self):
+        rng = np.random.RandomState(0)
+        even = rng.randint(-2**40, 2**40, 8) + 1j*rng.randint(-2**40, 2**40, 8)
+        odd = rng.randint(-2**40, 2**40, 8) + 1j*rng.randint(-2**40, 2**40, 8)
+        self.set_snapshots(even, odd)
+        buf = self.correlation.signal_buffer
+        self.correlation.fetch_signal()
+        # as the per snapshot decode and ravel used to give
+        np.testing.assert_array_equal(self.correlation.signal, np.ravel((even, odd), order = 'F'))
+        # decoded into the same buffer every time
+        self.assertIs(self.correlation.signal_buffer, buf)
+        self.assertFalse(self.correlation.signal.flags.writeable)
+
+    def test_fused_calibration(self):
+        signal = np.array(self.correlation.signal)
+        frequencies = np.linspace(0, 400e6, 50)
+        phases = np.linspace(-3, 3, 50)
+        self.correlation.add_frequency_bin_calibration(frequencies, phases)
+        self.correlation.add_cable_length_calibration(1.0, 0.66, 2.5, 0.7)
+        # the phase offsets and cable lengths applied one after the other, as they used to be
+        separate = signal * np.conj(np.exp(1j*self.correlation.calibration_phase_offsets))
+        separate = separate * np.exp(1j*self.correlation.calibration_cable_length_offsets)
+        fused = np.array(signal)
+        self.correlation.apply_frequency_domain_calibrations(fused)
+        np.testing.assert_allclose(fused, separate, rtol = 1e-12)
+
+
+class ResampleCalibrationPhasesTester(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.frequency_bins = np.linspace(0, 400e6, 1024, endpoint = False)
+        # an uneven table which doesn't cover the whole band
+        self.frequencies = np.sort(rng.uniform(10e6, 390e6, 37))
+        self.phases = np.angle(np.exp(1j * np.cumsum(rng.uniform(-2, 2, 37))))
+
+    def test_nearest_matches_loop(self):
+        expected = np.ndarray(len(self.frequency_bins))
+        for idx, f in enumerate(self.frequency_bins):
+            expected[idx] = self.phases[np.argmin(np.abs(self.frequencies - f))]
+        resampled = resample_calibration_phases(self.frequency_bins, self.frequencies, self.phases, 'nearest')
+        np.testing.assert_array_equal(resampled, expected)
+
+    def test_linear_matches_loop(self):
+        unwrapped = np.unwrap(self.phases)
+        expected = np.ndarray(len(self.frequency_bins))
+        for idx, f in enumerate(self.frequency_bins):
+            if f <= self.frequencies[0]:
+                expected[idx] = unwrapped[0]
+            elif f >= self.frequencies[-1]:
+                expected[idx] = unwrapped[-1]
+            else:
+                above = np.flatnonzero(self.frequencies >= f)[0]
+                below = above - 1
+                fraction = (f - self.frequencies[below]) / (self.frequencies[above] - self.frequencies[below])
+                expected[idx] = unwrapped[below] + fraction * (unwrapped[above] - unwrapped[below])
+        resampled = resample_calibration_phases(self.frequency_bins, self.frequencies, self.phases, 'linear')
+        np.testing.assert_allclose(resampled, expected, rtol = 1e-12, atol = 1e-12)
+
+    def test_single_entry(self):
+        resampled = resample_calibration_phases(self.frequency_bins, [100e6], [0.5])
+        np.testing.assert_array_equal(resampled, np.repeat(0.5, len(self.frequency_bins)))
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from directionFinder_backend.correlator import Correlator
+from directionFinder_backend.antenna_array import AntennaArray
+from directionFinder_backend.antenna import Antenna
+from fake_fpga import FakeRoach
+
+class CorrelatorFetchTester(unittest.TestCase):
+    def setUp(self):
+        self.roach = FakeRoach()
+
+    def test_concurrent_fetch_matches_serial(self):
+        serial = Correlator(fpga_client = self.roach.connect)
+        serial.fetch_crosses()
+        pooled = Correlator(fpga_client = self.roach.connect, fetch_workers = 3)
+        pooled.fetch_crosses()
+        np.testing.assert_array_equal(pooled.crosses, serial.crosses)
+        for comb in serial.cross_combinations:
+            np.testing.assert_array_equal(pooled.frequency_correlations[comb].signal,
+                                          serial.frequency_correlations[comb].signal)
+        # the snapshots were read over the worker connections
+        workers = self.roach.connections[-3:]
+        self.assertEqual(sum(fpga.snapshot_reads for fpga in workers), 2 * len(serial.cross_combinations))
+        pooled.set_fetch_workers(1)
+
+
+class CorrelatorCalibrationTester(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.correlator = Correlator(fpga_client = FakeRoach().connect)
+        self.correlator.fetch_crosses()
+        frequency_bins = self.correlator.frequency_bins()
+        offsets = {'axis': list(np.linspace(0, 400e6, 20))}
+        for idx, (a, b) in enumerate(self.correlator.cross_combinations):
+            offsets["{a}{b}".format(a = a, b = b)] = list(np.linspace(-1, 1, 20) * (idx + 1))
+        self.frequency_bin_file = os.path.join(self.path, 'frequency_bins.json')
+        with open(self.frequency_bin_file, 'w') as f:
+            json.dump(offsets, f)
+        cables = dict((str(chan), {'length': 1.0 + chan, 'velocity factor': 0.66})
+                      for chan in range(self.correlator.num_channels))
+        self.cable_file = os.path.join(self.path, 'cables.json')
+        with open(self.cable_file, 'w') as f:
+            json.dump(cables, f)
+        self.correlator.add_frequency_bin_calibrations(self.frequency_bin_file)
+        self.correlator.add_cable_length_calibrations(self.cable_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def separately_calibrated(self):
+        """ Each baseline calibrated by its phase offsets and then its cable
+        length offsets, as Correlation used to
+        """
+        calibrated = []
+        for comb in self.correlator.cross_combinations:
+            correlation = self.correlator.frequency_correlations[comb]
+            signal = correlation.signal * np.conj(np.exp(1j*correlation.calibration_phase_offsets))
+            calibrated.append(signal * np.exp(1j*correlation.calibration_cable_length_offsets))
+        return np.array(calibrated)
+
+    def test_shared_buffers(self):
+        # crosses is what every correlation's signal is a view of
+        for idx, comb in enumerate(self.correlator.cross_combinations):
+            signal = self.correlator.frequency_correlations[comb].signal
+            self.assertTrue(np.may_share_memory(signal, self.correlator.crosses[idx]))
+            np.testing.assert_array_equal(signal, self.correlator.crosses[idx])
+
+    def test_calibrates_in_place(self):
+        expected = self.separately_calibrated()
+        self.correlator.apply_frequency_domain_calibrations()
+        np.testing.assert_allclose(self.correlator.crosses, expected, rtol = 1e-12)
+
+    def test_calibrates_a_copy_of_a_frame(self):
+        expected = self.separately_calibrated()
+        frame = self.correlator.frequency_frame()
+        raw = np.array(frame.crosses)
+        calibrated = self.correlator.apply_frequency_domain_calibrations(frame)
+        np.testing.assert_allclose(calibrated.crosses, expected, rtol = 1e-12)
+        # the frame the recorder may still be writing is left raw
+        np.testing.assert_array_equal(frame.crosses, raw)
+        self.assertEqual(calibrated.t, frame.t)
+
+
+class CorrelatorTimeDomainTester(unittest.TestCase):
+    def setUp(self):
+        self.roach = FakeRoach()
+        self.correlator = Correlator(fpga_client = self.roach.connect)
+        # samples each channel lags channel 0 by
+        self.delays = [0, 7, -12, 30]
+        self.signals = self.delayed_signals(4096, self.delays)
+
+    def delayed_signals(self, length, delays, seed=0):
+        """ (channels x length) int8 valued noise. Each channel is a common
+        source delayed by its number of samples, plus noise of its own.
+        """
+        rng = np.random.RandomState(seed)
+        pad = max(abs(delay) for delay in delays)
+        source = rng.normal(0, 30, length + 2*pad)
+        signals = [source[pad - delay:pad - delay + length] + rng.normal(0, 10, length) + 3
+                   for delay in delays]
+        return np.clip(np.round(signals), -128, 127)
+
+    def stored_correlations(self, correlate, signals):
+        """ What correlate(signals) passes to store_time_domain_correlation for
+        each baseline: (correlation, correlation_time)
+        """
+        stored = {}
+        def store(baseline, correlation, correlation_time):
+            stored[baseline] = (np.array(correlation), np.array(correlation_time))
+        self.correlator.store_time_domain_correlation = store
+        try:
+            correlate(signals)
+        finally:
+            del self.correlator.store_time_domain_correlation
+        return stored
+
+    def test_fft_matches_np_correlate(self):
+        self.correlator.subsignal_length_max = 3000
+        direct = self.stored_correlations(self.correlator.do_time_domain_cross_correlations_cross_first, self.signals)
+        fft = self.stored_correlations(self.correlator.do_time_domain_cross_correlations_fft, self.signals)
+        for baseline in self.correlator.cross_combinations:
+            np.testing.assert_allclose(fft[baseline][0], direct[baseline][0], rtol = 1e-9, atol = 1e-6)
+            np.testing.assert_allclose(fft[baseline][1], direct[baseline][1], rtol = 0, atol = 1e-15)
+        # and the peaks land on the delays
+        self.correlator.do_time_domain_cross_correlations_fft(self.signals)
+        for a, b in self.correlator.cross_combinations:
+            self.assertAlmostEqual(self.correlator.time_domain_cross_correlations_peaks[(a, b)] * self.correlator.fs,
+                                   self.delays[b] - self.delays[a], delta = 0.5)
+
+    def fractionally_delayed_signals(self, length, delays, seed=0):
+        """ As delayed_signals but band limited to 0.4 fs so delays can be a
+        fraction of a sample
+        """
+        rng = np.random.RandomState(seed)
+        spectrum = np.fft.rfft(rng.normal(0, 30, length))
+        frequencies = np.fft.rfftfreq(length)
+        spectrum[frequencies > 0.4] = 0
+        return np.round([np.fft.irfft(spectrum * np.exp(-2j*np.pi*frequencies*delay), length) +
+                         rng.normal(0, 5, length) for delay in delays])
+
+    def peaks_in_samples(self, signals):
+        self.correlator.do_time_domain_cross_correlations_fft(signals)
+        return np.array([self.correlator.time_domain_cross_correlations_peaks[baseline] * self.correlator.fs
+                         for baseline in self.correlator.cross_combinations])
+
+    def test_refined_peaks_match_resample(self):
+        step = 1.0 / self.correlator.upsample_factor
+        for seed in range(5):
+            delays = [0] + list(np.random.RandomState(100 + seed).uniform(-40, 40, 3))
+            signals = self.fractionally_delayed_signals(4096, delays, seed)
+            expected = np.array([delays[b] - delays[a] for a, b in self.correlator.cross_combinations])
+            peaks = {}
+            for refinement in ['resample', 'sinc', 'parabolic']:
+                self.correlator.peak_refinement = refinement
+                peaks[refinement] = self.peaks_in_samples(signals)
+            np.testing.assert_allclose(peaks['resample'], expected, rtol = 0, atol = 0.02)
+            # the same grid as resampling. A near tie can go to the neighbouring point.
+            np.testing.assert_allclose(peaks['sinc'], peaks['resample'], rtol = 0, atol = step + 1e-9)
+            np.testing.assert_allclose(peaks['parabolic'], expected, rtol = 0, atol = 0.1)
+
+    def test_correlation_window(self):
+        self.correlator.correlation_window = 2
+        signals = self.fractionally_delayed_signals(4096, [0, 2.5, -3.25, 10.1])
+        for refinement in ['sinc', 'parabolic']:
+            self.correlator.peak_refinement = refinement
+            self.correlator.do_time_domain_cross_correlations_fft(signals)
+            for baseline in self.correlator.cross_combinations:
+                values = self.correlator.time_domain_correlations_values[baseline]
+                times = self.correlator.time_domain_correlations_times[baseline]
+                self.assertEqual(len(values), len(times))
+                # the peak is the largest of the values kept around it
+                self.assertAlmostEqual(times[np.argmax(values)],
+                                       self.correlator.time_domain_cross_correlations_peaks[baseline],
+                                       delta = 1.5 / self.correlator.fs)
+
+    def test_lag_windows_follow_geometry(self):
+        array = AntennaArray([Antenna(0.39, 0.0), Antenna(-0.07, 0.54),
+                              Antenna(-0.61, -0.04), Antenna(0.29, -0.50)])
+        fs = self.correlator.fs
+        margin = 5e-9
+        self.correlator.time_domain_calibration_values = dict(
+            (baseline, 1e-9 * idx) for idx, baseline in enumerate(self.correlator.cross_combinations))
+        self.correlator.set_array(array, tdoa_margin = margin)
+        for idx, baseline in enumerate(self.correlator.cross_combinations):
+            lag_min, lag_max = self.correlator.time_domain_lag_window(baseline)
+            max_tdoa = array.max_time_differences()[idx]
+            offset = 1e-9 * idx
+            # covers every TDOA the geometry allows, shifted by the calibration,
+            # and no more than the margin and rounding beyond that
+            self.assertLessEqual(lag_min, (offset - max_tdoa - margin) * fs)
+            self.assertGreater(lag_min, (offset - max_tdoa - margin) * fs - 1)
+            self.assertGreaterEqual(lag_max, (offset + max_tdoa + margin) * fs)
+            self.assertLess(lag_max, (offset + max_tdoa + margin) * fs + 1)
+        # correlations only cover the windows
+        correlations = self.stored_correlations(self.correlator.do_time_domain_cross_correlations_fft, self.signals)
+        for baseline in self.correlator.cross_combinations:
+            lag_min, lag_max = self.correlator.time_domain_lag_window(baseline)
+            np.testing.assert_allclose(correlations[baseline][1] * fs, np.arange(lag_min, lag_max + 1))
+
+    def test_clips_unphysical_tdoas(self):
+        array = AntennaArray([Antenna(0.39, 0.0), Antenna(-0.07, 0.54),
+                              Antenna(-0.61, -0.04), Antenna(0.29, -0.50)])
+        self.correlator.set_array(array)
+        # channel 3 lags by more than any baseline allows, but within the margin
+        self.correlator.do_time_domain_cross_correlations_fft(self.delayed_signals(4096, [0, 0, 0, 8]))
+        visibilities = self.correlator.visibilities_from_time()
+        max_tdoas = array.max_time_differences()
+        self.assertTrue(np.all(np.abs(visibilities) <= max_tdoas))
+        idx = self.correlator.cross_combinations.index((0, 3))
+        self.assertEqual(visibilities[idx], max_tdoas[idx])
+        # physical ones are left alone
+        self.correlator.time_domain_cross_correlations_peaks = dict(
+            (baseline, 0.5 * max_tdoa) for baseline, max_tdoa in zip(self.correlator.cross_combinations, max_tdoas))
+        np.testing.assert_array_equal(self.correlator.visibilities_from_time(), 0.5 * max_tdoas)
+
+    def test_deinterleave_matches_loop(self):
+        signals = np.random.RandomState(2).randint(-128, 128, (4, 2048))
+        self.roach.set_dram(signals)
+        self.correlator.fetch_time_domain_snapshot(force = True)
+        # the per channel loop fetch_time_domain_snapshot used to run
+        sig = np.frombuffer(self.roach.dram, np.int8)
+        sig = sig.reshape(len(sig) // 4, 4)
+        expected = np.ndarray((4, len(sig)))
+        for chan in range(4):
+            expected[chan] = sig[chan::4].flatten().astype(np.float64)
+            expected[chan] -= np.mean(expected[chan])
+        np.testing.assert_array_equal(self.correlator.time_domain_signals + self.correlator.time_domain_dc_offsets[:, np.newaxis],
+                                      signals)
+        np.testing.assert_allclose(self.correlator.time_domain_signals, expected, rtol = 0, atol = 1e-4)
+        # kept as the default float32, and the buffer is reused
+        buf = self.correlator.time_domain_signals_buffer
+        self.assertEqual(self.correlator.time_domain_signals.dtype, np.float32)
+        self.correlator.fetch_time_domain_snapshot(force = True)
+        self.assertIs(self.correlator.time_domain_signals_buffer, buf)
+
+    def test_streaming_matches_fft(self):
+        # an impulse capture just long enough for the signals
+        self.roach.registers['impulse_length'] = 512
+        self.roach.set_dram(self.signals)
+        # segments and chunks that don't divide the capture
+        self.correlator.time_domain_chunk_size = 4 * 4 * 100
+        self.correlator.time_domain_segment_length = 1000
+        for subsignal_length_max in [2**20, 3000]:
+            self.correlator.subsignal_length_max = subsignal_length_max
+            self.correlator.fpga.register_reads.clear()
+            streamed = self.stored_correlations(
+                lambda signals: self.correlator.fetch_and_correlate_time_domain_snapshot(), None)
+            self.assertEqual(self.correlator.fpga.register_reads['impulse_length'], 1)
+            np.testing.assert_array_equal(self.correlator.time_domain_signals.shape, self.signals.shape)
+            self.correlator.fetch_time_domain_snapshot()
+            fft = self.stored_correlations(self.correlator.do_time_domain_cross_correlations_fft,
+                                           self.correlator.time_domain_signals)
+            for baseline in self.correlator.cross_combinations:
+                np.testing.assert_allclose(streamed[baseline][0], fft[baseline][0], rtol = 1e-9, atol = 1e-3)
+                np.testing.assert_array_equal(streamed[baseline][1], fft[baseline][1])
+
+    def test_streaming_empty_capture(self):
+        self.roach.dram = b''
+        self.assertRaises(ValueError, self.correlator.fetch_and_correlate_time_domain_snapshot)
+
+    def test_abandoned_stream_stops_reader(self):
+        self.roach.set_dram(self.signals)
+        snap = self.correlator.time_domain_snap
+        chunks = snap.iter_dram_chunks(chunk_size = 1024, prefetch = 1, length = len(self.roach.dram))
+        next(chunks)
+        # the reader is now blocked on the full queue
+        chunks.close()
+        self.assertEqual([thread for thread in threading.enumerate() if thread.name == 'dram_snapshot_reader'], [])
+        self.assertLess(self.correlator.fpga.dram_reads, len(self.roach.dram) // 1024)
+
+    def test_saves_float64(self):
+        self.roach.set_dram(self.signals)
+        self.correlator.fetch_time_domain_snapshot(force = True)
+        path = tempfile.mkdtemp()
+        try:
+            self.correlator.save_time_domain_snapshots(path, self.correlator.impulse_frame())
+            saved = os.path.join(path, os.listdir(path)[0], '0.npy')
+            self.assertEqual(np.load(saved).dtype, np.float64)
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend.antenna_array import AntennaArray
+from directionFinder_backend.antenna import Antenna
+from directionFinder_backend.direction_finder import DirectionFinder
+
+class DirectionFinderTester(unittest.TestCase):
+    def setUp(self):
+        self.array = AntennaArray([
+            Antenna(0.39, 0.0),
+            Antenna(-0.07, 0.54),
+            Antenna(-0.61, -0.04),
+            Antenna(0.29, -0.50)])
+        self.frequency = 240e6
+        # no correlator needed to search the manifold
+        self.df = DirectionFinder(None, self.array, self.frequency)
+        self.step = self.df.sampled_angles[1] - self.df.sampled_angles[0]
+
+    def test_find_closest_point(self):
+        for angle in [-2.5, -0.3, 0.0, 1.2, 3.0]:
+            visibilities = self.array.each_pair_phase_difference_at_angle(angle, self.frequency)
+            self.assertAlmostEqual(self.df.find_closest_point(visibilities), angle, delta = self.step)
+
+    def test_find_closest_points_matches_single(self):
+        angles = np.linspace(-3, 3, 25)
+        visibilities = self.array.each_pair_phase_difference_at_angles(angles, self.frequency)
+        batch = self.df.find_closest_points(visibilities, chunk_size = 7)
+        single = [self.df.find_closest_point(v) for v in visibilities]
+        np.testing.assert_allclose(batch, single)
+        np.testing.assert_allclose(batch, angles, atol = self.step)
+
+    def test_distance_wraps(self):
+        self.assertAlmostEqual(self.df.distance_between_vectors(np.array([np.pi - 0.1]),
+                                                                np.array([-np.pi + 0.1])),
+                               0.2)
+
+    def test_refined_search(self):
+        df = DirectionFinder(None, self.array, self.frequency, search = 'refined')
+        self.assertLess(len(df.coarse_angles), len(df.sampled_angles))
+        for angle in [-3.1, -1.0, 0.05, 2.2, 3.1]:
+            visibilities = self.array.each_pair_phase_difference_at_angle(angle, self.frequency)
+            found = df.find_closest_point(visibilities)
+            # finer than the grid search can resolve
+            self.assertAlmostEqual(np.angle(np.exp(1j*(found - angle))), 0, delta = self.step/10)
+
+    def test_refined_search_builds_coarse_manifold(self):
+        df = DirectionFinder(None, self.array, self.frequency, search = 'refined')
+        self.assertIsNone(df.manifold)
+        self.assertEqual(len(df.manifold_cache), 1)
+        # the grid methods still work, building the full manifold when asked
+        angles = np.linspace(-3, 3, 7)
+        visibilities = self.array.each_pair_phase_difference_at_angles(angles, self.frequency)
+        np.testing.assert_allclose(df.find_closest_points(visibilities), angles, atol = self.step)
+        self.assertEqual(df.manifold.shape, (len(df.sampled_angles), len(self.array.baselines)))
+
+    def test_refined_search_time(self):
+        df = DirectionFinder(None, self.array, self.frequency, search = 'refined')
+        df.set_time()
+        tdoas = self.array.each_pair_time_difference_at_angle(-2.0)
+        self.assertAlmostEqual(df.find_closest_point(tdoas), -2.0, delta = self.step)
+
+    def test_solve_tdoa(self):
+        self.df.set_time()
+        for angle in [-3.1, -1.0, 0.05, 2.2, 3.1]:
+            tdoas = self.array.each_pair_time_difference_at_angle(angle)
+            self.assertAlmostEqual(self.df.solve_tdoa(tdoas), angle)
+            # residuals are in seconds so the default 7 places would pass anything
+            self.assertAlmostEqual(self.df.last_residual, 0, delta = 1e-15)
+
+    def test_solve_tdoas_noisy(self):
+        self.df.set_time()
+        angles = np.linspace(-3, 3, 50)
+        tdoas = self.array.each_pair_time_difference_at_angles(angles)
+        noisy = tdoas + np.random.RandomState(0).normal(0, 50e-12, tdoas.shape)
+        found, residuals = self.df.solve_tdoas(noisy)
+        np.testing.assert_allclose(np.angle(np.exp(1j*(found - angles))), 0, atol = 0.05)
+        self.assertTrue(np.all(residuals > 0))
+        self.assertTrue(np.all(residuals < 100e-12))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend.impulse_monitor import ImpulseMonitor
+from directionFinder_backend.frame import ImpulseFrame
+
+class FakeCorrelator:
+    def __init__(self, impulse_after):
+        self.impulse_after = impulse_after
+        self.reads = 0
+        self.arms = 0
+        self.fetches = 0
+
+    def impulse_arm(self):
+        self.arms += 1
+
+    def read_impulse_length(self):
+        self.reads += 1
+        if self.reads > self.impulse_after:
+            return 10
+        return 0
+
+    def impulse_fetch(self, impulse_len):
+        self.fetches += 1
+        self.impulse_arm()
+        return True
+
+    def impulse_frame(self):
+        return ImpulseFrame(t = 0, time_domain_signals = np.zeros((4, 8)))
+
+class ImpulseMonitorTester(unittest.TestCase):
+    def test_backs_off_when_idle(self):
+        monitor = ImpulseMonitor(FakeCorrelator(1000), min_interval = 1e-4,
+                                 max_interval = 1e-3, backoff = 2, tight_period = 0)
+        monitor.arm()
+        intervals = []
+        for idx in range(6):
+            self.assertIsNone(monitor.poll())
+            intervals.append(monitor.interval)
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertAlmostEqual(intervals[-1], 1e-3)
+
+    def test_tight_polling_after_arm(self):
+        monitor = ImpulseMonitor(FakeCorrelator(1000), min_interval = 1e-4, tight_period = 10)
+        monitor.arm()
+        for idx in range(3):
+            monitor.poll()
+        self.assertEqual(monitor.interval, 1e-4)
+
+    def test_wait_returns_frame(self):
+        correlator = FakeCorrelator(3)
+        monitor = ImpulseMonitor(correlator, min_interval = 1e-4, tight_period = 0)
+        monitor.arm()
+        frame = monitor.wait()
+        self.assertEqual(correlator.reads, 4)
+        self.assertEqual(correlator.fetches, 1)
+        self.assertEqual(monitor.interval, 1e-4)
+        self.assertIsNotNone(frame.detected)
+        monitor.record_result(frame)
+        stats = monitor.stats()
+        self.assertEqual(stats['detections'], 1)
+        self.assertGreaterEqual(stats['result_latency']['max'], 0)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+import shutil
+import tempfile
+from directionFinder_backend.antenna_array import AntennaArray
+from directionFinder_backend.manifold_cache import ManifoldCache
+
+class ManifoldCacheTester(unittest.TestCase):
+    def setUp(self):
+        self.array = AntennaArray.mk_circular(0.5, 4)
+        self.angles = np.linspace(-np.pi, np.pi, 100)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_same_bin_shares_manifold(self):
+        cache = ManifoldCache(bin_width = 1e6)
+        m0 = cache.phase_manifold(self.array, self.angles, 240.1e6)
+        m1 = cache.phase_manifold(self.array, self.angles, 239.9e6)
+        self.assertIs(m0, m1)
+        self.assertEqual(len(cache), 1)
+        # built at the bin centre, whichever frequency asked first
+        np.testing.assert_array_equal(m0, self.array.each_pair_phase_difference_at_angles(self.angles, 240e6))
+
+    def test_lru_eviction(self):
+        manifold_bytes = len(self.angles) * 6 * 8
+        cache = ManifoldCache(max_bytes = 2 * manifold_bytes, bin_width = 1e6)
+        for f in [200e6, 210e6, 220e6]:
+            cache.phase_manifold(self.array, self.angles, f)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.nbytes, 2 * manifold_bytes)
+        self.assertNotIn(cache.key(self.array, self.angles, 'phase', 200e6), cache)
+
+    def test_persists_to_disk(self):
+        cache = ManifoldCache(bin_width = 1e6, cache_dir = self.cache_dir)
+        m0 = cache.phase_manifold(self.array, self.angles, 240e6)
+        restarted = ManifoldCache(bin_width = 1e6, cache_dir = self.cache_dir)
+        key = restarted.key(self.array, self.angles, 'phase', 240e6)
+        m1 = restarted.get(key)
+        self.assertIsInstance(m1, np.memmap)
+        np.testing.assert_array_equal(m0, m1)
+
+    def test_precompute_band(self):
+        frequencies = np.linspace(220e6, 261e6, 42)
+        for cache_dir in [None, self.cache_dir]:
+            cache = ManifoldCache(bin_width = 1e6, cache_dir = cache_dir)
+            band = cache.precompute_band(self.array, self.angles, frequencies, processes = 2, chunk_bins = 5)
+            self.assertEqual(band.shape, (42, 100, 6))
+            manifold = cache.phase_manifold(self.array, self.angles, frequencies[7])
+            # a view into the band rather than a new entry
+            self.assertEqual(len(cache), 0)
+            np.testing.assert_allclose(
+                manifold,
+                self.array.each_pair_phase_difference_at_angles(self.angles, frequencies[7]))
+
+    def test_precompute_several_bands(self):
+        cache = ManifoldCache(bin_width = 1e6)
+        low = cache.precompute_band(self.array, self.angles, np.linspace(100e6, 109e6, 10), processes = 1)
+        high = cache.precompute_band(self.array, self.angles, np.linspace(300e6, 309e6, 10), processes = 1)
+        # both bands are still used
+        for f, band in [(103e6, low), (305e6, high)]:
+            manifold = cache.phase_manifold(self.array, self.angles, f)
+            self.assertTrue(np.may_share_memory(manifold, band))
+            np.testing.assert_allclose(manifold, self.array.each_pair_phase_difference_at_angles(self.angles, f))
+        self.assertEqual(len(cache), 0)
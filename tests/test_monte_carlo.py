@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from directionFinder_backend.monte_carlo import MonteCarloRunner
+from directionFinder_backend.signal_generator import SignalGenerator
+
+def noisy_phase(snr, rng):
+    siggen = SignalGenerator(tone_freq = 0.2002, num_channels = 2, snr = snr,
+                             phase_shifts = np.array((1.0, 0)), amplitude_scales = np.ones(2),
+                             samples = 64, rng = rng)
+    vacc = siggen.accumulate_crosses(20, bins = [siggen.bin_index(0.2002)])
+    return np.angle(vacc[:, 0, 0])
+
+class MonteCarloRunnerTester(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_pool_matches_serial(self):
+        serial = MonteCarloRunner(noisy_phase, [1, 0.1], 3, 20, seed = 5, processes = 1).run()
+        pooled = MonteCarloRunner(noisy_phase, [1, 0.1], 3, 20, seed = 5, processes = 2).run()
+        np.testing.assert_array_equal(serial, pooled)
+        # every task has its own stream
+        self.assertFalse(np.array_equal(serial[0, 0], serial[0, 1]))
+        self.assertFalse(np.array_equal(serial[0, 0], serial[1, 0]))
+
+    def test_resume(self):
+        results_file = os.path.join(self.path, 'results.npy')
+        runner = MonteCarloRunner(noisy_phase, [1, 0.1], 3, 20, processes = 1, results_file = results_file)
+        runner.run()
+        expected = np.array(runner.results)
+        # forget a run as if the sweep had been interrupted
+        runner.done[1, 2] = False
+        runner.results[1, 2] = 0
+        runner.flush()
+        del runner
+        resumed = MonteCarloRunner(noisy_phase, [1, 0.1], 3, 20, processes = 1, results_file = results_file)
+        self.assertEqual(len(resumed.tasks()), 1)
+        np.testing.assert_array_equal(resumed.run(), expected)
+        rms = resumed.rms_error(1.0)
+        self.assertEqual(rms.shape, (2, 20))
+        # the stronger signal ends up closer
+        self.assertLess(rms[0, -1], rms[1, -1])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import unittest
+import threading
+import time
+from directionFinder_backend.pipeline import Pipeline, Stage
+
+class StageTester(unittest.TestCase):
+    def test_drops_when_full(self):
+        processed = []
+        stage = Stage('df', processed.append, maxsize = 2, block = False)
+        # not started, so nothing is taken off the queue
+        accepted = [stage.put(frame) for frame in range(5)]
+        self.assertEqual(accepted, [True, True, False, False, False])
+        self.assertEqual(stage.dropped, 3)
+        stage.start()
+        stage.stop()
+        self.assertEqual(processed, [0, 1])
+        self.assertEqual(stage.stats(), {'processed': 2, 'dropped': 3, 'errors': 0, 'queued': 0})
+
+    def test_backpressure(self):
+        processed = []
+        stage = Stage('recorder', processed.append, maxsize = 1, block = True)
+        stage.put(0)
+        putter = threading.Thread(target = stage.put, args = (1, ))
+        putter.daemon = True
+        putter.start()
+        putter.join(0.1)
+        # held up until the stage makes room
+        self.assertTrue(putter.is_alive())
+        stage.start()
+        putter.join(5)
+        self.assertFalse(putter.is_alive())
+        stage.stop()
+        self.assertEqual(processed, [0, 1])
+        self.assertEqual(stage.dropped, 0)
+
+    def test_counts_errors(self):
+        def fail(frame):
+            raise ValueError(frame)
+        stage = Stage('df', fail)
+        stage.start()
+        stage.put(0)
+        stage.stop()
+        self.assertEqual(stage.errors, 1)
+        self.assertFalse(stage.thread.is_alive())
+
+
+class PipelineTester(unittest.TestCase):
+    def source(self, frames, end):
+        """ acquire function which hands out frames, with a None for nothing
+        acquired in between, and then raises end
+        """
+        frames = list(frames)
+        def acquire():
+            if len(frames) == 0:
+                raise end
+            frame = frames.pop(0)
+            return frame
+        return acquire
+
+    def run_pipeline(self, end):
+        recorded = []
+        dfed = []
+        def slow_df(frame):
+            time.sleep(0.01)
+            dfed.append(frame)
+        stages = [Stage('recorder', recorded.append, block = True),
+                  Stage('df', slow_df, maxsize = 1, block = False)]
+        pipeline = Pipeline(self.source([0, None, 1, 2, None, 3, 4], end), stages)
+        pipeline.run()
+        self.assertFalse(pipeline.thread.is_alive())
+        for stage in stages:
+            self.assertFalse(stage.thread.is_alive())
+        self.assertEqual(pipeline.acquired, 5)
+        # every frame is recorded. The DF stage saw whatever it didn't drop.
+        self.assertEqual(recorded, [0, 1, 2, 3, 4])
+        self.assertEqual(len(dfed) + stages[1].dropped, 5)
+        self.assertEqual(dfed, sorted(dfed))
+
+    def test_stops_when_source_ends(self):
+        self.run_pipeline(StopIteration())
+
+    def test_stops_when_acquire_fails(self):
+        self.run_pipeline(IOError("ROACH went away"))
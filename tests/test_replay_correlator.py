@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import unittest
+import shutil
+import tempfile
+import numpy as np
+from directionFinder_backend.correlator import Correlator
+from directionFinder_backend.replay_correlator import ReplayCorrelator
+from directionFinder_backend.session_recorder import SessionRecorder
+from directionFinder_backend.frame import FrequencyFrame, ImpulseFrame
+from fake_fpga import FakeRoach
+
+class ReplayCorrelatorTester(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.correlator = Correlator(fpga_client = FakeRoach().connect)
+        combs = self.correlator.cross_combinations
+        bins = np.linspace(0, 400e6, 16, endpoint = False)
+        rng = np.random.RandomState(0)
+        # times with more digits than str keeps, as time.time() gives
+        self.frequency_frames = [FrequencyFrame(1760711000.123456 + idx, combs,
+                                                rng.randint(-2**20, 2**20, (len(combs), 16)) +
+                                                1j*rng.randint(-2**20, 2**20, (len(combs), 16)),
+                                                bins, acc_len = 100)
+                                 for idx in range(3)]
+        # float32 valued so sessions store them exactly
+        self.impulse_frames = [ImpulseFrame(1760711100.654321 + idx,
+                                            rng.randint(-128, 128, (4, length)).astype(np.float32),
+                                            impulse_length = length // 4)
+                               for idx, length in enumerate([400, 64, 1000])]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def record_session(self, frames):
+        recorder = SessionRecorder(self.path, session = 'session')
+        for frame in frames:
+            recorder.record(frame)
+        recorder.close()
+
+    def check_frequency_replay(self):
+        replay = ReplayCorrelator(self.path)
+        for frame in self.frequency_frames:
+            replay.fetch_crosses()
+            np.testing.assert_array_equal(replay.crosses, frame.crosses)
+            self.assertAlmostEqual(replay.frequency_frame().t, frame.t, delta = 0.01)
+        self.assertRaises(StopIteration, replay.fetch_crosses)
+
+    def check_impulse_replay(self, impulse_lengths=True):
+        replay = ReplayCorrelator(self.path)
+        for frame in self.impulse_frames:
+            if impulse_lengths == True:
+                self.assertEqual(replay.read_impulse_length(), frame.impulse_length)
+            self.assertTrue(replay.impulse_fetch())
+            np.testing.assert_array_equal(replay.time_domain_signals, frame.time_domain_signals)
+            self.assertAlmostEqual(replay.impulse_frame().t, frame.t, delta = 0.01)
+        self.assertRaises(StopIteration, replay.impulse_fetch)
+
+    def test_frequency_session(self):
+        self.record_session(self.frequency_frames)
+        self.check_frequency_replay()
+
+    def test_frequency_directories(self):
+        for frame in self.frequency_frames:
+            self.correlator.save_frequency_correlations(self.path, frame)
+        self.check_frequency_replay()
+
+    def test_impulse_session(self):
+        self.record_session(self.impulse_frames)
+        self.check_impulse_replay()
+
+    def test_impulse_directories(self):
+        for frame in self.impulse_frames:
+            self.correlator.save_time_domain_snapshots(self.path, frame)
+        # directories don't keep the impulse length
+        self.check_impulse_replay(impulse_lengths = False)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import unittest
+import shutil
+import tempfile
+import time
+import numpy as np
+from directionFinder_backend.results_writer import ResultsWriter, load_results
+
+class ResultsWriterTester(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_text_format(self):
+        writer = ResultsWriter(self.log_dir)
+        writer.write(1.5, 0.25, frequency = 240e6, quality = 0.1)
+        writer.write(2.5, -1.0)
+        writer.close()
+        with open("{d}/results.txt".format(d = self.log_dir)) as f:
+            self.assertEqual(f.read(), "1.5,240000000.0,0.25\n2.5,-1.0\n")
+
+    def test_flushes_when_full(self):
+        writer = ResultsWriter(self.log_dir, binary = True, flush_rows = 10, flush_interval = 1000)
+        for idx in range(10):
+            writer.write(float(idx), 0.0, frequency = 1.0)
+        # the background thread flushes without waiting for flush_interval
+        for attempt in range(500):
+            if writer.written == 10:
+                break
+            time.sleep(0.01)
+        self.assertEqual(writer.written, 10)
+        writer.close()
+
+    def test_binary_columns(self):
+        writer = ResultsWriter(self.log_dir, binary = True, flush_rows = 3)
+        for idx in range(7):
+            writer.write(float(idx), idx / 10.0, frequency = 100.0 + idx, quality = 2.0*idx)
+        writer.write(7.0, 0.7)
+        writer.close()
+        results = load_results(self.log_dir)
+        np.testing.assert_array_equal(results['t'], np.arange(8))
+        np.testing.assert_allclose(results['aoa'], np.arange(8) / 10.0)
+        np.testing.assert_array_equal(results['frequency'][0:7], 100.0 + np.arange(7))
+        self.assertTrue(np.isnan(results['frequency'][7]))
+        self.assertTrue(np.isnan(results['quality'][7]))
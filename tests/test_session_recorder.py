@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from directionFinder_backend.session_recorder import SessionRecorder, SessionReader
+from directionFinder_backend.frame import FrequencyFrame, ImpulseFrame
+
+class SessionRecorderTester(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.combs = [(0, 1), (0, 2), (1, 2)]
+        self.bins = np.linspace(0, 400e6, 8, endpoint = False)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def frequency_frame(self, t):
+        crosses = (np.arange(24) + 1j*t).reshape(3, 8)
+        return FrequencyFrame(t, self.combs, crosses, self.bins, acc_len = 100,
+                              overflows = {'adc': t % 2 == 0, 'acc': False, 'fft': False})
+
+    def test_frequency_round_trip_with_rotation(self):
+        recorder = SessionRecorder(self.path, session = 'test', fsync_interval = 0)
+        # room for 3 records per file
+        recorder.max_bytes = 3 * (8 + 8 + 1 + 3*8*16)
+        for t in range(7):
+            recorder.record(self.frequency_frame(t))
+        recorder.close()
+        self.assertEqual(len(recorder.index['files']), 3)
+        reader = SessionReader("{p}/test.json".format(p = self.path))
+        self.assertEqual(len(reader), 7)
+        np.testing.assert_array_equal(reader.times(), np.arange(7))
+        for t, frame in enumerate(reader.frames()):
+            np.testing.assert_array_equal(frame.crosses, self.frequency_frame(t).crosses)
+            self.assertEqual(frame.overflows['adc'], t % 2 == 0)
+            self.assertEqual(frame.acc_len, 100)
+            self.assertEqual(frame.cross_combinations, self.combs)
+        self.assertIsInstance(reader.files[0], np.memmap)
+
+    def test_reader_only_sees_synced_records(self):
+        recorder = SessionRecorder(self.path, session = 'test', fsync_interval = 1e6)
+        recorder.record(self.frequency_frame(0))
+        recorder.sync()
+        recorder.record(self.frequency_frame(1))
+        self.assertEqual(len(SessionReader("{p}/test.json".format(p = self.path))), 1)
+
+    def test_impulse_round_trip(self):
+        recorder = SessionRecorder(self.path, session = 'impulses', max_samples = 100)
+        signals = np.random.RandomState(0).normal(size = (4, 60)).astype(np.float32)
+        recorder.record(ImpulseFrame(5.0, signals, impulse_length = 12))
+        recorder.record(ImpulseFrame(6.0, np.ones((4, 150), dtype = np.float32)))
+        recorder.close()
+        reader = SessionReader("{p}/impulses.json".format(p = self.path))
+        frame = reader.frame(0)
+        np.testing.assert_array_equal(frame.time_domain_signals, signals)
+        self.assertEqual(frame.impulse_length, 12)
+        self.assertEqual(reader.frame(-1).time_domain_signals.shape, (4, 100))
+
+    def test_impulses_take_their_own_length(self):
+        recorder = SessionRecorder(self.path, session = 'impulses', fsync_interval = 0)
+        # room for about three of the signals per payload file
+        recorder.max_bytes = 3 * 4 * 4 * 200
+        rng = np.random.RandomState(1)
+        signals = [rng.normal(size = (4, length)).astype(np.float32) for length in [200, 7, 2**12, 0, 150, 33]]
+        for t, signal in enumerate(signals):
+            recorder.record(ImpulseFrame(float(t), signal))
+        recorder.close()
+        payloads = [os.path.join(self.path, entry['payload']) for entry in recorder.index['files']]
+        self.assertEqual(len(payloads), 3)
+        # only what the signals need, aligned to 8 bytes
+        self.assertEqual(sum(os.path.getsize(payload) for payload in payloads),
+                         sum((signal.nbytes + 7) // 8 * 8 for signal in signals))
+        reader = SessionReader("{p}/impulses.json".format(p = self.path))
+        self.assertEqual(len(reader), len(signals))
+        for signal, frame in zip(signals, reader.frames()):
+            np.testing.assert_array_equal(frame.time_domain_signals, signal)
+            self.assertEqual(frame.time_domain_signals.dtype, np.float32)
+
+    def test_codec(self):
+        recorder = SessionRecorder(self.path, session = 'delta', codec = 'delta')
+        for t in range(3):
+            recorder.record(self.frequency_frame(t))
+        recorder.close()
+        reader = SessionReader("{p}/delta.json".format(p = self.path))
+        for t, frame in enumerate(reader.frames()):
+            np.testing.assert_array_equal(frame.crosses, self.frequency_frame(t).crosses)
+
+    def test_compressed_payloads(self):
+        recorder = SessionRecorder(self.path, session = 'shuffle', codec = 'shuffle')
+        frames = [self.frequency_frame(t) for t in range(3)]
+        # not integers, as though calibrated
+        frames[1].crosses = frames[1].crosses * (1.7 + 2.4j)
+        for frame in frames:
+            recorder.record(frame)
+        recorder.close()
+        entry = recorder.index['files'][0]
+        self.assertEqual(os.path.getsize(os.path.join(self.path, entry['payload'])), entry['payload_bytes'])
+        reader = SessionReader("{p}/shuffle.json".format(p = self.path))
+        self.assertEqual(entry['payload_bytes'], sum((int(reader[idx]['length']) + 7) // 8 * 8 for idx in range(3)))
+        for frame, read in zip(frames, reader.frames()):
+            np.testing.assert_array_equal(read.crosses, frame.crosses)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend.signal_generator import SignalGenerator
+
+class SignalGeneratorTester(unittest.TestCase):
+    def setUp(self):
+        self.siggen = SignalGenerator(tone_freq = 0.2002, num_channels = 3, snr = 0.1,
+                                      phase_shifts = np.array((1.234, 0, 0.5)),
+                                      amplitude_scales = np.ones(3), samples = 256)
+
+    def test_batch_matches_single(self):
+        np.random.seed(1)
+        crosses = self.siggen.fetch_crosses_batch(3)
+        self.assertEqual(crosses.shape, (3, 3, 129))
+        np.random.seed(1)
+        for integration in range(3):
+            self.siggen.fetch_crosses()
+            for idx, comb in enumerate(self.siggen.cross_combinations):
+                np.testing.assert_allclose(crosses[integration, idx],
+                                           self.siggen.frequency_correlations[comb].signal)
+
+    def test_accumulate_in_chunks(self):
+        f_bin = self.siggen.bin_index(0.2002)
+        np.random.seed(2)
+        accumulated = self.siggen.accumulate_crosses(10, bins = [f_bin], chunk_size = 3)
+        self.assertEqual(accumulated.shape, (10, 3, 1))
+        np.random.seed(2)
+        vacc = 0
+        for integration in range(10):
+            self.siggen.fetch_crosses()
+            vacc += self.siggen.frequency_correlations[(0, 1)].bin_at_freq(0.2002)
+            self.assertAlmostEqual(accumulated[integration, 0, 0], vacc)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+from directionFinder_backend.spectrum_codec import SpectrumCodec, CODECS
+
+class SpectrumCodecTester(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.shape = (6, 512)
+        # smooth, large accumulator values like the FPGA gives
+        smooth = np.cumsum(rng.randint(-1000, 1000, (6, 512, 2)), axis = 1) + 2**40
+        self.crosses = smooth[..., 0] + 1j*smooth[..., 1]
+        self.crosses[0, 0] = -2**52 + 1j*(2**52)
+
+    def round_trip(self, name, crosses=None):
+        if crosses is None:
+            crosses = self.crosses
+        codec = SpectrumCodec(name)
+        record = np.zeros((), dtype = codec.fields(*self.shape))
+        payload = codec.encode_into(record, crosses)
+        if codec.compressed == True:
+            self.assertLessEqual(len(payload), codec.payload_bound(*self.shape))
+        return codec.decode(record, self.shape, payload), record
+
+    def test_lossless(self):
+        for name in ['complex128', 'raw', 'shuffle', 'delta']:
+            decoded, record = self.round_trip(name)
+            np.testing.assert_array_equal(decoded, self.crosses)
+            self.assertEqual(decoded.dtype, np.complex128)
+
+    def test_lossless_when_not_integers(self):
+        # calibrated spectra, NaNs and values too big for int64 are kept as floats
+        crosses = self.crosses * (1.7 + 2.4j)
+        crosses[1, 3] = np.nan
+        crosses[2, 5] = 1e30 - 1e30j
+        for name in ['raw', 'shuffle', 'delta']:
+            decoded, record = self.round_trip(name, crosses)
+            np.testing.assert_array_equal(decoded, crosses)
+            self.assertEqual(record['floats'], True)
+            # and integers are still stored as integers
+            self.assertEqual(self.round_trip(name)[1]['floats'], False)
+
+    def test_compresses(self):
+        raw = self.shape[0] * self.shape[1] * 16
+        shuffled = self.round_trip('shuffle')[1]['length']
+        delta = self.round_trip('delta')[1]['length']
+        self.assertLess(shuffled, raw)
+        self.assertLess(delta, shuffled)
+
+    def test_lossy(self):
+        for name, tolerance in [('float32', 1e-7), ('float16', 1e-3)]:
+            decoded = self.round_trip(name)[0]
+            error = np.abs(decoded - self.crosses) / np.max(np.abs(self.crosses), axis = 1)[:, np.newaxis]
+            self.assertLess(np.max(error), tolerance)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, SpectrumCodec, 'gzip')
+        self.assertEqual(len(CODECS), 6)